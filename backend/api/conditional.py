@@ -0,0 +1,53 @@
+from hashlib import md5
+
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+from recipes.models import User
+
+
+def get_viewer_state(user):
+    """Версия избранного, корзины и подписок пользователя.
+
+    User.relations_version увеличивается при каждом их изменении: API
+    меняет её вместе со счётчиками, правки в обход API (админка,
+    каскадное удаление) — сигналы из recipes.signals. Читается отдельным
+    запросом, а не из request.user, загруженного при аутентификации.
+    Версии разных пользователей совпадают, поэтому в состояние входит
+    и id пользователя.
+    """
+    if user.is_anonymous:
+        return ()
+    return (user.pk, *User.objects.filter(pk=user.pk).values_list(
+        'relations_version', flat=True
+    ))
+
+
+def conditional_response(
+    request, get_response, *version, last_modified=None
+):
+    """Отвечает 304, если у клиента актуальная версия ответа.
+
+    version — дешёвые валидаторы содержимого, из которых вместе с адресом
+    запроса строится ETag; get_response вызывается только при промахе.
+    Last-Modified отдаётся лишь анонимам: для остальных ответ зависит
+    ещё и от их избранного и подписок, у которых нет дат изменения.
+    """
+    etag = quote_etag(
+        md5(
+            repr((request.get_full_path(), version)).encode()
+        ).hexdigest()
+    )
+    if not request.user.is_anonymous:
+        last_modified = None
+    timestamp = last_modified and int(last_modified.timestamp())
+    response = get_conditional_response(
+        request, etag=etag, last_modified=timestamp
+    )
+    if response is None:
+        response = get_response()
+    response["ETag"] = etag
+    if timestamp:
+        response["Last-Modified"] = http_date(timestamp)
+    patch_vary_headers(response, ("Authorization",))
+    return response
@@ -0,0 +1,167 @@
+from hashlib import md5
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db.models.signals import post_delete
+from django.dispatch import receiver
+
+from recipes.models import Favorite, Recipe, ShoppingCart
+from .loaders import SubscriptionLoader
+from .serializers import RecipeReadSerializer
+
+KEY_PREFIX = "recipe_feed"
+STATS = ("page_hits", "page_misses", "fragment_hits", "fragment_misses")
+VIEWER_FILTERS = ("is_favorited", "is_in_shopping_cart")
+
+
+class RecipeFeedCache:
+    """Двухуровневый кэш ленты рецептов.
+
+    Первый уровень — id рецептов страницы, ключ строится из адреса запроса
+    и версии рецептов (recipes.versions), поэтому любое изменение рецептов
+    даёт новый ключ сразу после фиксации транзакции. Второй уровень — готовые
+    представления рецептов по ключу (id, updated_at). Флаги, зависящие от
+    зрителя, и абсолютные ссылки на изображения подставляются в каждом
+    запросе.
+
+    Сохранение рецепта, изменение его продуктов или автора меняют
+    updated_at (см. recipes.signals), а с ним и ключи обоих уровней;
+    фрагмент удалённого рецепта удаляется сигналом.
+    """
+
+    def can_cache(self, request):
+        # Курсорная выдача дешева сама по себе и в кэше не нуждается.
+        return "cursor" not in request.query_params and not any(
+            request.query_params.get(name) for name in VIEWER_FILTERS
+        )
+
+    def get_page(self, view, recipes, version):
+        request = view.request
+        page_key = self.make_key(
+            "page", request.build_absolute_uri(), *version
+        )
+        page = cache.get(page_key)
+        self.count("page_hits" if page else "page_misses")
+        if page is None:
+            page = self.build_page(view, recipes)
+            cache.set(page_key, page, settings.RECIPE_FEED_PAGE_TIMEOUT)
+        results = self.get_fragments(request, recipes, page.pop("items"))
+        self.merge_viewer_flags(request, results)
+        return {**page, "results": results}
+
+    def build_page(self, view, recipes):
+        page = view.paginate_queryset(recipes)
+        paginator = view.paginator
+        return {
+            "count": paginator.page.paginator.count,
+            "next": paginator.get_next_link(),
+            "previous": paginator.get_previous_link(),
+            "items": [
+                (recipe.id, recipe.updated_at.timestamp())
+                for recipe in page
+            ],
+        }
+
+    def get_fragment_key(self, recipe_id, version):
+        return self.make_key("fragment", recipe_id, version)
+
+    def get_fragments(self, request, recipes, items):
+        keys = {
+            recipe_id: self.get_fragment_key(recipe_id, version)
+            for recipe_id, version in items
+        }
+        fragments = cache.get_many(keys.values())
+        missing = [
+            recipe_id for recipe_id, key in keys.items()
+            if key not in fragments
+        ]
+        self.count("fragment_hits", len(keys) - len(missing))
+        self.count("fragment_misses", len(missing))
+        if missing:
+            # Без request сериализатор отдаёт флаги зрителя False и
+            # относительные ссылки на изображения.
+            rendered = {
+                keys[recipe["id"]]: recipe
+                for recipe in RecipeReadSerializer(
+                    recipes.with_user_flags(AnonymousUser())
+                    .filter(id__in=missing),
+                    many=True,
+                ).data
+            }
+            cache.set_many(rendered, settings.RECIPE_FEED_FRAGMENT_TIMEOUT)
+            fragments.update(rendered)
+        return [dict(fragments[keys[recipe_id]]) for recipe_id, _ in items]
+
+    def merge_viewer_flags(self, request, results):
+        user = request.user
+        recipe_ids = [recipe["id"] for recipe in results]
+        favorited = cart = set()
+        if not user.is_anonymous:
+            favorited = set(Favorite.objects.filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list("recipe_id", flat=True))
+            cart = set(ShoppingCart.objects.filter(
+                user=user, recipe_id__in=recipe_ids
+            ).values_list("recipe_id", flat=True))
+        loader = SubscriptionLoader.for_request(request)
+        loader.load_ids(recipe["author"]["id"] for recipe in results)
+        for recipe in results:
+            author = dict(recipe["author"])
+            author["is_subscribed"] = loader.flags[author["id"]]
+            if author["avatar"]:
+                author["avatar"] = request.build_absolute_uri(
+                    author["avatar"]
+                )
+            author["avatar_variants"] = self.absolute_variants(
+                request, author["avatar_variants"]
+            )
+            recipe["author"] = author
+            recipe["image"] = request.build_absolute_uri(recipe["image"])
+            recipe["image_variants"] = self.absolute_variants(
+                request, recipe["image_variants"]
+            )
+            recipe["is_favorited"] = recipe["id"] in favorited
+            recipe["is_in_shopping_cart"] = recipe["id"] in cart
+
+    def absolute_variants(self, request, variants):
+        return {
+            variant: {
+                image_format: request.build_absolute_uri(url)
+                for image_format, url in formats.items()
+            }
+            for variant, formats in variants.items()
+        }
+
+    def make_key(self, kind, *parts):
+        digest = md5(repr(parts).encode()).hexdigest()
+        return f"{KEY_PREFIX}:{kind}:{digest}"
+
+    def count(self, stat, delta=1):
+        if not delta:
+            return
+        key = f"{KEY_PREFIX}:stats:{stat}"
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, delta)
+        except ValueError:
+            cache.set(key, delta, None)
+
+    def get_stats(self):
+        values = cache.get_many(
+            [f"{KEY_PREFIX}:stats:{stat}" for stat in STATS]
+        )
+        return {
+            stat: values.get(f"{KEY_PREFIX}:stats:{stat}", 0)
+            for stat in STATS
+        }
+
+
+feed_cache = RecipeFeedCache()
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    cache.delete(feed_cache.get_fragment_key(
+        instance.id, instance.updated_at.timestamp()
+    ))
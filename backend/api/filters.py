@@ -1,15 +1,47 @@
+from collections import defaultdict
+
+from django.db.models import Case, F, IntegerField, Value, When
 from django_filters import rest_framework as filters
 
 from recipes.models import Ingredient, Recipe
+from recipes.pantry_index import pantry_index
+from recipes.search import search_recipes
+
+PANTRY_MAX_RESULTS = 1000
+PANTRY_DEFAULT_MISSING = 2
+PANTRY_MAX_MISSING = 10
+# Недостающий продукт весит больше любого числа имеющихся
+PANTRY_MISSING_WEIGHT = 1000
+# Аннотации, по которым фильтры рецептов задают порядок, от старшей:
+# явная сортировка (ordering) важнее подбора по продуктам (pantry), подбор —
+# релевантности поиска (search). Младшие упорядочивают равные по старшим.
+RANK_ANNOTATIONS = ('score_rank', 'pantry_rank', 'search_rank')
+
+
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    pass
 
 
 class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', lookup_expr='istartswith')
+    name = filters.CharFilter(method='filter_name')
 
     class Meta:
         model = Ingredient
         fields = ('name',)
 
+    def filter_name(self, ingredients, name, value):
+        # Совпадения с начала названия выше совпадений в середине.
+        # На PostgreSQL оба условия обслуживаются индексами по UPPER(name)
+        # (text_pattern_ops и pg_trgm), см. миграцию 0003.
+        return (
+            ingredients.filter(name__icontains=value)
+            .annotate(search_rank=Case(
+                When(name__istartswith=value, then=Value(0)),
+                default=Value(1),
+            ))
+            .order_by('search_rank', 'name')
+        )
+
 
 class RecipeFilter(filters.FilterSet):
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
@@ -17,10 +49,36 @@ class RecipeFilter(filters.FilterSet):
         method='filter_is_in_shopping_cart'
     )
     author = filters.NumberFilter(field_name='author__id')
+    search = filters.CharFilter(method='filter_search')
+    pantry = NumberInFilter(method='filter_pantry')
+    missing = filters.NumberFilter(
+        method='filter_missing', min_value=0, max_value=PANTRY_MAX_MISSING
+    )
+    ordering = filters.ChoiceFilter(
+        choices=(
+            ('popular', 'Популярные'),
+            ('trending', 'Набирают популярность'),
+        ),
+        method='filter_ordering',
+    )
 
     class Meta:
         model = Recipe
-        fields = ('author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'author', 'is_favorited', 'is_in_shopping_cart', 'search',
+            'pantry', 'missing', 'ordering',
+        )
+
+    def filter_queryset(self, recipes):
+        recipes = super().filter_queryset(recipes)
+        ranks = [
+            f'-{name}' for name in RANK_ANNOTATIONS
+            if name in recipes.query.annotations
+        ]
+        if ranks:
+            # Этот порядок — и ключ курсора (RecipePagination).
+            recipes = recipes.order_by(*ranks, '-id')
+        return recipes
 
     def filter_is_favorited(self, recipes, name, value):
         user = self.request.user
@@ -33,3 +91,49 @@ class RecipeFilter(filters.FilterSet):
         if value and user.is_authenticated:
             return recipes.filter(shopping_carts__user=user)
         return recipes
+
+    def filter_search(self, recipes, name, value):
+        # Сначала самые релевантные, см. filter_queryset.
+        return search_recipes(recipes, value)
+
+    def filter_pantry(self, recipes, name, value):
+        """Рецепты из имеющихся продуктов (id через запятую).
+
+        Подходят рецепты, которым не хватает не больше missing продуктов
+        (по умолчанию PANTRY_DEFAULT_MISSING); сначала те, для которых
+        есть всё, затем с одним недостающим и так далее (аннотация
+        pantry_rank, см. filter_queryset). Подбор идёт по индексу в памяти
+        (recipes.pantry_index), в запрос попадают только
+        PANTRY_MAX_RESULTS лучших рецептов.
+        """
+        max_missing = self.form.cleaned_data.get('missing')
+        if max_missing is None:
+            max_missing = PANTRY_DEFAULT_MISSING
+        matches = pantry_index.match(
+            {int(pk) for pk in value}, int(max_missing), PANTRY_MAX_RESULTS
+        )
+        if not matches:
+            return recipes.none()
+        ranks = defaultdict(list)
+        for missing, matched, recipe_id in matches:
+            ranks[matched - missing * PANTRY_MISSING_WEIGHT].append(recipe_id)
+        return (
+            recipes.filter(id__in=[recipe_id for *_, recipe_id in matches])
+            .annotate(pantry_rank=Case(
+                *(
+                    When(id__in=recipe_ids, then=Value(rank))
+                    for rank, recipe_ids in ranks.items()
+                ),
+                output_field=IntegerField(),
+            ))
+        )
+
+    def filter_missing(self, recipes, name, value):
+        # Учитывается в filter_pantry
+        return recipes
+
+    def filter_ordering(self, recipes, name, value):
+        # Оценки заранее посчитаны в RecipeScore (recipes.scores).
+        return recipes.filter(score__isnull=False).annotate(
+            score_rank=F(f'score__{value}')
+        )
@@ -0,0 +1,49 @@
+from recipes.models import Subscription
+
+
+class SubscriptionLoader:
+    """Флаги подписки текущего пользователя, запомненные на время запроса.
+
+    Подписки загружаются пачкой для всех авторов страницы одним запросом,
+    после чего сериализаторы только читают готовый результат.
+    """
+
+    request_attr = "_subscription_loader"
+
+    def __init__(self, user):
+        self.user = user
+        self.flags = {}
+
+    @classmethod
+    def for_request(cls, request):
+        loader = getattr(request, cls.request_attr, None)
+        if loader is None:
+            loader = cls(request.user)
+            setattr(request, cls.request_attr, loader)
+        return loader
+
+    def load(self, authors):
+        self.load_ids(author.id for author in authors)
+
+    def load_ids(self, author_ids):
+        author_ids = set(author_ids) - self.flags.keys()
+        if not author_ids:
+            return
+        if self.user.is_anonymous:
+            subscribed_ids = set()
+        else:
+            subscribed_ids = set(
+                Subscription.objects.filter(
+                    subscriber=self.user, author_id__in=author_ids
+                ).values_list("author_id", flat=True)
+            )
+        for author_id in author_ids:
+            self.flags[author_id] = author_id in subscribed_ids
+
+    def mark_subscribed(self, authors):
+        for author in authors:
+            self.flags[author.id] = True
+
+    def is_subscribed(self, author):
+        self.load([author])
+        return self.flags[author.id]
@@ -0,0 +1,159 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.query_plans import (
+    HOT_QUERIES,
+    find_full_scans,
+    get_plan,
+    get_sample,
+)
+from recipes import timeline
+from recipes.models import (
+    Favorite,
+    ImageJob,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Subscription,
+    User,
+)
+from recipes.search import update_search_index
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Проверяет планы частых запросов API (EXPLAIN) и сообщает "
+        "о полных просмотрах таблиц"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--no-seed",
+            action="store_true",
+            help="Проверять на текущих данных, без синтетических",
+        )
+        parser.add_argument("--users", type=int, default=200)
+        parser.add_argument("--recipes", type=int, default=2000)
+        parser.add_argument("--ingredients", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options["no_seed"]:
+            flagged = self.check_plans(options["verbosity"])
+        else:
+            try:
+                with transaction.atomic():
+                    self.seed(options)
+                    flagged = self.check_plans(options["verbosity"])
+                    raise Rollback
+            except Rollback:
+                pass
+        if flagged:
+            raise CommandError(
+                f"Полные просмотры таблиц в запросах: {', '.join(flagged)}"
+            )
+
+    def check_plans(self, verbosity):
+        sample = get_sample()
+        if sample is None:
+            raise CommandError(
+                "Нет данных для построения запросов, запустите без --no-seed"
+            )
+        flagged = []
+        for name, query in HOT_QUERIES.items():
+            if query.vendors and connection.vendor not in query.vendors:
+                continue
+            plan = get_plan(query.build(sample))
+            tables = find_full_scans(plan, query.index_scan)
+            if tables:
+                flagged.append(name)
+                self.stdout.write(self.style.WARNING(
+                    f"{name}: полный просмотр {', '.join(tables)}"
+                ))
+            else:
+                self.stdout.write(f"{name}: OK")
+            if verbosity > 1:
+                self.stdout.write(
+                    plan if isinstance(plan, dict) else "\n".join(plan)
+                )
+        return flagged
+
+    def seed(self, options):
+        started = time.monotonic()
+        prefix = f"plans{int(time.time())}"
+        users = User.objects.bulk_create(
+            User(
+                username=f"{prefix}_{i}",
+                email=f"{prefix}_{i}@example.com",
+                first_name="Plans",
+                last_name=str(i),
+                password="!",
+            )
+            for i in range(options["users"])
+        )
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=user, author=author)
+            for user in users
+            for author in random.sample(users, min(20, len(users)))
+            if author != user
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"{prefix} продукт {i}", measurement_unit="г")
+            for i in range(options["ingredients"])
+        )
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=random.choice(users),
+                    name=f"Рецепт {i}",
+                    text="-",
+                    cooking_time=1,
+                    image="recipes/images/plans.png",
+                )
+                for i in range(options["recipes"])
+            ),
+            batch_size=1000,
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(recipe=recipe, ingredient=ingredient,
+                                 amount=1)
+                for recipe in recipes
+                for ingredient in random.sample(ingredients, 5)
+            ),
+            batch_size=5000,
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                (
+                    model(user=user, recipe=recipe)
+                    for user in users
+                    for recipe in random.sample(recipes, 10)
+                ),
+                batch_size=5000,
+            )
+        ShoppingCartTotal.objects.rebuild()
+        RecipeScore.objects.bulk_create(
+            (RecipeScore(recipe=recipe) for recipe in recipes),
+            batch_size=5000,
+        )
+        ImageJob.objects.bulk_create(
+            ImageJob(model="recipes.recipe", object_id=recipe.pk,
+                     field="image", source=recipe.image.name)
+            for recipe in recipes[:100]
+        )
+        timeline.fan_out(recipes)
+        update_search_index(recipe.pk for recipe in recipes)
+        self.stdout.write(
+            f"Синтетические данные: {len(users)} пользователей, "
+            f"{len(recipes)} рецептов ({time.monotonic() - started:.1f} с)"
+        )
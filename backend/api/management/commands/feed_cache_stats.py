@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from api.feed_cache import feed_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "Показывает попадания и промахи кэша ленты рецептов "
+        "(имеет смысл при общем для процессов кэше)"
+    )
+
+    def handle(self, *args, **options):
+        for stat, value in feed_cache.get_stats().items():
+            self.stdout.write(f"{stat}: {value}")
@@ -0,0 +1,112 @@
+import shutil
+import statistics
+import tempfile
+import time
+from base64 import b64encode
+from io import BytesIO
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from PIL import Image
+from rest_framework.test import APIClient
+
+from recipes.images import render_variants
+from recipes.models import Ingredient, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет время ответа на загрузку рецепта с большим изображением: "
+        "с обработкой в очереди и с обработкой в запросе (как раньше)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--width", type=int, default=4000)
+        parser.add_argument("--height", type=int, default=3000)
+        parser.add_argument("--repeats", type=int, default=5)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root, IMAGE_PROCESSING_MODE="worker"
+            ), transaction.atomic():
+                self.measure(options)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root)
+
+    def make_image(self, width, height):
+        """JPEG с шумом: сжимается примерно как фотография с телефона."""
+        image = Image.merge("RGB", [
+            Image.effect_noise((width, height), sigma)
+            for sigma in (40, 60, 80)
+        ])
+        buffer = BytesIO()
+        image.save(buffer, "JPEG", quality=92)
+        return buffer.getvalue()
+
+    def measure(self, options):
+        prefix = f"upload{int(time.time())}"
+        author = User.objects.create_user(
+            username=prefix,
+            email=f"{prefix}@example.com",
+            password="!",
+            first_name="Upload",
+            last_name="Benchmark",
+        )
+        ingredient = Ingredient.objects.create(
+            name=f"{prefix} продукт", measurement_unit="г"
+        )
+        client = APIClient()
+        client.force_authenticate(author)
+        original = self.make_image(options["width"], options["height"])
+        payload = {
+            "ingredients": [{"id": ingredient.id, "amount": 1}],
+            "image": "data:image/jpeg;base64," + b64encode(original).decode(),
+            "name": "Рецепт",
+            "text": "Описание",
+            "cooking_time": 5,
+        }
+        requests, processing = [], []
+        for _ in range(options["repeats"]):
+            started = time.perf_counter()
+            response = client.post("/api/recipes/", payload, format="json")
+            requests.append(time.perf_counter() - started)
+            if response.status_code != 201:
+                raise CommandError(f"Ответ {response.status_code}")
+            source = response.data["image"].split("/media/", 1)[1]
+            started = time.perf_counter()
+            variants = render_variants(source)
+            processing.append(time.perf_counter() - started)
+
+        self.stdout.write(
+            f"Изображение {options['width']}x{options['height']}, "
+            f"{len(original) / 2 ** 20:.1f} МБ"
+        )
+        for variant, formats in variants.items():
+            sizes = ", ".join(
+                f"{image_format} {default_storage.size(name) / 1024:.0f} КБ"
+                for image_format, name in formats.items()
+            )
+            self.stdout.write(f"  {variant}: {sizes}")
+        request = statistics.median(requests)
+        process = statistics.median(processing)
+        self.stdout.write(
+            f"Ответ с обработкой в очереди: медиана {request * 1000:.0f} мс"
+        )
+        self.stdout.write(
+            f"Обработка изображения: медиана {process * 1000:.0f} мс"
+        )
+        self.stdout.write(
+            f"Ответ с обработкой в запросе: около "
+            f"{(request + process) * 1000:.0f} мс"
+        )
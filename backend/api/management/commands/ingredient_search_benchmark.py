@@ -0,0 +1,92 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.filters import IngredientFilter
+from recipes.ingredient_index import IngredientIndex
+from recipes.models import Ingredient
+
+SYLLABLES = (
+    "ка", "ро", "ми", "са", "ло", "ту", "не", "ва", "ри", "до", "пе", "за",
+)
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает поиск продуктов фильтром IngredientFilter (запрос к БД) "
+        "с индексом в памяти (IngredientIndex) на синтетических названиях"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ingredients", type=int, default=2200)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        try:
+            with transaction.atomic():
+                names = self.seed(rng, options["ingredients"])
+                self.measure(rng, names, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, rng, count):
+        prefix = f"bench{int(time.time())}"
+        names = set()
+        while len(names) < count:
+            names.add("".join(rng.choices(SYLLABLES, k=rng.randint(2, 5))))
+        Ingredient.objects.bulk_create(
+            Ingredient(name=f"{name} {prefix}", measurement_unit="г")
+            for name in names
+        )
+        return sorted(names)
+
+    def measure(self, rng, names, options):
+        index = IngredientIndex()
+        started = time.perf_counter()
+        snapshot = index.build(version=None)
+        self.stdout.write(
+            f"Индекс из {len(snapshot.rows)} продуктов построен за "
+            f"{(time.perf_counter() - started) * 1000:.1f} мс"
+        )
+        queries = []
+        for _ in range(options["queries"]):
+            name = rng.choice(names)
+            start = rng.randrange(0, 3)
+            queries.append(name[start:start + rng.randint(1, 4)])
+
+        def database(query, limit):
+            ingredients = IngredientFilter().filter_name(
+                Ingredient.objects.all(), "name", query
+            ).values_list("id", "name", "measurement_unit")
+            return list(ingredients if limit is None else ingredients[:limit])
+
+        for query in queries[:20]:
+            if set(database(query, None)) != set(snapshot.search(query)):
+                raise CommandError(f"Результаты по {query!r} отличаются")
+
+        for title, search in (
+            ("IngredientFilter", database),
+            ("IngredientIndex", snapshot.search),
+        ):
+            for limit in (options["limit"], None):
+                timings = []
+                for query in queries:
+                    started = time.perf_counter()
+                    search(query, limit)
+                    timings.append(time.perf_counter() - started)
+                self.stdout.write(
+                    f"{title}, limit={limit}: медиана "
+                    f"{statistics.median(timings) * 1e6:.0f} мкс, максимум "
+                    f"{max(timings) * 1e6:.0f} мкс"
+                )
@@ -0,0 +1,151 @@
+import random
+import statistics
+import time
+import tracemalloc
+from io import BytesIO
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from api.parsers import ORJSONParser
+from api.renderers import ORJSONRenderer, orjson
+from recipes import timeline
+from recipes.models import (
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    Subscription,
+    User,
+)
+
+PAGE_SIZE = 30
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает JSONRenderer/JSONParser с ORJSONRenderer/ORJSONParser "
+        "по времени и памяти на ответах ленты, списка продуктов и подписок"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--ingredients", type=int, default=2000)
+        parser.add_argument("--repeats", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if orjson is None:
+            self.stdout.write(self.style.WARNING(
+                "orjson не установлен, ORJSONRenderer работает как "
+                "JSONRenderer"
+            ))
+        try:
+            with transaction.atomic():
+                payloads = self.get_payloads(self.seed(options))
+                for title, data in payloads.items():
+                    self.measure(title, data, options["repeats"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        prefix = f"render{int(time.time())}"
+        viewer, *authors = User.objects.bulk_create(
+            User(
+                username=f"{prefix}_{i}",
+                email=f"{prefix}_{i}@example.com",
+                first_name="Render",
+                last_name=str(i),
+                password="!",
+            )
+            for i in range(PAGE_SIZE + 1)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=viewer, author=author)
+            for author in authors
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"{prefix} продукт {i}", measurement_unit="г")
+            for i in range(options["ingredients"])
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=f"Рецепт {i}",
+                text="Описание рецепта. " * 30,
+                cooking_time=i + 1,
+                image=f"recipes/images/{prefix}_{i}.png",
+            )
+            for i, author in enumerate(authors * 3)
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in recipes
+            for ingredient in random.sample(ingredients, 8)
+        )
+        timeline.fan_out(recipes)
+        return viewer
+
+    def get_payloads(self, viewer):
+        """Данные ответов API до рендеринга (Response.data)."""
+        client = APIClient()
+        client.force_authenticate(viewer)
+        payloads = {}
+        for title, path in (
+            ("Лента", f"/api/recipes/feed/?limit={PAGE_SIZE}"),
+            ("Продукты", "/api/ingredients/"),
+            (
+                "Подписки",
+                f"/api/users/subscriptions/?limit={PAGE_SIZE}"
+                "&recipes_limit=3",
+            ),
+        ):
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"{path}: ответ {response.status_code}")
+            payloads[title] = response.data
+        return payloads
+
+    def measure(self, title, data, repeats):
+        rendered = {}
+        for renderer in (JSONRenderer(), ORJSONRenderer()):
+            rendered[type(renderer).__name__] = self.report(
+                type(renderer).__name__,
+                lambda: renderer.render(data, "application/json"),
+                repeats,
+                title,
+            )
+        outputs = set(rendered.values())
+        if len(outputs) != 1:
+            raise CommandError(f"{title}: вывод рендереров отличается")
+        body = outputs.pop()
+        for parser in (JSONParser(), ORJSONParser()):
+            self.report(
+                type(parser).__name__,
+                lambda: parser.parse(BytesIO(body)),
+                repeats,
+                title,
+            )
+
+    def report(self, name, call, repeats, title):
+        timings = []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            result = call()
+            timings.append(time.perf_counter() - started)
+        tracemalloc.start()
+        call()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        size = f", {len(result)} байт" if isinstance(result, bytes) else ""
+        self.stdout.write(
+            f"{title}, {name}: медиана "
+            f"{statistics.median(timings) * 1e6:.0f} мкс, пик памяти "
+            f"{peak / 1024:.0f} КБ{size}"
+        )
+        return result
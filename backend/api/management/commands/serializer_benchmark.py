@@ -0,0 +1,203 @@
+import random
+import statistics
+import time
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api import representations
+from api.loaders import SubscriptionLoader
+from api.representations import represent_ingredient_rows
+from api.serializers import (
+    IngredientSerializer,
+    RecipeReadSerializer,
+    RecipeShortSerializer,
+)
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    ShoppingCart,
+    Subscription,
+    User,
+)
+
+VARIANTS = {"small": {"webp": "recipes/images/small.webp"}}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет вывод RecipeReadSerializer, RecipeShortSerializer и "
+        "IngredientSerializer с выводом полей DRF и замеряет загрузку и "
+        "сериализацию в расчёте на один объект"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=500)
+        parser.add_argument("--ingredients", type=int, default=8)
+        parser.add_argument("--repeats", type=int, default=5)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                viewer = self.seed(options)
+                self.measure(viewer, options["repeats"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        prefix = f"serial{int(time.time())}"
+        users = User.objects.bulk_create(
+            User(
+                username=f"{prefix}_{i}",
+                email=f"{prefix}_{i}@example.com",
+                first_name="Serial",
+                last_name=str(i),
+                password="!",
+                avatar=f"users/{prefix}_{i}.png" if i % 2 else "",
+                avatar_variants=VARIANTS if i % 4 == 1 else {},
+            )
+            for i in range(20)
+        )
+        viewer = users[0]
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=viewer, author=author)
+            for author in users[1::3]
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"{prefix} продукт {i}", measurement_unit="г")
+            for i in range(200)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=random.choice(users),
+                name=f"Рецепт {i}",
+                text="Описание " * 20,
+                cooking_time=i + 1,
+                image=f"recipes/images/{prefix}_{i}.png",
+                image_variants=VARIANTS if i % 2 else {},
+            )
+            for i in range(options["recipes"])
+        )
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=amount
+                )
+                for recipe in recipes
+                for amount, ingredient in enumerate(
+                    random.sample(ingredients, options["ingredients"]), 1
+                )
+            ),
+            batch_size=5000,
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=viewer, recipe=recipe)
+                for recipe in random.sample(recipes, len(recipes) // 3)
+            )
+        self.recipe_ids = [recipe.pk for recipe in recipes]
+        self.ingredient_ids = [ingredient.pk for ingredient in ingredients]
+        return viewer
+
+    def make_request(self, user):
+        request = Request(APIRequestFactory().get("/api/recipes/"))
+        request.user = user
+        return request
+
+    def measure(self, viewer, repeats):
+        recipes = Recipe.objects.filter(
+            pk__in=self.recipe_ids
+        ).select_related("author").order_by("pk")
+        flagged = recipes.with_user_flags(viewer)
+        cases = (
+            ("RecipeReadSerializer, с запросом", RecipeReadSerializer,
+             flagged, viewer),
+            ("RecipeReadSerializer, без запроса", RecipeReadSerializer,
+             recipes.with_user_flags(AnonymousUser()), None),
+            ("RecipeReadSerializer, флаги без аннотаций",
+             RecipeReadSerializer, recipes, viewer),
+            ("RecipeShortSerializer", RecipeShortSerializer, recipes,
+             viewer),
+        )
+        for title, serializer_class, queryset, user in cases:
+            self.compare(
+                title,
+                lambda request: self.reference(
+                    serializer_class, queryset, request
+                ),
+                lambda request: serializer_class(
+                    queryset, many=True, context={"request": request}
+                ).data,
+                user,
+                repeats,
+            )
+        ingredients = Ingredient.objects.filter(pk__in=self.ingredient_ids)
+        self.compare(
+            "IngredientSerializer",
+            lambda request: self.reference(
+                IngredientSerializer, ingredients, request
+            ),
+            lambda request: represent_ingredient_rows(
+                ingredients.values_list("id", "name", "measurement_unit")
+            ),
+            None,
+            repeats,
+        )
+
+    def reference(self, serializer_class, queryset, request):
+        """Вывод полей DRF, как до api.representations."""
+        if serializer_class is RecipeReadSerializer:
+            queryset = queryset.prefetch_related(
+                "recipe_ingredients__ingredient"
+            )
+        items = list(queryset.all())
+        if request is not None and serializer_class is RecipeReadSerializer:
+            SubscriptionLoader.for_request(request).load(
+                item.author for item in items
+            )
+        serializer = serializer_class(context={"request": request})
+        # Ссылки на варианты — через storage.url, как до get_media_prefix.
+        with mock.patch.object(
+            representations, "get_media_prefix", return_value=None
+        ):
+            return [
+                serializers.ModelSerializer.to_representation(
+                    serializer, item
+                )
+                for item in items
+            ]
+
+    def compare(self, title, reference, compiled, user, repeats):
+        renderer = JSONRenderer()
+        timings = {"поля DRF": [], "api.representations": []}
+        outputs = {}
+        for _ in range(repeats):
+            for name, build in zip(timings, (reference, compiled)):
+                request = None if user is None else self.make_request(user)
+                started = time.perf_counter()
+                data = build(request)
+                timings[name].append(time.perf_counter() - started)
+                outputs[name] = renderer.render(data)
+        reference_output, compiled_output = outputs.values()
+        if reference_output != compiled_output:
+            raise CommandError(f"{title}: вывод отличается от полей DRF")
+        count = len(data)
+        self.stdout.write(f"{title} ({len(reference_output)} байт):")
+        for name, values in timings.items():
+            self.stdout.write(
+                f"  {name}: {statistics.median(values) / count * 1e6:.1f} "
+                "мкс на объект"
+            )
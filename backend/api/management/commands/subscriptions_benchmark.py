@@ -0,0 +1,127 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.representations import represent_short_recipes
+from recipes.models import Recipe, Subscription, User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает страницу подписок (превью через ROW_NUMBER) с "
+        "запросами по каждому автору на авторах с тысячами рецептов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--authors", type=int, default=20)
+        parser.add_argument("--recipes", type=int, default=2000)
+        parser.add_argument("--recipes-limit", type=int, default=3)
+        parser.add_argument("--repeats", type=int, default=10)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                viewer = self.seed(options)
+                self.measure(viewer, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        prefix = f"subs{int(time.time())}"
+        viewer, *authors = User.objects.bulk_create(
+            User(
+                username=f"{prefix}_{i}",
+                email=f"{prefix}_{i}@example.com",
+                first_name="Subs",
+                last_name=str(i),
+                password="!",
+                recipes_count=options["recipes"] if i else 0,
+            )
+            for i in range(options["authors"] + 1)
+        )
+        Subscription.objects.bulk_create(
+            Subscription(subscriber=viewer, author=author)
+            for author in authors
+        )
+        Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=author,
+                    name=f"Рецепт {i}",
+                    text="Описание",
+                    cooking_time=i % 100 + 1,
+                    image=f"recipes/images/{prefix}_{i}.png",
+                )
+                for author in authors
+                for i in range(options["recipes"])
+            ),
+            batch_size=5000,
+        )
+        return viewer
+
+    def measure(self, viewer, options):
+        client = APIClient()
+        client.force_authenticate(viewer)
+        path = (
+            f"/api/users/subscriptions/?limit={options['authors']}"
+            f"&recipes_limit={options['recipes_limit']}"
+        )
+
+        def current():
+            response = client.get(path)
+            if response.status_code != 200:
+                raise CommandError(f"{path}: ответ {response.status_code}")
+            return {
+                author["id"]: (
+                    author["recipes_count"],
+                    [recipe["id"] for recipe in author["recipes"]],
+                )
+                for author in response.data["results"]
+            }
+
+        def per_author():
+            """Запросы по каждому автору, как до ROW_NUMBER."""
+            authors = User.objects.filter(
+                authors__subscriber=viewer
+            ).order_by("username")[:options["authors"]]
+            results = {}
+            for author in authors:
+                Subscription.objects.filter(
+                    subscriber=viewer, author=author
+                ).exists()
+                recipes = represent_short_recipes(
+                    author.recipes.all()[:options["recipes_limit"]]
+                )
+                results[author.id] = (
+                    author.recipes.count(),
+                    [recipe["id"] for recipe in recipes],
+                )
+            return results
+
+        outputs = {}
+        for title, call in (
+            ("Запросы по каждому автору", per_author),
+            ("ROW_NUMBER", current),
+        ):
+            timings = []
+            for _ in range(options["repeats"]):
+                with CaptureQueriesContext(connection) as queries:
+                    started = time.perf_counter()
+                    outputs[title] = call()
+                    timings.append(time.perf_counter() - started)
+            self.stdout.write(
+                f"{title}: {len(queries)} запросов, медиана "
+                f"{statistics.median(timings) * 1000:.1f} мс"
+            )
+        reference, result = outputs.values()
+        if reference != result:
+            raise CommandError("Превью рецептов отличаются")
@@ -1,16 +1,202 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+from datetime import datetime
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+def estimate_count(queryset):
+    """Оценка числа строк по плану запроса PostgreSQL (без COUNT(*))."""
+    sql, params = queryset.query.sql_with_params()
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}", params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+class ApproximateCountPaginator(Paginator):
+    """Пагинатор, который на больших выборках PostgreSQL берёт оценку
+    числа строк из планировщика вместо точного COUNT(*).
+
+    Включается настройкой PAGINATION_APPROXIMATE_COUNT_THRESHOLD: точный
+    подсчёт выполняется, пока оценка не превышает порог.
+    """
+
+    @cached_property
+    def count(self):
+        threshold = settings.PAGINATION_APPROXIMATE_COUNT_THRESHOLD
+        queryset = self.object_list
+        if (
+            threshold
+            and hasattr(queryset, "query")
+            and connections[queryset.db].vendor == "postgresql"
+        ):
+            estimate = estimate_count(queryset.order_by())
+            if estimate > threshold:
+                return estimate
+        return super().count
+
+
+class KeysetPagination(PageNumberPagination):
+    """Постраничная выдача с курсором по ключу сортировки.
+
+    Без параметра cursor работает как обычная PageNumberPagination
+    (page/limit). С ?cursor= (пустым для первой страницы) выборка
+    сортируется по keyset и продолжается условием «после последней
+    записи», без COUNT(*) и OFFSET.
+    """
+
+    django_paginator_class = ApproximateCountPaginator
+    cursor_query_param = "cursor"
+    keyset = ()
+    invalid_cursor_message = "Неверный курсор"
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.use_cursor = self.cursor_query_param in request.query_params
+        if not self.use_cursor:
+            return super().paginate_queryset(queryset, request, view)
 
+        self.request = request
+        page_size = self.get_page_size(request)
+        self.keyset = self.get_keyset(queryset)
+        position = self.decode_cursor(
+            request.query_params[self.cursor_query_param],
+            self.get_keyset_fields(queryset),
+        )
+        queryset = queryset.order_by(*self.keyset)
+        if position is not None:
+            queryset = queryset.filter(self.get_after_filter(position))
+        items = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(items) > page_size:
+            items = items[:page_size]
+            self.next_position = [
+                getattr(items[-1], field.lstrip("-"))
+                for field in self.keyset
+            ]
+        return items
 
-class RecipePagination(PageNumberPagination):
+    def get_keyset(self, queryset):
+        return self.keyset
+
+    def get_keyset_fields(self, queryset):
+        """Поля модели (или аннотаций) из keyset — для разбора курсора."""
+        fields = []
+        for name in self.keyset:
+            name = name.lstrip("-")
+            annotation = queryset.query.annotations.get(name)
+            if annotation is not None:
+                fields.append(annotation.output_field)
+            else:
+                fields.append(queryset.model._meta.get_field(name))
+        return fields
+
+    def get_after_filter(self, position):
+        # (a, b) после (x, y): a > x или (a = x и b > y); для полей
+        # с «-» сравнение в обратную сторону.
+        after = Q()
+        for i, field in enumerate(self.keyset):
+            name = field.lstrip("-")
+            lookup = "lt" if field.startswith("-") else "gt"
+            condition = Q(**{f"{name}__{lookup}": position[i]})
+            for previous, value in zip(self.keyset[:i], position):
+                condition &= Q(**{previous.lstrip("-"): value})
+            after |= condition
+        return after
+
+    def encode_cursor(self, position):
+        return b64encode(json.dumps([
+            value.isoformat() if hasattr(value, "isoformat") else value
+            for value in position
+        ]).encode()).decode()
+
+    def decode_cursor(self, cursor, fields):
+        """Позиция из курсора, приведённая к типам полей fields.
+
+        Подделанный курсор (не тот тип, значение вне диапазона) даёт 404,
+        как и битый, а не ошибку в запросе к БД.
+        """
+        if not cursor:
+            return None
+        try:
+            position = json.loads(b64decode(cursor.encode()))
+        except (BinasciiError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(fields):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            return [
+                self.to_python(field, value)
+                for field, value in zip(fields, position)
+            ]
+        except (ValidationError, TypeError, ValueError, OverflowError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def to_python(self, field, value):
+        if value is None or isinstance(value, (bool, dict, list)):
+            raise TypeError(f"Недопустимое значение курсора: {value!r}")
+        value = field.to_python(value)
+        field.run_validators(value)
+        if isinstance(value, datetime) and timezone.is_naive(value):
+            value = timezone.make_aware(value)
+        return value
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        return replace_query_param(
+            remove_query_param(
+                self.request.build_absolute_uri(), self.page_query_param
+            ),
+            self.cursor_query_param,
+            self.encode_cursor(self.next_position),
+        )
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super().get_paginated_response(data)
+        return Response({
+            "next": self.get_next_link(),
+            "previous": None,
+            "results": data,
+        })
+
+
+class RecipePagination(KeysetPagination):
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 30
+    keyset = ('-pub_date', '-id')
+
+    def get_keyset(self, queryset):
+        # Порядок по аннотациям RecipeFilter (популярность, подбор по
+        # продуктам, поиск) заканчивается id и сам служит ключом.
+        ordering = queryset.query.order_by
+        if ordering and ordering[0].lstrip("-") in queryset.query.annotations:
+            return tuple(ordering)
+        return super().get_keyset(queryset)
 
 
-class UserPagination(PageNumberPagination):
+class UserPagination(KeysetPagination):
     page_size = 6
     page_size_query_param = 'limit'
     max_page_size = 100
+    keyset = ('username', 'id')
 
 
 class LimitPagination(PageNumberPagination):
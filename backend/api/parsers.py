@@ -0,0 +1,34 @@
+"""JSON-парсер на orjson.
+
+Тело запроса в UTF-8 разбирается orjson. Тело в другой кодировке и
+тело, которое orjson отверг, разбирает JSONParser: он же формирует
+сообщение об ошибке, так что ответы 400 не меняются. Без orjson парсер
+работает как JSONParser.
+
+В отличие от json, orjson не сохраняет точно целые больше 64 бит; полей
+с такими значениями в API нет.
+"""
+from io import BytesIO
+
+from django.conf import settings
+from rest_framework.parsers import JSONParser
+
+from .renderers import ORJSONRenderer, orjson
+
+UTF8_NAMES = ("utf-8", "utf8")
+
+
+class ORJSONParser(JSONParser):
+    renderer_class = ORJSONRenderer
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get(
+            "encoding", settings.DEFAULT_CHARSET
+        )
+        if orjson is None or encoding.lower() not in UTF8_NAMES:
+            return super().parse(stream, media_type, parser_context)
+        body = stream.read()
+        try:
+            return orjson.loads(body)
+        except orjson.JSONDecodeError:
+            return super().parse(BytesIO(body), media_type, parser_context)
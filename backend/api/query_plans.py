@@ -0,0 +1,270 @@
+"""Частые запросы API и проверка их планов выполнения.
+
+Каждый запрос регистрируется функцией, которая по образцу данных
+(пользователь, автор, рецепт, продукт) строит тот же QuerySet, что
+выполняют представления и фильтры. Команда check_query_plans получает
+для них план (EXPLAIN) и сообщает о полных просмотрах таблиц.
+
+На PostgreSQL план строится с enable_seqscan = off: Seq Scan остаётся
+в плане, только если подходящего индекса нет вовсе, так что проверка
+не зависит от объёма данных. На SQLite полным просмотром считается
+строка плана «SCAN <таблица>».
+
+Проход по всему индексу без условия (SCAN ... USING INDEX, Index Scan
+без Index Cond) тоже считается полным просмотром, кроме запросов,
+зарегистрированных с index_scan=True: они читают индекс по порядку
+сортировки и останавливаются на LIMIT.
+"""
+import json
+import re
+from types import SimpleNamespace
+
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from recipes.models import (
+    DataVersion,
+    Favorite,
+    ImageJob,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Subscription,
+    TimelineEntry,
+    User,
+)
+from recipes.versions import RECIPES
+from .filters import IngredientFilter, RecipeFilter
+from .representations import INGREDIENT_ROW_FIELDS
+
+PAGE_SIZE = 6
+SQLITE_SCAN = re.compile(r'^SCAN (\w+)( USING (?:COVERING )?INDEX \w+)?$')
+SQLITE_SUBQUERY = re.compile(r'^(?:CO-ROUTINE|MATERIALIZE) (\w+)$')
+POSTGRESQL_INDEX_SCANS = ('Index Scan', 'Index Only Scan')
+
+HOT_QUERIES = {}
+
+
+def hot_query(name, vendors=None, index_scan=False):
+    """Регистрирует построитель запроса; vendors — СУБД, на которых
+    запрос выполняется именно так (None — на всех)."""
+    def register(build):
+        HOT_QUERIES[name] = SimpleNamespace(
+            build=build, vendors=vendors, index_scan=index_scan
+        )
+        return build
+    return register
+
+
+def filter_recipes(sample, **params):
+    recipes = Recipe.objects.with_user_flags(sample.user)
+    return RecipeFilter(
+        params, recipes, request=SimpleNamespace(user=sample.user)
+    ).qs
+
+
+@hot_query('recipes_page', index_scan=True)
+def recipes_page(sample):
+    return filter_recipes(sample).order_by('-pub_date', '-id')[:PAGE_SIZE]
+
+
+@hot_query('recipes_by_author')
+def recipes_by_author(sample):
+    return filter_recipes(sample, author=sample.author.pk).order_by(
+        '-pub_date', '-id'
+    )[:PAGE_SIZE]
+
+
+@hot_query('recipes_favorited')
+def recipes_favorited(sample):
+    return filter_recipes(sample, is_favorited=True).order_by(
+        '-pub_date', '-id'
+    )[:PAGE_SIZE]
+
+
+@hot_query('recipes_in_shopping_cart')
+def recipes_in_shopping_cart(sample):
+    return filter_recipes(sample, is_in_shopping_cart=True).order_by(
+        '-pub_date', '-id'
+    )[:PAGE_SIZE]
+
+
+@hot_query('recipes_popular', index_scan=True)
+def recipes_popular(sample):
+    return filter_recipes(sample, ordering='popular')[:PAGE_SIZE]
+
+
+@hot_query('recipes_trending', index_scan=True)
+def recipes_trending(sample):
+    return filter_recipes(sample, ordering='trending')[:PAGE_SIZE]
+
+
+@hot_query('recipes_search')
+def recipes_search(sample):
+    return filter_recipes(sample, search=sample.recipe.name)[:PAGE_SIZE]
+
+
+@hot_query('recipes_version')
+def recipes_version(sample):
+    # Версия списка рецептов и индекса подбора (recipes.versions)
+    return DataVersion.objects.filter(pk=RECIPES).values('version')
+
+
+@hot_query('recipe_ingredients')
+def recipe_ingredients(sample):
+    return IngredientRecipe.objects.filter(
+        recipe_id__in=[sample.recipe.pk]
+    ).values_list(*INGREDIENT_ROW_FIELDS)
+
+
+@hot_query('viewer_favorites')
+def viewer_favorites(sample):
+    return Favorite.objects.filter(
+        user=sample.user, recipe_id__in=[sample.recipe.pk]
+    ).values_list('recipe_id', flat=True)
+
+
+@hot_query('viewer_subscriptions')
+def viewer_subscriptions(sample):
+    return Subscription.objects.filter(
+        subscriber=sample.user, author_id__in=[sample.author.pk]
+    ).values_list('author_id', flat=True)
+
+
+@hot_query('subscriptions_page')
+def subscriptions_page(sample):
+    return User.objects.filter(
+        authors__subscriber=sample.user
+    ).order_by('username')[:PAGE_SIZE]
+
+
+@hot_query('subscriptions_recipes_preview')
+def subscriptions_recipes_preview(sample):
+    return Recipe.objects.filter(author_id__in=[sample.author.pk]).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )
+    ).filter(row_number__lte=3)
+
+
+@hot_query('feed_page')
+def feed_page(sample):
+    return TimelineEntry.objects.filter(user=sample.user).order_by(
+        '-pub_date', '-recipe_id'
+    ).values_list('pub_date', 'recipe_id')[:PAGE_SIZE + 1]
+
+
+@hot_query('shopping_list')
+def shopping_list(sample):
+    return ShoppingCartTotal.objects.filter(user=sample.user).values(
+        'ingredient__name', 'ingredient__measurement_unit', 'amount'
+    ).order_by('ingredient__name')
+
+
+@hot_query('recipe_carts')
+def recipe_carts(sample):
+    # Пересчёт итогов корзин при изменении рецепта
+    return ShoppingCart.objects.filter(
+        recipe_id=sample.recipe.pk
+    ).values_list('user_id', flat=True)
+
+
+@hot_query('trending_events')
+def trending_events(sample):
+    return Favorite.objects.filter(
+        created_at__gte=sample.recipe.pub_date
+    ).values_list('recipe_id', 'created_at')
+
+
+@hot_query('trending_stale')
+def trending_stale(sample):
+    return RecipeScore.objects.filter(trending__gt=0).values_list(
+        'recipe_id', flat=True
+    )
+
+
+@hot_query('image_jobs_pending', index_scan=True)
+def image_jobs_pending(sample):
+    return ImageJob.objects.filter(status=ImageJob.PENDING).values_list(
+        'id', flat=True
+    )[:100]
+
+
+@hot_query('ingredients_prefix')
+def ingredients_prefix(sample):
+    return Ingredient.objects.filter(
+        name__istartswith=sample.ingredient.name[:2]
+    ).order_by('name')
+
+
+# На SQLite поиск подстроки идёт по индексу в памяти (IngredientIndex).
+@hot_query('ingredients_search', vendors=('postgresql',))
+def ingredients_search(sample):
+    return IngredientFilter(
+        {'name': sample.ingredient.name[1:3]}, Ingredient.objects.all()
+    ).qs
+
+
+def get_plan(queryset):
+    """План запроса: строки EXPLAIN QUERY PLAN на SQLite,
+    дерево узлов (FORMAT JSON) на PostgreSQL."""
+    # Не queryset.explain(): он ломает запросы с фильтром по Window,
+    # которые Django оборачивает в подзапрос.
+    sql, params = queryset.query.sql_with_params()
+    with transaction.atomic(), connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return plan[0]['Plan']
+        cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def find_full_scans(plan, index_scan=False):
+    """Таблицы, которые план просматривает целиком; index_scan — не
+    считать полным просмотром проход по индексу без условия."""
+    if isinstance(plan, dict):
+        tables = []
+        node = plan['Node Type']
+        if node == 'Seq Scan' or (
+            node in POSTGRESQL_INDEX_SCANS
+            and 'Index Cond' not in plan
+            and not index_scan
+        ):
+            tables.append(plan['Relation Name'])
+        for child in plan.get('Plans', ()):
+            tables.extend(find_full_scans(child, index_scan))
+        return tables
+    # Подзапросы SQLite тоже «просматриваются», но это не таблицы.
+    subqueries = {
+        match.group(1) for match in map(SQLITE_SUBQUERY.match, plan) if match
+    }
+    return [
+        match.group(1)
+        for match in map(SQLITE_SCAN.match, plan)
+        if match
+        and match.group(1) not in subqueries
+        and not (match.group(2) and index_scan)
+    ]
+
+
+def get_sample():
+    """Образец данных для построения запросов или None, если их нет."""
+    recipe = Recipe.objects.select_related('author').first()
+    ingredient = Ingredient.objects.first()
+    user = User.objects.filter(subscribers__isnull=False).first()
+    if recipe is None or ingredient is None or user is None:
+        return None
+    return SimpleNamespace(
+        user=user, author=recipe.author, recipe=recipe,
+        ingredient=ingredient,
+    )
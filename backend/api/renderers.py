@@ -0,0 +1,47 @@
+"""JSON-рендерер на orjson.
+
+orjson кодирует ответы в несколько раз быстрее json из стандартной
+библиотеки и сразу отдаёт байты, без промежуточной строки. Если пакет
+не установлен, рендерер работает как обычный JSONRenderer.
+
+Вывод совпадает с JSONRenderer: компактный, без экранирования не-ASCII,
+с экранированными U+2028 и U+2029. Даты, Decimal, ленивые строки и
+прочие типы, которых нет в JSON, кодирует JSONEncoder из DRF. Данные,
+с которыми orjson не справляется (например, целые больше 64 бит), и
+вывод с отступами (indent, браузерный API) целиком отдаются
+JSONRenderer. Единственное расхождение — NaN и бесконечности: orjson
+пишет их как null, а JSONRenderer при STRICT_JSON отказывается их
+кодировать; в ответах API таких значений нет.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (
+            orjson is None
+            or data is None
+            or self.ensure_ascii
+            or not self.compact
+            or self.get_indent(accepted_media_type, renderer_context or {})
+        ):
+            return super().render(data, accepted_media_type, renderer_context)
+        try:
+            ret = orjson.dumps(
+                data,
+                default=self.encoder_class().default,
+                option=(
+                    orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+                ),
+            )
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        # Как JSONRenderer: вывод должен оставаться подмножеством JavaScript.
+        return ret.replace(b"\xe2\x80\xa8", b"\\u2028").replace(
+            b"\xe2\x80\xa9", b"\\u2029"
+        )
@@ -0,0 +1,246 @@
+"""Представления рецептов и продуктов для чтения без полей DRF.
+
+RecipeReadSerializer, RecipeShortSerializer и IngredientSerializer
+отдают to_representation функциям этого модуля: словари собираются
+напрямую из атрибутов объектов (через заранее построенные attrgetter)
+и строк values_list, без обхода полей сериализатора для каждого
+объекта. Продукты рецептов всей страницы читаются через values_list,
+без объектов IngredientRecipe и Ingredient, которые создавал
+prefetch_related.
+
+Вывод совпадает с выводом полей сериализаторов байт в байт, это
+проверяют RepresentationTests и команда serializer_benchmark; при
+изменении полей сериализаторов функции нужно менять вместе с ними.
+"""
+import re
+from operator import attrgetter
+
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.encoding import filepath_to_uri
+
+from recipes.models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    ShoppingCart,
+)
+from .loaders import SubscriptionLoader
+
+AUTHOR_FIELDS = attrgetter(
+    "id", "username", "first_name", "last_name", "email"
+)
+RECIPE_FIELDS = attrgetter("id", "name", "text", "cooking_time")
+RECIPE_SHORT_FIELDS = attrgetter("id", "name", "cooking_time")
+INGREDIENT_FIELDS = attrgetter("id", "name", "measurement_unit")
+INGREDIENT_ROW_FIELDS = ("recipe_id", "ingredient_id", "amount")
+# Имена, для которых urljoin в FileSystemStorage.url меняет путь
+# (пустые сегменты, «.» и «..»): их ссылки строит само хранилище.
+NOT_PLAIN_NAME = re.compile(r"//|\\|(^|/)\.\.?(/|$)")
+MEDIA_PREFIX_ATTR = "_media_url_prefix"
+
+
+def get_media_prefix(request=None):
+    """Начало ссылок на файлы FileSystemStorage (MEDIA_URL, для запроса
+    — абсолютный), чтобы не вызывать urljoin и build_absolute_uri для
+    каждого файла; для запроса считается один раз. None для других
+    хранилищ.
+    """
+    if not isinstance(default_storage, FileSystemStorage):
+        return None
+    if request is None:
+        return default_storage.base_url
+    prefix = getattr(request, MEDIA_PREFIX_ATTR, None)
+    if prefix is None:
+        prefix = request.build_absolute_uri(default_storage.base_url)
+        setattr(request, MEDIA_PREFIX_ATTR, prefix)
+    return prefix
+
+
+def get_storage_url(name, request=None):
+    """Ссылка на файл name хранилища, как её строят storage.url и
+    request.build_absolute_uri."""
+    prefix = get_media_prefix(request)
+    if prefix is None or NOT_PLAIN_NAME.search(name):
+        url = default_storage.url(name)
+        if request is not None:
+            url = request.build_absolute_uri(url)
+        return url
+    return prefix + filepath_to_uri(name).lstrip("/")
+
+
+def get_variant_urls(variants, request=None):
+    """Ссылки на уменьшенные копии изображения ({} до их готовности)."""
+    return {
+        variant: {
+            image_format: get_storage_url(name, request)
+            for image_format, name in formats.items()
+        }
+        for variant, formats in variants.items()
+    }
+
+
+def get_file_url(file, request=None):
+    """Ссылка на файл, как её отдаёт ImageField из DRF."""
+    if not file:
+        return None
+    if file.storage is not default_storage:
+        url = file.url
+        return url if request is None else request.build_absolute_uri(url)
+    return get_storage_url(file.name, request)
+
+
+def get_user_flags(recipes, request, flag, model_class):
+    """{id рецепта: флаг}; флаги, не посчитанные в запросе
+    (Recipe.objects.with_user_flags), загружаются одним запросом."""
+    flags = {}
+    missing = []
+    for recipe in recipes:
+        if hasattr(recipe, flag):
+            flags[recipe.id] = bool(getattr(recipe, flag))
+        else:
+            flags[recipe.id] = False
+            missing.append(recipe.id)
+    if missing and request is not None and not request.user.is_anonymous:
+        for recipe_id in model_class.objects.filter(
+            user=request.user, recipe_id__in=missing
+        ).values_list("recipe_id", flat=True):
+            flags[recipe_id] = True
+    return flags
+
+
+def get_ingredient_rows(recipes):
+    """{id рецепта: [(id, name, measurement_unit, amount), ...]}.
+
+    Уже загруженные через prefetch_related продукты берутся как есть.
+    Для остальных строки IngredientRecipe читаются тем же запросом, что
+    строит prefetch_related (и в том же порядке), а названия продуктов —
+    вторым запросом.
+    """
+    rows = {}
+    missing = []
+    for recipe in recipes:
+        prefetched = getattr(recipe, "_prefetched_objects_cache", {})
+        if "recipe_ingredients" in prefetched:
+            rows[recipe.id] = [
+                (
+                    item.ingredient.id,
+                    item.ingredient.name,
+                    item.ingredient.measurement_unit,
+                    item.amount,
+                )
+                for item in prefetched["recipe_ingredients"]
+            ]
+        else:
+            rows[recipe.id] = []
+            missing.append(recipe.id)
+    if not missing:
+        return rows
+    items = list(
+        IngredientRecipe.objects.filter(
+            recipe_id__in=missing
+        ).values_list(*INGREDIENT_ROW_FIELDS)
+    )
+    ingredients = {
+        pk: (name, measurement_unit)
+        for pk, name, measurement_unit in Ingredient.objects.filter(
+            pk__in={ingredient_id for _, ingredient_id, _ in items}
+        ).order_by().values_list("id", "name", "measurement_unit")
+    }
+    for recipe_id, ingredient_id, amount in items:
+        rows[recipe_id].append(
+            (ingredient_id, *ingredients[ingredient_id], amount)
+        )
+    return rows
+
+
+def represent_author(author, request, loader):
+    pk, username, first_name, last_name, email = AUTHOR_FIELDS(author)
+    return {
+        "id": pk,
+        "username": username,
+        "first_name": first_name,
+        "last_name": last_name,
+        "email": email,
+        "is_subscribed": loader is not None and loader.flags[pk],
+        "avatar": get_file_url(author.avatar, request),
+        "avatar_variants": get_variant_urls(author.avatar_variants, request),
+    }
+
+
+def represent_recipes(recipes, request=None):
+    """Вывод RecipeReadSerializer для списка рецептов."""
+    recipes = list(recipes)
+    loader = None
+    if request is not None:
+        loader = SubscriptionLoader.for_request(request)
+        loader.load(recipe.author for recipe in recipes)
+    favorited = get_user_flags(recipes, request, "is_favorited", Favorite)
+    in_cart = get_user_flags(
+        recipes, request, "is_in_shopping_cart", ShoppingCart
+    )
+    ingredient_rows = get_ingredient_rows(recipes)
+    authors = {}
+    results = []
+    for recipe in recipes:
+        pk, name, text, cooking_time = RECIPE_FIELDS(recipe)
+        author = authors.get(recipe.author_id)
+        if author is None:
+            author = authors[recipe.author_id] = represent_author(
+                recipe.author, request, loader
+            )
+        results.append({
+            "id": pk,
+            # Копия: рецепты одного автора не должны делить словарь.
+            "author": dict(author),
+            "ingredients": [
+                {
+                    "id": ingredient_id,
+                    "name": ingredient_name,
+                    "measurement_unit": measurement_unit,
+                    "amount": amount,
+                }
+                for ingredient_id, ingredient_name, measurement_unit, amount
+                in ingredient_rows[pk]
+            ],
+            "is_favorited": favorited[pk],
+            "is_in_shopping_cart": in_cart[pk],
+            "name": name,
+            "image": get_file_url(recipe.image, request),
+            "image_variants": get_variant_urls(
+                recipe.image_variants, request
+            ),
+            "text": text,
+            "cooking_time": cooking_time,
+        })
+    return results
+
+
+def represent_short_recipes(recipes, request=None):
+    """Вывод RecipeShortSerializer для списка рецептов."""
+    results = []
+    for recipe in recipes:
+        pk, name, cooking_time = RECIPE_SHORT_FIELDS(recipe)
+        results.append({
+            "id": pk,
+            "name": name,
+            "image": get_file_url(recipe.image, request),
+            "image_variants": get_variant_urls(
+                recipe.image_variants, request
+            ),
+            "cooking_time": cooking_time,
+        })
+    return results
+
+
+def represent_ingredient_rows(rows):
+    """Вывод IngredientSerializer для кортежей (id, name,
+    measurement_unit) — из values_list или IngredientIndex."""
+    return [
+        {"id": pk, "name": name, "measurement_unit": measurement_unit}
+        for pk, name, measurement_unit in rows
+    ]
+
+
+def represent_ingredients(ingredients, request=None):
+    """Вывод IngredientSerializer для списка продуктов."""
+    return represent_ingredient_rows(map(INGREDIENT_FIELDS, ingredients))
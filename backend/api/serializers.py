@@ -1,3 +1,5 @@
+from django.db import transaction
+from django.db.models import prefetch_related_objects
 from rest_framework import serializers
 from djoser.serializers import UserSerializer
 from drf_extra_fields.fields import Base64ImageField
@@ -8,13 +10,70 @@ from recipes.models import (
     IngredientRecipe,
     Recipe,
     ShoppingCart,
+    ShoppingCartTotal,
     User,
-    Subscription,
 )
+from recipes.images import enqueue_image_processing
+from recipes.search import update_search_index
+from .loaders import SubscriptionLoader
+from .representations import (
+    get_variant_urls,
+    represent_ingredients,
+    represent_recipes,
+    represent_short_recipes,
+)
+
+BULK_IDS_MAX = 100
+# Наибольший id (BigAutoField): больший не влезает в параметр запроса
+ID_MAX = 2 ** 63 - 1
+
+
+class ImageVariantsMixin:
+    def get_image_variants(self, recipe):
+        return get_variant_urls(
+            recipe.image_variants, self.context.get("request")
+        )
+
+
+class RepresentationMixin:
+    """Вывод без обхода полей: to_representation отдаёт объекты функции
+    represent (см. api.representations).
+
+    Поля остаются описанием формата — по ним строится схема и с ними
+    сверяется вывод в команде serializer_benchmark.
+    """
+
+    represent = None
+
+    def to_representation(self, instance):
+        return self.represent_many([instance])[0]
+
+    def represent_many(self, items):
+        return self.represent(items, self.context.get("request"))
+
+
+class RepresentationListSerializer(serializers.ListSerializer):
+    """Представляет весь список одним вызовом represent."""
+
+    def to_representation(self, data):
+        items = data.all() if hasattr(data, "all") else data
+        return self.child.represent_many(list(items))
+
+
+class SubscriptionPreloadListSerializer(serializers.ListSerializer):
+    """Заранее загружает подписки на всех авторов страницы."""
+
+    def to_representation(self, data):
+        items = data.all() if hasattr(data, "all") else data
+        request = self.context.get("request")
+        if request is not None:
+            SubscriptionLoader.for_request(request).load(items)
+        return super().to_representation(items)
 
 
 class CustomUserSerializer(UserSerializer):
     is_subscribed = serializers.SerializerMethodField()
+    avatar_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = User
@@ -26,17 +85,21 @@ class CustomUserSerializer(UserSerializer):
             "email",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
         )
         read_only_fields = fields
+        list_serializer_class = SubscriptionPreloadListSerializer
 
     def get_is_subscribed(self, user):
         request = self.context.get("request")
         return (
             request is not None
-            and not request.user.is_anonymous
-            and Subscription.objects.filter(
-                subscriber=request.user, author=user
-            ).exists()
+            and SubscriptionLoader.for_request(request).is_subscribed(user)
+        )
+
+    def get_avatar_variants(self, user):
+        return get_variant_urls(
+            user.avatar_variants, self.context.get("request")
         )
 
 
@@ -47,19 +110,36 @@ class SetAvatarSerializer(serializers.ModelSerializer):
         model = User
         fields = ("avatar",)
 
+    def update(self, instance, validated_data):
+        user = super().update(instance, validated_data)
+        enqueue_image_processing(user, "avatar")
+        return user
+
+
+class RecipeShortSerializer(
+    RepresentationMixin, ImageVariantsMixin, serializers.ModelSerializer
+):
+    image_variants = serializers.SerializerMethodField()
+    represent = staticmethod(represent_short_recipes)
 
-class RecipeShortSerializer(serializers.ModelSerializer):
     class Meta:
         model = Recipe
-        fields = ("id", "name", "image", "cooking_time")
+        fields = ("id", "name", "image", "image_variants", "cooking_time")
         read_only_fields = fields
+        list_serializer_class = RepresentationListSerializer
 
 
 class SubscribedAuthorSerializer(CustomUserSerializer):
-    recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.IntegerField(
-        source="recipes.count", read_only=True
+    """Автор из подписок.
+
+    Ожидает пользователей из UserViewSet.get_subscribed_authors: превью
+    рецептов и их количество уже загружены вместе со страницей.
+    """
+
+    recipes = RecipeShortSerializer(
+        source="recipes_preview", many=True, read_only=True
     )
+    recipes_count = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = User
@@ -71,35 +151,21 @@ class SubscribedAuthorSerializer(CustomUserSerializer):
             "email",
             "is_subscribed",
             "avatar",
+            "avatar_variants",
             "recipes",
             "recipes_count",
         )
         read_only_fields = fields
+        list_serializer_class = SubscriptionPreloadListSerializer
 
-    def get_recipes(self, author):
-        request = self.context.get("request")
-        recipes = author.recipes.all()
-
-        recipes_limit = 1000
-        try:
-            limit_param = request.query_params.get(
-                "recipes_limit"
-            ) or self.context.get("recipes_limit")
-            if limit_param:
-                recipes_limit = int(limit_param)
-        except (ValueError, TypeError, AttributeError):
-            pass
-
-        recipes = recipes[:recipes_limit]
-        return RecipeShortSerializer(
-            recipes, many=True, context={"request": request}
-        ).data
 
+class IngredientSerializer(RepresentationMixin, serializers.ModelSerializer):
+    represent = staticmethod(represent_ingredients)
 
-class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = ("id", "name", "measurement_unit")
+        list_serializer_class = RepresentationListSerializer
 
 
 class IngredientRecipeSerializer(serializers.ModelSerializer):
@@ -116,22 +182,53 @@ class IngredientRecipeSerializer(serializers.ModelSerializer):
         read_only_fields = fields
 
 
+class IngredientCreateListSerializer(serializers.ListSerializer):
+    """Находит все продукты рецепта одним запросом.
+
+    Заменяет id в каждом элементе на объект Ingredient; об отсутствующих
+    продуктах сообщает одной ошибкой.
+    """
+
+    def to_internal_value(self, data):
+        # Не в validate(): ошибки оттуда ListSerializer заворачивает в
+        # {"non_field_errors": [...]}, а клиенты ждут {"ingredients": [...]}.
+        attrs = super().to_internal_value(data)
+        ingredients = Ingredient.objects.in_bulk(
+            {ingredient["id"] for ingredient in attrs}
+        )
+        missing = sorted(
+            {ingredient["id"] for ingredient in attrs} - ingredients.keys()
+        )
+        if missing:
+            raise serializers.ValidationError(
+                f"Продукты не найдены: {', '.join(map(str, missing))}"
+            )
+        for ingredient in attrs:
+            ingredient["id"] = ingredients[ingredient["id"]]
+        return attrs
+
+
 class IngredientCreateSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    id = serializers.IntegerField()
     amount = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = IngredientRecipe
         fields = ("id", "amount")
+        list_serializer_class = IngredientCreateListSerializer
 
 
-class RecipeReadSerializer(serializers.ModelSerializer):
+class RecipeReadSerializer(
+    RepresentationMixin, ImageVariantsMixin, serializers.ModelSerializer
+):
     author = CustomUserSerializer(read_only=True)
     ingredients = IngredientRecipeSerializer(
         source="recipe_ingredients", many=True, read_only=True
     )
     is_favorited = serializers.SerializerMethodField(read_only=True)
     is_in_shopping_cart = serializers.SerializerMethodField(read_only=True)
+    image_variants = serializers.SerializerMethodField()
+    represent = staticmethod(represent_recipes)
 
     class Meta:
         model = Recipe
@@ -143,27 +240,30 @@ class RecipeReadSerializer(serializers.ModelSerializer):
             "is_in_shopping_cart",
             "name",
             "image",
+            "image_variants",
             "text",
             "cooking_time",
         )
         read_only_fields = fields
+        list_serializer_class = RepresentationListSerializer
 
     def get_is_favorited(self, recipe):
-        request = self.context.get("request")
-        return bool(
-            request
-            and not request.user.is_anonymous
-            and Favorite.objects.filter(
-                user=request.user, recipe=recipe
-            ).exists()
-        )
+        return self._get_user_flag(recipe, "is_favorited", Favorite)
 
     def get_is_in_shopping_cart(self, recipe):
+        return self._get_user_flag(
+            recipe, "is_in_shopping_cart", ShoppingCart
+        )
+
+    def _get_user_flag(self, recipe, flag, model_class):
+        # Флаг уже посчитан в запросе (Recipe.objects.with_user_flags)
+        if hasattr(recipe, flag):
+            return bool(getattr(recipe, flag))
         request = self.context.get("request")
         return bool(
             request
             and not request.user.is_anonymous
-            and ShoppingCart.objects.filter(
+            and model_class.objects.filter(
                 user=request.user, recipe=recipe
             ).exists()
         )
@@ -216,6 +316,49 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
             for ingredient in ingredients
         )
 
+    def update_ingredients(self, ingredients, recipe):
+        """Приводит продукты рецепта к ingredients, трогая только отличия.
+
+        Возвращает прежние количества оставшихся продуктов {id продукта:
+        количество}: удалённые строки вычитает из итогов корзин сигнал
+        post_delete, изменённые и новые — вызывающий код.
+        """
+        current = {
+            item.ingredient_id: item
+            for item in recipe.recipe_ingredients.all()
+        }
+        amounts = {
+            ingredient["id"].id: ingredient["amount"]
+            for ingredient in ingredients
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in current.items()
+            if ingredient_id in amounts
+        }
+        removed = [
+            item.pk for ingredient_id, item in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        for ingredient_id, item in current.items():
+            amount = amounts.get(ingredient_id)
+            if amount is not None and amount != item.amount:
+                item.amount = amount
+                changed.append(item)
+        if removed:
+            IngredientRecipe.objects.filter(pk__in=removed).delete()
+        if changed:
+            IngredientRecipe.objects.bulk_update(changed, ["amount"])
+        self.create_ingredients(
+            [
+                ingredient for ingredient in ingredients
+                if ingredient["id"].id not in current
+            ],
+            recipe,
+        )
+        return old_amounts
+
     def create(self, validated_data):
         author = self.context.get("request").user
         ingredients = validated_data.pop("ingredients", [])
@@ -224,17 +367,45 @@ class RecipeCreateUpdateSerializer(serializers.ModelSerializer):
         recipe = super().create(validated_data)
 
         self.create_ingredients(ingredients, recipe)
+        update_search_index([recipe.pk])
+        enqueue_image_processing(recipe, "image")
 
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         ingredients = validated_data.pop("ingredients", None)
 
         if ingredients is not None:
-            instance.ingredients.clear()
-            self.create_ingredients(ingredients, instance)
+            old_amounts = self.update_ingredients(ingredients, instance)
+            ShoppingCartTotal.objects.change_recipe(
+                instance.id,
+                old_amounts,
+                {
+                    ingredient["id"].id: ingredient["amount"]
+                    for ingredient in ingredients
+                },
+            )
 
-        return super().update(instance, validated_data)
+        recipe = super().update(instance, validated_data)
+        update_search_index([recipe.pk])
+        if "image" in validated_data:
+            enqueue_image_processing(recipe, "image")
+        return recipe
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], "recipe_ingredients__ingredient")
         return RecipeReadSerializer(instance, context=self.context).data
+
+
+class BulkIdsSerializer(serializers.Serializer):
+    """Список id для массового добавления и удаления (без повторов)."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1, max_value=ID_MAX),
+        allow_empty=False,
+        max_length=BULK_IDS_MAX,
+    )
+
+    def validate_ids(self, ids):
+        return list(dict.fromkeys(ids))
@@ -0,0 +1,176 @@
+import csv
+import os
+from abc import ABC, abstractmethod
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+
+from django.conf import settings
+
+from recipes.models import Recipe, ShoppingCartTotal
+
+ITERATOR_CHUNK_SIZE = 500
+PDF_SPOOL_SIZE = 1024 * 1024
+PDF_CHUNK_SIZE = 64 * 1024
+
+
+class ShoppingListRenderer(ABC):
+    """Потоковая выгрузка списка покупок.
+
+    Продукты берутся из готовых итогов корзины (ShoppingCartTotal).
+    Продукты и рецепты читаются из БД курсором через .iterator(), а
+    render() отдаёт документ по частям, не собирая его в памяти целиком.
+    """
+
+    content_type = None
+    extension = None
+
+    def __init__(self, user):
+        self.user = user
+        self.today = datetime.today()
+
+    def get_ingredients(self):
+        return (
+            ShoppingCartTotal.objects.filter(user=self.user)
+            .values(
+                "ingredient__name", "ingredient__measurement_unit", "amount"
+            )
+            .order_by("ingredient__name")
+            .iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        )
+
+    def get_recipes(self):
+        return (
+            Recipe.objects.filter(shopping_carts__user=self.user)
+            .select_related("author")
+            .order_by("name")
+            .iterator(chunk_size=ITERATOR_CHUNK_SIZE)
+        )
+
+    def get_filename(self):
+        return f"{self.user.username}_shopping_list.{self.extension}"
+
+    @abstractmethod
+    def render(self):
+        """Итератор частей документа (str или bytes)."""
+
+
+class TxtShoppingListRenderer(ShoppingListRenderer):
+    content_type = "text/plain"
+    extension = "txt"
+
+    def render(self):
+        yield (
+            f"Список покупок для {self.user.get_full_name()}\n"
+            f"Дата: {self.today:%d-%m-%Y}\n"
+        )
+        yield "Ингредиенты:\n"
+        for i, item in enumerate(self.get_ingredients(), start=1):
+            yield (
+                f"{i}. {item['ingredient__name'].capitalize()} "
+                f"({item['ingredient__measurement_unit']}) - "
+                f"{item['amount']}\n"
+            )
+        yield "Рецепты:\n"
+        for recipe in self.get_recipes():
+            yield f"- {recipe.name} (@ {recipe.author.get_full_name()})\n"
+        yield f"\nFoodgram ({self.today:%Y})"
+
+
+class Echo:
+    """Псевдо-буфер для csv.writer: возвращает строку вместо записи."""
+
+    def write(self, value):
+        return value
+
+
+class CsvShoppingListRenderer(ShoppingListRenderer):
+    content_type = "text/csv"
+    extension = "csv"
+
+    def render(self):
+        writer = csv.writer(Echo())
+        yield writer.writerow(("Продукт", "Единица измерения", "Количество"))
+        for item in self.get_ingredients():
+            yield writer.writerow((
+                item["ingredient__name"].capitalize(),
+                item["ingredient__measurement_unit"],
+                item["amount"],
+            ))
+        yield writer.writerow(())
+        yield writer.writerow(("Рецепт", "Автор"))
+        for recipe in self.get_recipes():
+            yield writer.writerow(
+                (recipe.name, recipe.author.get_full_name())
+            )
+
+
+class PdfShoppingListRenderer(ShoppingListRenderer):
+    content_type = "application/pdf"
+    extension = "pdf"
+    font_size = 11
+    line_height = 16
+    margin = 40
+
+    def get_font_name(self):
+        from reportlab.pdfbase import pdfmetrics
+        from reportlab.pdfbase.ttfonts import TTFont
+
+        font_path = settings.SHOPPING_LIST_PDF_FONT
+        if not font_path or not os.path.exists(font_path):
+            return "Helvetica"
+        pdfmetrics.registerFont(TTFont("ShoppingListFont", font_path))
+        return "ShoppingListFont"
+
+    def render(self):
+        # PDF нельзя отдавать по мере генерации (таблица ссылок пишется
+        # в конце), поэтому документ собирается во временный файл,
+        # который уходит на диск при превышении PDF_SPOOL_SIZE.
+        from reportlab.lib.pagesizes import A4
+        from reportlab.pdfgen import canvas
+
+        with SpooledTemporaryFile(max_size=PDF_SPOOL_SIZE) as file:
+            pdf = canvas.Canvas(file, pagesize=A4)
+            font_name = self.get_font_name()
+            width, height = A4
+            y = height - self.margin
+
+            def write_line(text):
+                nonlocal y
+                if y < self.margin:
+                    pdf.showPage()
+                    y = height - self.margin
+                pdf.setFont(font_name, self.font_size)
+                pdf.drawString(self.margin, y, text)
+                y -= self.line_height
+
+            write_line(f"Список покупок для {self.user.get_full_name()}")
+            write_line(f"Дата: {self.today:%d-%m-%Y}")
+            write_line("Ингредиенты:")
+            for i, item in enumerate(self.get_ingredients(), start=1):
+                write_line(
+                    f"{i}. {item['ingredient__name'].capitalize()} "
+                    f"({item['ingredient__measurement_unit']}) - "
+                    f"{item['amount']}"
+                )
+            write_line("Рецепты:")
+            for recipe in self.get_recipes():
+                write_line(
+                    f"- {recipe.name} (@ {recipe.author.get_full_name()})"
+                )
+            write_line("")
+            write_line(f"Foodgram ({self.today:%Y})")
+            pdf.save()
+
+            file.seek(0)
+            while chunk := file.read(PDF_CHUNK_SIZE):
+                yield chunk
+
+
+SHOPPING_LIST_RENDERERS = {
+    renderer.extension: renderer
+    for renderer in (
+        TxtShoppingListRenderer,
+        CsvShoppingListRenderer,
+        PdfShoppingListRenderer,
+    )
+}
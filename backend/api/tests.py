@@ -0,0 +1,1810 @@
+import json
+import shutil
+import tempfile
+from base64 import b64encode
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, time, timedelta
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipIf
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection
+from django.db.models import Count
+from django.test import (
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.exceptions import ErrorDetail, ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory, APITestCase
+
+from api import filters, representations
+from api.feed_cache import STATS, feed_cache
+from api.loaders import SubscriptionLoader
+from api.parsers import ORJSONParser
+from api.renderers import ORJSONRenderer, orjson
+from api.serializers import (
+    IngredientSerializer,
+    RecipeReadSerializer,
+    RecipeShortSerializer,
+)
+from api.views import RECIPES_LIMIT_MAX
+
+from recipes import images, scores, short_links, timeline
+from recipes.images import requeue_stale_jobs
+from recipes.ingredient_index import IngredientSnapshot, ingredient_index
+from recipes.management.commands import load_ingredients
+from recipes.models import (
+    Favorite,
+    ImageJob,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Subscription,
+    User,
+)
+from recipes.pantry_index import PantryIndex
+from recipes.search import update_search_index
+from recipes.short_links import RecipeExistenceCache, recipe_existence_cache
+
+
+class RecipeTestCase(APITestCase):
+    """Рецепты нескольких авторов с продуктами, избранным и корзиной."""
+
+    recipes_count = 6
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer, *cls.authors = (
+            User.objects.create_user(
+                username=f"user{i}",
+                email=f"user{i}@example.com",
+                password="password",
+                first_name="Имя",
+                last_name="Фамилия",
+            )
+            for i in range(3)
+        )
+        Subscription.objects.create(
+            subscriber=cls.viewer, author=cls.authors[0]
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"продукт {i}", measurement_unit="г")
+            for i in range(4)
+        )
+        cls.recipes = [
+            Recipe.objects.create(
+                author=cls.authors[i % 2],
+                name=f"Рецепт {i}",
+                text="Описание",
+                cooking_time=i + 1,
+                image=f"recipes/images/{i}.png",
+            )
+            for i in range(cls.recipes_count)
+        ]
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=10)
+            for recipe in cls.recipes
+            for ingredient in cls.ingredients[:3]
+        )
+        for model in (Favorite, ShoppingCart):
+            model.objects.bulk_create(
+                model(user=cls.viewer, recipe=recipe)
+                for recipe in cls.recipes[::2]
+            )
+        # bulk_create не трогает счётчики и итоги корзин.
+        Recipe.change_counters_in(
+            [recipe.id for recipe in cls.recipes[::2]],
+            favorites_count=1,
+            in_carts_count=1,
+        )
+        ShoppingCartTotal.objects.rebuild()
+
+    def setUp(self):
+        # Страницы и версии кешируются между запросами.
+        cache.clear()
+
+
+class RecipeQueryCountTests(RecipeTestCase):
+    """Число запросов к БД не зависит от размера страницы."""
+
+    limits = (1, 6, 30)
+    extra_recipes = (0, 40)
+
+    def add_recipes(self, count):
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=self.authors[i % 2],
+                name=f"Ещё рецепт {i}",
+                text="Описание",
+                cooking_time=1,
+                image=f"recipes/images/extra{i}.png",
+            )
+            for i in range(count)
+        )
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in recipes
+            for ingredient in self.ingredients[:3]
+        )
+
+    def assertListQueries(self, queries):
+        added = 0
+        for extra in self.extra_recipes:
+            self.add_recipes(extra - added)
+            added = extra
+            total = self.recipes_count + extra
+            for limit in self.limits:
+                with self.subTest(recipes=total, limit=limit):
+                    cache.clear()
+                    with self.assertNumQueries(queries):
+                        response = self.client.get(
+                            "/api/recipes/", {"limit": limit}
+                        )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data["count"], total)
+                    self.assertEqual(
+                        len(response.data["results"]), min(limit, total)
+                    )
+
+    def test_list_anonymous(self):
+        self.assertListQueries(6)
+
+    def test_list_authenticated(self):
+        self.client.force_authenticate(self.viewer)
+        self.assertListQueries(10)
+
+    def test_list_flags(self):
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+        results = {item["id"]: item for item in response.data["results"]}
+        for i, recipe in enumerate(self.recipes):
+            item = results[recipe.id]
+            self.assertEqual(item["is_favorited"], i % 2 == 0)
+            self.assertEqual(item["is_in_shopping_cart"], i % 2 == 0)
+            self.assertEqual(
+                item["author"]["is_subscribed"],
+                recipe.author_id == self.authors[0].id,
+            )
+            self.assertEqual(len(item["ingredients"]), 3)
+
+    def test_detail(self):
+        self.client.force_authenticate(self.viewer)
+        with self.assertNumQueries(4):
+            response = self.client.get(f"/api/recipes/{self.recipes[0].id}/")
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data["is_favorited"])
+        self.assertTrue(response.data["is_in_shopping_cart"])
+        self.assertTrue(response.data["author"]["is_subscribed"])
+        self.assertEqual(len(response.data["ingredients"]), 3)
+
+
+class FeedCacheTests(RecipeTestCase):
+    """Кэш страниц и фрагментов ленты рецептов (api.feed_cache)."""
+
+    def fetch(self, **params):
+        response = self.client.get("/api/recipes/", params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def fetch_counting(self, **params):
+        """Ответ и изменение счётчиков кэша за запрос."""
+        before = feed_cache.get_stats()
+        data = self.fetch(**params)
+        after = feed_cache.get_stats()
+        return data, {
+            stat: after[stat] - before[stat]
+            for stat in STATS if after[stat] != before[stat]
+        }
+
+    def test_page_miss_then_hit(self):
+        first, stats = self.fetch_counting()
+        self.assertEqual(stats, {"page_misses": 1, "fragment_misses": 6})
+        second, stats = self.fetch_counting()
+        self.assertEqual(stats, {"page_hits": 1, "fragment_hits": 6})
+        self.assertEqual(second, first)
+
+    def test_recipe_save_invalidates(self):
+        self.fetch()
+        recipe = self.recipes[1]
+        recipe.name = "Новое название"
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        data, stats = self.fetch_counting()
+        self.assertEqual(stats, {
+            "page_misses": 1, "fragment_hits": 5, "fragment_misses": 1,
+        })
+        names = {item["id"]: item["name"] for item in data["results"]}
+        self.assertEqual(names[recipe.id], "Новое название")
+
+    def test_recipe_delete_invalidates(self):
+        self.fetch()
+        recipe = Recipe.objects.get(pk=self.recipes[1].pk)
+        fragment_key = feed_cache.get_fragment_key(
+            recipe.id, recipe.updated_at.timestamp()
+        )
+        self.assertIsNotNone(cache.get(fragment_key))
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertIsNone(cache.get(fragment_key))
+        data, stats = self.fetch_counting()
+        self.assertEqual(stats, {"page_misses": 1, "fragment_hits": 5})
+        self.assertEqual(data["count"], self.recipes_count - 1)
+        self.assertNotIn(
+            self.recipes[1].id, [item["id"] for item in data["results"]]
+        )
+
+    def test_author_change_invalidates(self):
+        self.fetch()
+        author = self.authors[1]
+        author.first_name = "Новое имя"
+        with self.captureOnCommitCallbacks(execute=True):
+            author.save()
+        data, stats = self.fetch_counting()
+        self.assertEqual(stats, {
+            "page_misses": 1, "fragment_hits": 3, "fragment_misses": 3,
+        })
+        for item in data["results"]:
+            self.assertEqual(
+                item["author"]["first_name"],
+                "Новое имя" if item["author"]["id"] == author.id else "Имя",
+            )
+
+    def test_viewer_flags_merged_into_shared_fragments(self):
+        anonymous = self.fetch()
+        for user in (self.viewer, self.authors[1]):
+            self.client.force_authenticate(user)
+            data, stats = self.fetch_counting()
+            # Фрагменты общие для всех зрителей, флаги — свои.
+            self.assertEqual(stats, {"page_hits": 1, "fragment_hits": 6})
+            results = {item["id"]: item for item in data["results"]}
+            for i, recipe in enumerate(self.recipes):
+                item = results[recipe.id]
+                own = user == self.viewer and i % 2 == 0
+                self.assertEqual(item["is_favorited"], own)
+                self.assertEqual(item["is_in_shopping_cart"], own)
+                self.assertEqual(
+                    item["author"]["is_subscribed"],
+                    user == self.viewer
+                    and recipe.author_id == self.authors[0].id,
+                )
+                self.assertTrue(
+                    item["image"].startswith("http://testserver/media/")
+                )
+        # Флаги зрителей не попали в общие фрагменты.
+        self.client.force_authenticate(None)
+        self.assertEqual(self.fetch(), anonymous)
+        self.assertFalse(any(
+            item["is_favorited"] or item["author"]["is_subscribed"]
+            for item in anonymous["results"]
+        ))
+
+    def test_cursor_and_viewer_filters_not_cached(self):
+        self.client.force_authenticate(self.viewer)
+        for params in (
+            {"cursor": ""},
+            {"is_favorited": 1},
+            {"is_in_shopping_cart": 1},
+        ):
+            with self.subTest(params=params):
+                data, stats = self.fetch_counting(**params)
+                self.assertEqual(stats, {})
+                self.assertTrue(data["results"])
+
+
+class SubscriptionListTests(RecipeTestCase):
+    """Подписки с превью рецептов загружаются одним набором запросов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        Subscription.objects.create(
+            subscriber=cls.viewer, author=cls.authors[1]
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_authenticate(self.viewer)
+
+    def get_previews(self, **params):
+        response = self.client.get("/api/users/subscriptions/", params)
+        self.assertEqual(response.status_code, 200)
+        return {
+            author["id"]: [recipe["id"] for recipe in author["recipes"]]
+            for author in response.data["results"]
+        }
+
+    def get_latest(self, author, count):
+        return [
+            recipe.id for recipe in reversed(self.recipes)
+            if recipe.author_id == author.id
+        ][:count]
+
+    def add_recipes(self, author, count):
+        return Recipe.objects.bulk_create(
+            Recipe(
+                author=author,
+                name=f"Ещё рецепт {i}",
+                text="Описание",
+                cooking_time=1,
+                image=f"recipes/images/extra{i}.png",
+            )
+            for i in range(count)
+        )
+
+    def test_recipes_limit(self):
+        for recipes_limit, count in (
+            ("1", 1), ("2", 2), ("0", 0), ("-1", 0), ("", 3), ("два", 3),
+        ):
+            with self.subTest(recipes_limit=recipes_limit):
+                self.assertEqual(
+                    self.get_previews(recipes_limit=recipes_limit),
+                    {
+                        author.id: self.get_latest(author, count)
+                        for author in self.authors
+                    },
+                )
+
+    def test_recipes_limit_max(self):
+        author = self.authors[0]
+        self.add_recipes(author, RECIPES_LIMIT_MAX)
+        for params in ({}, {"recipes_limit": RECIPES_LIMIT_MAX * 10}):
+            with self.subTest(**params):
+                previews = self.get_previews(**params)
+                self.assertEqual(
+                    len(previews[author.id]), RECIPES_LIMIT_MAX
+                )
+                self.assertEqual(
+                    previews[self.authors[1].id],
+                    self.get_latest(self.authors[1], 3),
+                )
+
+    def test_queries(self):
+        """Число запросов не зависит от числа авторов и рецептов."""
+        for extra in (0, 5):
+            authors = User.objects.bulk_create(
+                User(
+                    username=f"{extra}author{i}",
+                    email=f"{extra}author{i}@example.com",
+                )
+                for i in range(extra)
+            )
+            Subscription.objects.bulk_create(
+                Subscription(subscriber=self.viewer, author=author)
+                for author in authors
+            )
+            for author in authors:
+                self.add_recipes(author, 4)
+            with self.subTest(extra_authors=extra):
+                # COUNT, страница авторов и превью всех авторов страницы.
+                with self.assertNumQueries(3):
+                    previews = self.get_previews(recipes_limit=2, limit=10)
+                self.assertEqual(len(previews), len(self.authors) + extra)
+                self.assertTrue(all(
+                    len(preview) == 2 for preview in previews.values()
+                ))
+
+
+class RecipeUpdateTests(RecipeTestCase):
+    def test_patch_writes_only_differences(self):
+        """Один DELETE, один UPDATE и один INSERT на продукты рецепта,
+        по строке на каждый."""
+        recipe = self.recipes[0]
+        first, second, _ = self.ingredients[:3]
+        self.client.force_authenticate(recipe.author)
+        cursors = []
+
+        def record_cursor(execute, sql, params, many, context):
+            # rowcount читается после запроса: у INSERT ... RETURNING он
+            # известен, только когда строки получены.
+            cursors.append((sql, context["cursor"]))
+            return execute(sql, params, many, context)
+
+        # Рецепт и продукты запроса; разница продуктов вместе с итогами
+        # корзин; сохранение рецепта (с чтением прежнего автора) и
+        # поискового индекса — на SQLite два запроса к FTS; ответ.
+        with (
+            self.assertNumQueries(27),
+            connection.execute_wrapper(record_cursor),
+        ):
+            response = self.client.patch(
+                f"/api/recipes/{recipe.id}/",
+                {
+                    "ingredients": [
+                        {"id": first.id, "amount": 10},
+                        {"id": second.id, "amount": 5},
+                        {"id": self.ingredients[3].id, "amount": 7},
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        table = connection.ops.quote_name(IngredientRecipe._meta.db_table)
+        for statement in (
+            f"DELETE FROM {table}",
+            f"UPDATE {table}",
+            f"INSERT INTO {table}",
+        ):
+            with self.subTest(statement=statement):
+                self.assertEqual(
+                    [
+                        cursor.rowcount for sql, cursor in cursors
+                        if sql.startswith(statement)
+                    ],
+                    [1],
+                )
+        self.assertEqual(
+            dict(recipe.recipe_ingredients.values_list(
+                "ingredient_id", "amount"
+            )),
+            {first.id: 10, second.id: 5, self.ingredients[3].id: 7},
+        )
+
+    def test_unknown_ingredients(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(recipe.author)
+        response = self.client.patch(
+            f"/api/recipes/{recipe.id}/",
+            {"ingredients": [
+                {"id": self.ingredients[0].id, "amount": 1},
+                {"id": 10 ** 6, "amount": 1},
+            ]},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {"ingredients": ["Продукты не найдены: 1000000"]},
+        )
+
+
+class RecipeVersionTests(RecipeTestCase):
+    """Версия списка рецептов — строка DataVersion, а не COUNT и MAX."""
+
+    def test_list_follows_recipe_changes(self):
+        first = self.client.get("/api/recipes/")
+        recipe = self.recipes[-1]
+        self.client.force_authenticate(recipe.author)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f"/api/recipes/{recipe.id}/",
+                {
+                    "name": "Новое название",
+                    "ingredients": [
+                        {"id": self.ingredients[0].id, "amount": 1}
+                    ],
+                },
+                format="json",
+            )
+        self.assertEqual(response.status_code, 200)
+        self.client.force_authenticate(None)
+        second = self.client.get(
+            "/api/recipes/", HTTP_IF_NONE_MATCH=first["ETag"]
+        )
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.data["results"][0]["name"], "Новое название")
+
+    def test_cursor_page_skips_count(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get("/api/recipes/?cursor=&limit=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data["results"]), 2)
+        for query in queries:
+            self.assertNotIn("COUNT(", query["sql"])
+
+
+class CursorTests(RecipeTestCase):
+    def get(self, path, position):
+        cursor = b64encode(json.dumps(position).encode()).decode()
+        return self.client.get(path, {"cursor": cursor})
+
+    def test_pages_follow_cursor(self):
+        response = self.client.get("/api/recipes/?cursor=&limit=4")
+        next_link = response.data["next"]
+        response = self.client.get(next_link)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["id"] for item in response.data["results"]],
+            [recipe.id for recipe in self.recipes[1::-1]],
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_tampered_cursor(self):
+        self.client.force_authenticate(self.viewer)
+        for path in ("/api/recipes/", "/api/recipes/feed/"):
+            for position in (
+                ["bad", 1],
+                [{"a": 1}, 1],
+                ["2020-01-01T00:00:00", "x"],
+                ["2020-01-01T00:00:00", 2 ** 70],
+                ["2020-01-01T00:00:00"],
+            ):
+                with self.subTest(path=path, position=position):
+                    response = self.get(path, position)
+                    self.assertEqual(response.status_code, 404)
+        response = self.get("/api/users/subscriptions/", [{"a": 1}, 1])
+        self.assertEqual(response.status_code, 404)
+        response = self.get("/api/recipes/", ["2020-01-01T00:00:00", 1])
+        self.assertEqual(response.status_code, 200)
+
+
+class BulkRelationTests(RecipeTestCase):
+    def test_add_and_remove_many(self):
+        recipe_ids = [recipe.id for recipe in self.recipes[:2]]
+        added = ShoppingCart.objects.add_many(
+            "recipe", [*recipe_ids, 10 ** 6], user_id=self.viewer.id
+        )
+        # recipes[0] уже в корзине, несуществующий рецепт пропущен
+        self.assertEqual(added, {recipe_ids[1]})
+        removed = ShoppingCart.objects.remove_many(
+            "recipe", recipe_ids, user_id=self.viewer.id
+        )
+        self.assertEqual(removed, set(recipe_ids))
+        self.assertEqual(
+            ShoppingCart.objects.remove_many(
+                "recipe", recipe_ids, user_id=self.viewer.id
+            ),
+            set(),
+        )
+
+    def test_bulk_remove_queries(self):
+        """Число запросов не зависит от числа удаляемых рецептов."""
+        self.client.force_authenticate(self.viewer)
+        counts = []
+        for recipes in (self.recipes[:1], self.recipes[2::2]):
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.delete(
+                    "/api/recipes/shopping_cart/",
+                    {"ids": [recipe.id for recipe in recipes]},
+                    format="json",
+                )
+            self.assertEqual(
+                [item["status"] for item in response.data["results"]],
+                ["removed"] * len(recipes),
+            )
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+        self.assertFalse(ShoppingCart.objects.filter(user=self.viewer))
+        self.assertFalse(
+            ShoppingCartTotal.objects.filter(user=self.viewer, amount__gt=0)
+        )
+
+    def test_counters_follow_changed_rows(self):
+        self.client.force_authenticate(self.viewer)
+        recipe_ids = [recipe.id for recipe in self.recipes[:2]]
+        for method, statuses, favorites in (
+            ("post", ["exists", "added"], [1, 1]),
+            ("post", ["exists", "exists"], [1, 1]),
+            ("delete", ["removed", "removed"], [0, 0]),
+            ("delete", ["absent", "absent"], [0, 0]),
+        ):
+            response = getattr(self.client, method)(
+                "/api/recipes/favorite/", {"ids": recipe_ids}, format="json"
+            )
+            self.assertEqual(
+                [item["status"] for item in response.data["results"]],
+                statuses,
+            )
+            self.assertEqual(
+                [
+                    Recipe.objects.get(pk=pk).favorites_count
+                    for pk in recipe_ids
+                ],
+                favorites,
+            )
+        author = self.authors[1]
+        for method, status, subscribers in (
+            ("post", "added", 1),
+            ("post", "exists", 1),
+            ("delete", "removed", 0),
+            ("delete", "absent", 0),
+        ):
+            response = getattr(self.client, method)(
+                "/api/users/subscribe/",
+                {"ids": [author.id, self.viewer.id]},
+                format="json",
+            )
+            self.assertEqual(
+                [item["status"] for item in response.data["results"]],
+                [status, "self"],
+            )
+            author.refresh_from_db()
+            self.assertEqual(author.subscribers_count, subscribers)
+
+
+class CounterTests(RecipeTestCase):
+    """Счётчики сходятся с числом строк при любых способах изменения."""
+
+    def assertCounters(self):
+        for field, expression in (
+            ("favorites_count", Count("favorite_recipes", distinct=True)),
+            ("in_carts_count", Count("shopping_carts", distinct=True)),
+        ):
+            for recipe in Recipe.objects.annotate(actual=expression):
+                with self.subTest(recipe=recipe.pk, field=field):
+                    self.assertEqual(getattr(recipe, field), recipe.actual)
+        for field, expression in (
+            ("recipes_count", Count("recipes", distinct=True)),
+            ("subscribers_count", Count("authors", distinct=True)),
+            ("subscriptions_count", Count("subscribers", distinct=True)),
+        ):
+            for user in User.objects.annotate(actual=expression):
+                with self.subTest(user=user.pk, field=field):
+                    self.assertEqual(getattr(user, field), user.actual)
+
+    def test_single_endpoints(self):
+        self.client.force_authenticate(self.viewer)
+        recipe, author = self.recipes[1], self.authors[1]
+        for method, success in (("post", 201), ("delete", 204)):
+            for path in (
+                f"/api/recipes/{recipe.id}/favorite/",
+                f"/api/recipes/{recipe.id}/shopping_cart/",
+                f"/api/users/{author.id}/subscribe/",
+            ):
+                with self.subTest(path=path, method=method):
+                    response = getattr(self.client, method)(path)
+                    self.assertEqual(response.status_code, success)
+                    self.assertCounters()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.favorites_count, 0)
+        self.assertEqual(recipe.in_carts_count, 0)
+
+    def test_cascades(self):
+        self.viewer.delete()
+        self.assertCounters()
+        self.assertEqual(
+            User.objects.get(pk=self.authors[0].pk).subscribers_count, 0
+        )
+        self.recipes[1].delete()
+        self.authors[0].delete()
+        self.assertCounters()
+
+    def test_model_edits(self):
+        """Правки через save() и delete(), как в админке."""
+        favorite = Favorite.objects.create(
+            user=self.authors[0], recipe=self.recipes[1]
+        )
+        self.assertCounters()
+        favorite.recipe = self.recipes[3]
+        favorite.save()
+        self.assertCounters()
+        subscription = Subscription.objects.get(subscriber=self.viewer)
+        subscription.author = self.authors[1]
+        subscription.save()
+        self.assertCounters()
+        recipe = self.recipes[0]
+        recipe.author = self.authors[1]
+        recipe.save()
+        self.assertCounters()
+        Favorite.objects.all().delete()
+        subscription.delete()
+        self.assertCounters()
+
+    def test_recount(self):
+        Recipe.objects.update(favorites_count=5, in_carts_count=0)
+        User.objects.update(
+            recipes_count=0, subscribers_count=7, subscriptions_count=7
+        )
+        call_command("recount", stdout=StringIO())
+        self.assertCounters()
+
+
+class RelationIdTests(RecipeTestCase):
+    def test_out_of_range_ids(self):
+        self.client.force_authenticate(self.viewer)
+        for pk in (2 ** 70, 2 ** 63, 0, -1):
+            for path in (
+                f"/api/recipes/{pk}/favorite/",
+                f"/api/recipes/{pk}/shopping_cart/",
+                f"/api/users/{pk}/subscribe/",
+            ):
+                for method in ("post", "delete"):
+                    with self.subTest(path=path, method=method):
+                        response = getattr(self.client, method)(path)
+                        self.assertEqual(response.status_code, 404)
+        response = self.client.post(
+            "/api/recipes/favorite/", {"ids": [2 ** 70]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class RelationConcurrencyTests(TransactionTestCase):
+    """Одинаковые запросы из нескольких потоков меняют связь один раз."""
+
+    workers = 8
+    requests = 24
+
+    def setUp(self):
+        self.author, self.viewer = (
+            User.objects.create_user(
+                username=role,
+                email=f"{role}@example.com",
+                password="password",
+                first_name="Имя",
+                last_name="Фамилия",
+            )
+            for role in ("author", "viewer")
+        )
+        self.recipe = Recipe.objects.create(
+            author=self.author,
+            name="Рецепт",
+            text="Описание",
+            cooking_time=1,
+            image="recipes/images/race.png",
+        )
+
+    def hammer(self, method, path):
+        def send(_):
+            client = APIClient()
+            client.force_authenticate(self.viewer)
+            try:
+                return getattr(client, method)(path).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.workers) as executor:
+            return Counter(executor.map(send, range(self.requests)))
+
+    def test_toggle(self):
+        for path, relations, counter in (
+            (
+                f"/api/recipes/{self.recipe.id}/favorite/",
+                Favorite.objects.filter(user=self.viewer),
+                lambda: Recipe.objects.get(pk=self.recipe.pk).favorites_count,
+            ),
+            (
+                f"/api/recipes/{self.recipe.id}/shopping_cart/",
+                ShoppingCart.objects.filter(user=self.viewer),
+                lambda: Recipe.objects.get(pk=self.recipe.pk).in_carts_count,
+            ),
+            (
+                f"/api/users/{self.author.id}/subscribe/",
+                Subscription.objects.filter(subscriber=self.viewer),
+                lambda: User.objects.get(pk=self.author.pk).subscribers_count,
+            ),
+        ):
+            for method, success, rows in (
+                ("post", 201, 1),
+                ("delete", 204, 0),
+            ):
+                with self.subTest(path=path, method=method):
+                    statuses = self.hammer(method, path)
+                    self.assertEqual(
+                        statuses,
+                        Counter({success: 1, 400: self.requests - 1}),
+                    )
+                    self.assertEqual(relations.count(), rows)
+                    self.assertEqual(counter(), rows)
+
+
+class RepresentationTests(RecipeTestCase):
+    """api.representations отдаёт то же, что поля DRF, байт в байт."""
+
+    variants = {
+        "card": {
+            "jpeg": "recipes/images/variants/рецепт 1_card.jpg",
+            "webp": "recipes/images/variants/../1_card.webp",
+        },
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for recipe, image in zip(cls.recipes, (
+            "recipes/images/рецепт 1 (копия).png",
+            "recipes/images/a//b.png",
+            "recipes/images/%20#?.png",
+        )):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                image=image, image_variants=cls.variants
+            )
+        User.objects.filter(pk=cls.authors[0].pk).update(
+            avatar="users/аватар.png", avatar_variants=cls.variants
+        )
+
+    def make_request(self, user):
+        request = Request(APIRequestFactory().get("/api/recipes/"))
+        request.user = user
+        return request
+
+    def assertSameOutput(self, serializer_class, queryset, user=None):
+        renderer = JSONRenderer()
+        for request in (None, self.make_request(user or self.viewer)):
+            with self.subTest(request=request):
+                items = list(queryset.all())
+                compiled = serializer_class(
+                    items, many=True, context={"request": request}
+                ).data
+                # Ссылки на варианты — через storage.url, как до
+                # get_media_prefix.
+                with mock.patch.object(
+                    representations, "get_media_prefix", return_value=None
+                ):
+                    if request is not None:
+                        SubscriptionLoader.for_request(request).load(
+                            item.author for item in items
+                            if hasattr(item, "author")
+                        )
+                    serializer = serializer_class(
+                        context={"request": request}
+                    )
+                    reference = [
+                        serializers.ModelSerializer.to_representation(
+                            serializer, item
+                        )
+                        for item in queryset.all()
+                    ]
+                self.assertEqual(
+                    renderer.render(compiled), renderer.render(reference)
+                )
+
+    def test_recipes(self):
+        self.assertSameOutput(
+            RecipeReadSerializer,
+            Recipe.objects.select_related("author")
+            .with_user_flags(self.viewer)
+            .prefetch_related("recipe_ingredients__ingredient"),
+        )
+
+    def test_recipes_without_flags(self):
+        self.assertSameOutput(
+            RecipeReadSerializer,
+            Recipe.objects.select_related("author").prefetch_related(
+                "recipe_ingredients__ingredient"
+            ),
+        )
+
+    def test_short_recipes(self):
+        self.assertSameOutput(RecipeShortSerializer, Recipe.objects.all())
+
+    def test_ingredients(self):
+        self.assertSameOutput(IngredientSerializer, Ingredient.objects.all())
+
+
+class RendererTests(SimpleTestCase):
+    """ORJSONRenderer отдаёт те же байты, что JSONRenderer."""
+
+    data = {
+        "decimal": Decimal("1.10"),
+        "datetime": datetime(2024, 1, 2, 3, 4, 5, 123456, dt_timezone.utc),
+        "naive": datetime(2024, 1, 2, 3, 4, 5),
+        "time": time(1, 2, 3),
+        "lazy": gettext_lazy("Имя"),
+        "separators": "a\u2028b\u2029c",
+        "name": "Щи «по-домашнему»",
+        1: [None, True, 1.5, {"nested": "значение"}],
+        "big": 2 ** 70,
+    }
+
+    def assertSameOutput(self, data, media_type=None, context=None,
+                         **attrs):
+        renderers = [JSONRenderer(), ORJSONRenderer()]
+        for renderer in renderers:
+            renderer.__dict__.update(attrs)
+        self.assertEqual(
+            *(
+                renderer.render(data, media_type, context)
+                for renderer in renderers
+            )
+        )
+
+    def test_types(self):
+        for key, value in self.data.items():
+            with self.subTest(key=key):
+                self.assertSameOutput({key: value})
+        self.assertSameOutput(self.data)
+        self.assertSameOutput(None)
+
+    @skipIf(orjson is None, "orjson не установлен")
+    def test_plain_data_skips_json_renderer(self):
+        data = dict(self.data)
+        del data["big"]
+        with mock.patch.object(
+            JSONRenderer, "render", side_effect=AssertionError
+        ):
+            ORJSONRenderer().render(data)
+
+    def test_fallbacks(self):
+        self.assertSameOutput(self.data, ensure_ascii=True)
+        self.assertSameOutput(self.data, compact=False)
+        self.assertSameOutput(self.data, "application/json; indent=2")
+        self.assertSameOutput(self.data, context={"indent": 4})
+
+    @skipIf(orjson is None, "orjson не установлен")
+    def test_nan(self):
+        """NaN orjson пишет как null, а JSONRenderer с STRICT_JSON
+        отказывается кодировать."""
+        with self.assertRaises(ValueError):
+            JSONRenderer().render({"value": float("nan")})
+        self.assertEqual(
+            ORJSONRenderer().render({"value": float("nan")}),
+            b'{"value":null}',
+        )
+
+
+class ParserTests(SimpleTestCase):
+    """ORJSONParser разбирает тело и сообщает об ошибках как JSONParser."""
+
+    def parse(self, parser, body, encoding="utf-8"):
+        try:
+            return parser.parse(BytesIO(body), None, {"encoding": encoding})
+        except ParseError as error:
+            return error.detail
+
+    def assertSameResult(self, body, encoding="utf-8"):
+        self.assertEqual(
+            *(
+                self.parse(parser, body, encoding)
+                for parser in (JSONParser(), ORJSONParser())
+            )
+        )
+
+    def test_valid(self):
+        self.assertEqual(
+            self.parse(ORJSONParser(), '{"name": "Щи"}'.encode()),
+            {"name": "Щи"},
+        )
+        self.assertSameResult(b"[1, 2.5, null, true]")
+
+    def test_errors(self):
+        for body in (
+            b"",
+            b'{"name": ',
+            b'{"value": NaN}',
+            b'{"a": 1}{"b": 2}',
+            b'\xef\xbb\xbf{"a": 1}',
+            b'{"name": "\xff"}',
+        ):
+            with self.subTest(body=body):
+                self.assertIsInstance(
+                    self.parse(ORJSONParser(), body), ErrorDetail
+                )
+                self.assertSameResult(body)
+
+    def test_other_encodings(self):
+        self.assertSameResult('{"name": "café"}'.encode("latin-1"), "latin-1")
+        self.assertSameResult('{"name": "Щи"}'.encode("utf-16"), "utf-16")
+
+    def test_api_error(self):
+        client = APIClient()
+        client.force_authenticate(
+            User(pk=1, username="user", email="user@example.com")
+        )
+        response = client.post(
+            "/api/recipes/", b'{"name": ', content_type="application/json"
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {
+                "detail": "JSON parse error - "
+                "Expecting value: line 1 column 10 (char 9)"
+            },
+        )
+
+
+class SearchTests(RecipeTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for i, name, text in (
+            (0, "Капустный пирог", "Описание"),
+            (2, "Капуста тушёная", "Описание"),
+            (3, "Капуста тушёная", "Описание"),
+            (5, "Суп", "Капуста и морковь"),
+        ):
+            Recipe.objects.filter(pk=cls.recipes[i].pk).update(
+                name=name, text=text
+            )
+        IngredientRecipe.objects.create(
+            recipe=cls.recipes[0], ingredient=cls.ingredients[3], amount=1
+        )
+        update_search_index()
+
+    def setUp(self):
+        super().setUp()
+        pantry_index = PantryIndex()
+        pantry_index.build()
+        pantry_index.refresh = lambda: None
+        self.enterContext(
+            mock.patch.object(filters, "pantry_index", pantry_index)
+        )
+
+    def search(self, **params):
+        response = self.client.get(
+            "/api/recipes/", {"search": "капуст", **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [item["id"] for item in response.data["results"]]
+
+    def test_query_without_words(self):
+        for text in ("*", '"', "-"):
+            for params in ({}, {"cursor": ""}):
+                with self.subTest(text=text, params=params):
+                    response = self.client.get(
+                        "/api/recipes/", {"search": text, **params}
+                    )
+                    self.assertEqual(response.status_code, 200)
+                    self.assertEqual(response.data["results"], [])
+
+    def test_ranked_by_relevance(self):
+        ids = self.search()
+        # Совпадения в названии выше совпадения в описании.
+        self.assertCountEqual(ids[:3], [
+            self.recipes[i].id for i in (0, 2, 3)
+        ])
+        self.assertEqual(ids[3:], [self.recipes[5].id])
+        # Одинаковые рецепты с равной релевантностью — новые выше.
+        self.assertLess(
+            ids.index(self.recipes[3].id), ids.index(self.recipes[2].id)
+        )
+
+    def test_combined_with_author(self):
+        author = self.recipes[5].author
+        ids = self.search(author=author.id)
+        self.assertEqual(ids, [
+            recipe_id for recipe_id in self.search()
+            if recipe_id in {
+                recipe.id for recipe in self.recipes
+                if recipe.author_id == author.id
+            }
+        ])
+        self.assertIn(self.recipes[5].id, ids)
+
+    def test_pantry_takes_precedence(self):
+        # Первому рецепту не хватает продукта 3: по подбору он ниже
+        # остальных, хотя по поиску выше описания.
+        pantry = ",".join(
+            str(ingredient.id) for ingredient in self.ingredients[:3]
+        )
+        ids = self.search(pantry=pantry)
+        self.assertEqual(ids[-1], self.recipes[0].id)
+        self.assertEqual(ids[:-1], [
+            recipe_id for recipe_id in self.search()
+            if recipe_id != self.recipes[0].id
+        ])
+
+    def test_cursor_follows_rank(self):
+        for params in ({}, {"pantry": str(self.ingredients[0].id)}):
+            with self.subTest(params=params):
+                expected = self.search(**params)
+                ids = []
+                response = self.client.get("/api/recipes/", {
+                    "search": "капуст", "cursor": "", "limit": 1, **params
+                })
+                while True:
+                    self.assertEqual(response.status_code, 200)
+                    ids.extend(
+                        item["id"] for item in response.data["results"]
+                    )
+                    if response.data["next"] is None:
+                        break
+                    response = self.client.get(response.data["next"])
+                self.assertEqual(ids, expected)
+
+
+@override_settings(FEED_FANOUT_MAX_SUBSCRIBERS=1)
+class TimelineTests(RecipeTestCase):
+    def subscribe(self, user, author, method="post"):
+        self.client.force_authenticate(user)
+        response = getattr(self.client, method)(
+            f"/api/users/{author.id}/subscribe/"
+        )
+        self.assertLess(response.status_code, 300)
+
+    def test_refill_below_threshold(self):
+        """Рецепт, выложенный при большом числе подписчиков, остаётся
+        в ленте, когда подписчиков становится не больше порога."""
+        author = self.authors[1]
+        self.subscribe(self.viewer, author)
+        self.subscribe(self.authors[0], author)
+        recipe = Recipe.objects.create(
+            author=author,
+            name="Новый рецепт",
+            text="Описание",
+            cooking_time=1,
+            image="recipes/images/new.png",
+        )
+        timeline.fan_out([recipe])
+        recipe_ids, _ = timeline.get_feed(self.viewer, 1)
+        self.assertEqual(recipe_ids, [recipe.id])
+        self.subscribe(self.authors[0], author, "delete")
+        recipe_ids, _ = timeline.get_feed(self.viewer, 1)
+        self.assertEqual(recipe_ids, [recipe.id])
+
+
+class ViewerStateTests(RecipeTestCase):
+    """ETag списка рецептов меняется вместе с избранным пользователя."""
+
+    def get_etag(self):
+        cache.clear()
+        response = self.client.get("/api/recipes/")
+        self.assertEqual(response.status_code, 200)
+        return response["ETag"]
+
+    def test_etag_follows_favorites(self):
+        self.client.force_authenticate(self.viewer)
+        recipe = self.recipes[1]
+        etags = [self.get_etag()]
+        self.client.post(f"/api/recipes/{recipe.id}/favorite/")
+        etags.append(self.get_etag())
+        self.client.delete(f"/api/recipes/{self.recipes[0].id}/favorite/")
+        etags.append(self.get_etag())
+        # Правки в обход API, как из админки.
+        Favorite.objects.create(user=self.viewer, recipe=self.recipes[0])
+        Favorite.objects.filter(user=self.viewer, recipe=recipe).delete()
+        etags.append(self.get_etag())
+        self.assertEqual(len(set(etags)), len(etags))
+
+    def test_etag_differs_between_users(self):
+        User.objects.filter(
+            pk__in=[self.viewer.pk, self.authors[1].pk]
+        ).update(relations_version=7)
+        etags = []
+        for user in (self.viewer, self.authors[1]):
+            self.client.force_authenticate(user)
+            etags.append(self.get_etag())
+        self.assertNotEqual(*etags)
+
+
+class RecipeScoreTests(RecipeTestCase):
+    """Пересчёт оценок переписывает только изменившиеся строки."""
+
+    def setUp(self):
+        super().setUp()
+        self.now = timezone.now()
+
+    def get_scores(self, field):
+        return dict(RecipeScore.objects.values_list("recipe_id", field))
+
+    def test_popular_follows_counters(self):
+        self.assertEqual(scores.refresh_popular(self.now), 3)
+        self.assertEqual(
+            self.get_scores("popular"),
+            {
+                recipe.id: 0 if i % 2 else 2
+                for i, recipe in enumerate(self.recipes)
+            },
+        )
+        self.assertEqual(scores.refresh_popular(self.now), 0)
+        Recipe.change_counters_in([self.recipes[1].id], favorites_count=1)
+        self.assertEqual(scores.refresh_popular(self.now), 1)
+        self.assertEqual(self.get_scores("popular")[self.recipes[1].id], 1)
+
+    def test_trending_ranks_recent_additions(self):
+        """Одно свежее добавление весит больше двух, сделанных полтора
+        периода полураспада назад."""
+        half_life = timedelta(hours=settings.RECIPE_TRENDING_HALF_LIFE_HOURS)
+        for model in (Favorite, ShoppingCart):
+            model.objects.update(created_at=self.now - half_life * 1.5)
+        Favorite.objects.create(user=self.authors[0], recipe=self.recipes[1])
+        scores.refresh_trending(self.now)
+        trending = self.get_scores("trending")
+        self.assertGreater(
+            trending[self.recipes[1].id], trending[self.recipes[0].id]
+        )
+        self.assertEqual(trending[self.recipes[3].id], 0)
+        response = self.client.get("/api/recipes/?ordering=trending")
+        self.assertEqual(
+            [recipe["id"] for recipe in response.data["results"][:4]],
+            [self.recipes[i].id for i in (1, 4, 2, 0)],
+        )
+
+    def test_trending_rewrites_only_changed_rows(self):
+        self.assertEqual(scores.refresh_trending(self.now), 3)
+        version = scores.get_scores_version()
+        later = self.now + timedelta(hours=1)
+        # Затухание само по себе оценки и версию лент не меняет.
+        self.assertEqual(scores.refresh_trending(later), 0)
+        self.assertEqual(scores.get_scores_version(), version)
+        Favorite.objects.create(user=self.authors[0], recipe=self.recipes[1])
+        self.assertEqual(scores.refresh_trending(later), 1)
+        self.assertEqual(scores.get_scores_version(), later)
+        # Добавления из фикстуры выпадают из окна, новое остаётся.
+        window = timedelta(days=settings.RECIPE_TRENDING_DAYS)
+        self.assertEqual(scores.refresh_trending(self.now + window), 3)
+        self.assertEqual(
+            {
+                recipe_id
+                for recipe_id, score in self.get_scores("trending").items()
+                if score
+            },
+            {self.recipes[1].id},
+        )
+
+
+class ShortLinkTests(RecipeTestCase):
+    def setUp(self):
+        super().setUp()
+        recipe_existence_cache.clear()
+        self.addCleanup(recipe_existence_cache.clear)
+
+    def test_encode_decode_round_trip(self):
+        ids = [*range(2000), 10 ** 6, 2 ** 32, 2 ** 40 - 1]
+        codes = [short_links.encode(recipe_id) for recipe_id in ids]
+        self.assertEqual(len(set(codes)), len(ids))
+        for recipe_id, code in zip(ids, codes):
+            self.assertIn(code[0], short_links.LETTERS)
+            self.assertEqual(short_links.decode(code), recipe_id)
+        for recipe_id in (-1, 2 ** 40):
+            with self.assertRaises(ValueError):
+                short_links.encode(recipe_id)
+
+    def test_permutation_is_bijective(self):
+        for start in (0, 2 ** 20 - 2 ** 11, 2 ** 40 - 2 ** 12):
+            values = range(start, start + 2 ** 12)
+            permuted = [short_links.permute(value) for value in values]
+            self.assertEqual(len(set(permuted)), len(values))
+            self.assertLess(max(permuted), 2 ** 40)
+            self.assertEqual(
+                [
+                    short_links.permute(value, inverse=True)
+                    for value in permuted
+                ],
+                list(values),
+            )
+
+    def test_decode_rejects_invalid_codes(self):
+        code = short_links.encode(self.recipes[0].id)
+        for invalid in ("", "0" + code, code + "-", code + "0", "z" * 9):
+            with self.subTest(code=invalid):
+                self.assertIsNone(short_links.decode(invalid))
+        self.assertIsNone(short_links.parse("٣"))
+
+    def test_legacy_numeric_links(self):
+        recipe = self.recipes[0]
+        self.assertEqual(short_links.parse(str(recipe.id)), recipe.id)
+        response = self.client.get(f"/s/{recipe.id}/")
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], f"/recipes/{recipe.id}/")
+
+    def test_middleware_redirects(self):
+        recipe = self.recipes[0]
+        response = self.client.get(f"/api/recipes/{recipe.id}/get-link/")
+        self.assertEqual(response.status_code, 200)
+        link = response.data["short-link"]
+        self.assertEqual(
+            link,
+            f"http://testserver/s/{short_links.encode(recipe.id)}/",
+        )
+        response = self.client.get(link)
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(response["Location"], f"/recipes/{recipe.id}/")
+        missing = max(recipe.id for recipe in self.recipes) + 1
+        for code in (short_links.encode(missing), str(missing), "0abc"):
+            with self.subTest(code=code):
+                response = self.client.get(f"/s/{code}/")
+                self.assertEqual(response.status_code, 404)
+
+    def test_deleted_recipe_invalidated_in_other_processes(self):
+        recipe = self.recipes[0]
+        # Кэш другого процесса: сигнал удаления его не затрагивает.
+        other = RecipeExistenceCache()
+        self.assertTrue(other.exists(recipe.id))
+        with self.assertNumQueries(0):
+            self.assertTrue(other.exists(recipe.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(pk=recipe.id).delete()
+        other.checked_at -= settings.SHORT_LINK_CHECK_INTERVAL
+        self.assertFalse(other.exists(recipe.id))
+
+
+class ShoppingListTests(RecipeTestCase):
+    def download(self, file_format):
+        self.client.force_authenticate(self.viewer)
+        response = self.client.get(
+            f"/api/recipes/download_shopping_cart/?format={file_format}"
+        )
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content).decode()
+
+    def test_csv_lists_recipes(self):
+        lines = self.download("csv").splitlines()
+        recipes_header = lines.index("Рецепт,Автор")
+        self.assertEqual(
+            lines[recipes_header + 1:],
+            [
+                f"{recipe.name},{recipe.author.get_full_name()}"
+                for recipe in self.recipes[::2]
+            ],
+        )
+
+
+class ShoppingCartTotalTests(TestCase):
+    """Итоги корзин следуют за правками через save() и delete()."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.buyer = (
+            User.objects.create_user(
+                username=name, email=f"{name}@example.com", password="x"
+            )
+            for name in ("author", "buyer")
+        )
+        cls.salt, cls.sugar = Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("соль", "сахар")
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author,
+            name="Рецепт",
+            text="Описание",
+            cooking_time=5,
+            image="recipes/images/1.png",
+        )
+        cls.salt_row = IngredientRecipe.objects.create(
+            recipe=cls.recipe, ingredient=cls.salt, amount=3
+        )
+
+    def setUp(self):
+        ShoppingCart.objects.create(user=self.buyer, recipe=self.recipe)
+
+    def get_totals(self, user=None):
+        return dict(
+            ShoppingCartTotal.objects.filter(
+                user=user or self.buyer
+            ).values_list("ingredient_id", "amount")
+        )
+
+    def assertTotals(self, expected):
+        self.assertEqual(self.get_totals(), expected)
+        self.assertEqual(
+            {
+                (row["recipe__shopping_carts__user"], row["ingredient"]):
+                    row["total"]
+                for row in ShoppingCartTotal.objects.compute()
+            },
+            {
+                (user_id, ingredient_id): amount
+                for user_id, ingredient_id, amount
+                in ShoppingCartTotal.objects.values_list(
+                    "user_id", "ingredient_id", "amount"
+                )
+            },
+        )
+
+    def test_cart_item_created(self):
+        self.assertTotals({self.salt.id: 3})
+
+    def test_ingredient_changed(self):
+        self.salt_row.amount = 5
+        self.salt_row.save()
+        IngredientRecipe.objects.create(
+            recipe=self.recipe, ingredient=self.sugar, amount=2
+        )
+        self.assertTotals({self.salt.id: 5, self.sugar.id: 2})
+        self.salt_row.delete()
+        self.assertTotals({self.sugar.id: 2})
+
+    def test_cart_item_deleted(self):
+        ShoppingCart.objects.filter(user=self.buyer).delete()
+        self.assertTotals({})
+
+    def test_recipe_deleted(self):
+        self.recipe.delete()
+        self.assertTotals({})
+
+    def test_author_deleted(self):
+        self.author.delete()
+        self.assertTotals({})
+
+    def test_buyer_deleted(self):
+        self.buyer.delete()
+        self.assertEqual(ShoppingCartTotal.objects.count(), 0)
+
+
+@override_settings(PANTRY_INDEX_CHECK_INTERVAL=60)
+class PantryIndexTests(RecipeTestCase):
+    def test_refresh_follows_version(self):
+        index = PantryIndex()
+        index.refresh()
+        ingredient = self.ingredients[3]
+        self.assertEqual(index.match({ingredient.id}), [])
+        recipe = self.recipes[0]
+        with self.captureOnCommitCallbacks(execute=True):
+            IngredientRecipe.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=1
+            )
+            recipe.save()
+        # Версию проверяет не чаще раза в PANTRY_INDEX_CHECK_INTERVAL
+        with self.assertNumQueries(0):
+            index.refresh()
+        index.checked_at = None
+        index.refresh()
+        self.assertEqual(index.match({ingredient.id}, 3), [(3, 1, recipe.id)])
+        # Без изменений — один поиск версии по первичному ключу
+        index.checked_at = None
+        with self.assertNumQueries(1):
+            index.refresh()
+
+
+class IngredientSearchTests(APITestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit="г")
+            for name in ("сахар", "сахарная пудра", "ванильный сахар", "соль")
+        )
+
+    def setUp(self):
+        cache.clear()
+        ingredient_index.snapshot = IngredientSnapshot()
+
+    def search(self, name):
+        response = self.client.get(f"/api/ingredients/?name={name}")
+        self.assertEqual(response.status_code, 200)
+        return [item["name"] for item in response.data]
+
+    def test_prefix_matches_first(self):
+        # Версия индекса и его построение; второй поиск — только версия.
+        with self.assertNumQueries(2):
+            names = self.search("сах")
+        self.assertEqual(names, ["сахар", "сахарная пудра", "ванильный сахар"])
+        with self.assertNumQueries(1):
+            self.search("пудра")
+
+    def test_index_follows_ingredient_changes(self):
+        self.assertEqual(self.search("мёд"), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            honey = Ingredient.objects.create(name="мёд", measurement_unit="г")
+        self.assertEqual(self.search("мёд"), ["мёд"])
+        with self.captureOnCommitCallbacks(execute=True):
+            honey.delete()
+        self.assertEqual(self.search("мёд"), [])
+
+    @override_settings(INGREDIENT_SEARCH_IN_MEMORY=False)
+    def test_database_search_skips_index(self):
+        self.assertEqual(self.search("соль"), ["соль"])
+        self.assertIsNone(ingredient_index.snapshot.version)
+
+
+class ImageJobTests(TransactionTestCase):
+    """Обработка очереди изображений вне транзакции теста."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        buffer = BytesIO()
+        Image.new("RGB", (640, 480)).save(buffer, "PNG")
+        author = User.objects.create_user(
+            username="author",
+            email="author@example.com",
+            password="password",
+            first_name="Имя",
+            last_name="Фамилия",
+        )
+        self.recipe = Recipe.objects.create(
+            author=author,
+            name="Рецепт",
+            text="Описание",
+            cooking_time=1,
+            image=default_storage.save(
+                "recipes/images/job.png", BytesIO(buffer.getvalue())
+            ),
+        )
+
+    def create_job(self, **fields):
+        return ImageJob.objects.create(
+            model="recipes.recipe",
+            object_id=self.recipe.id,
+            field="image",
+            source=self.recipe.image.name,
+            **fields,
+        )
+
+    def test_claim_retried_when_table_locked(self):
+        job = self.create_job()
+        claim_job = images.claim_job
+        calls = []
+
+        def locked_once(job_id):
+            calls.append(job_id)
+            if len(calls) == 1:
+                raise OperationalError("database table is locked")
+            return claim_job(job_id)
+
+        with mock.patch.object(images, "claim_job", locked_once), \
+                mock.patch.object(images, "LOCKED_DELAY", 0):
+            images.process_image_job(job.pk)
+        self.assertEqual(calls, [job.pk, job.pk])
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImageJob.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(
+            set(self.recipe.image_variants), set(images.VARIANTS)
+        )
+
+    def test_other_errors_not_retried(self):
+        failing = mock.Mock(side_effect=OperationalError("no such table"))
+        with self.assertRaises(OperationalError):
+            images.retry_locked(failing)
+        self.assertEqual(failing.call_count, 1)
+
+    @override_settings(IMAGE_PROCESSING_MODE="thread")
+    def test_thread_mode_resubmits_forgotten_jobs(self):
+        job = self.create_job()
+        with mock.patch.object(images, "_submit_to_pool") as pool, \
+                mock.patch.object(images, "_resubmitted_at", None):
+            images.submit(job.pk)
+            images.submit(job.pk)
+        # Поиск забытых задач — только при первой задаче процесса.
+        self.assertEqual(pool.call_args_list, [
+            mock.call(images.process_image_job, job.pk),
+            mock.call(images.resubmit_jobs),
+            mock.call(images.process_image_job, job.pk),
+        ])
+
+        stale = self.create_job(status=ImageJob.PROCESSING, attempts=1)
+        self.create_job(status=ImageJob.DONE)
+        ImageJob.objects.filter(pk=stale.pk).update(
+            updated_at=timezone.now() - timedelta(
+                seconds=settings.IMAGE_PROCESSING_TIMEOUT + 1
+            )
+        )
+        with mock.patch.object(images, "_submit_to_pool") as pool:
+            images.resubmit_jobs()
+        self.assertCountEqual(pool.call_args_list, [
+            mock.call(images.process_image_job, job.pk),
+            mock.call(images.process_image_job, stale.pk),
+        ])
+
+
+class LoadIngredientsTests(TestCase):
+    items = [
+        {"name": f"продукт «{i}» \\ \"{i}\"", "measurement_unit": "г"}
+        for i in range(20)
+    ]
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.directory = directory
+
+    def write(self, name, text):
+        path = f"{self.directory}/{name}"
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+        return path
+
+    def load(self, path, **options):
+        out = StringIO()
+        call_command("load_ingredients", path=path, stdout=out, **options)
+        return out.getvalue()
+
+    def test_iter_json_across_chunk_boundaries(self):
+        text = json.dumps(self.items, ensure_ascii=False, indent=1)
+        for size in (1, 2, 7, 64):
+            with self.subTest(size=size), mock.patch.object(
+                load_ingredients, "READ_CHUNK_SIZE", size
+            ):
+                self.assertEqual(
+                    list(load_ingredients.iter_json(StringIO(text))),
+                    self.items,
+                )
+
+    def test_iter_json_rejects_malformed_input(self):
+        for text in (
+            '{"name": "соль"}',
+            '[{"name": "соль"}',
+            '[{"name": "соль"},',
+            '[{"name": }]',
+            "",
+        ):
+            with self.subTest(text=text), mock.patch.object(
+                load_ingredients, "READ_CHUNK_SIZE", 3
+            ):
+                with self.assertRaises(ValueError):
+                    list(load_ingredients.iter_json(StringIO(text)))
+
+    def test_iter_csv(self):
+        rows = list(load_ingredients.iter_csv(
+            StringIO('соль,г\n\n"мука, пшеничная",кг\n')
+        ))
+        self.assertEqual(rows, [
+            {"name": "соль", "measurement_unit": "г"},
+            {"name": "мука, пшеничная", "measurement_unit": "кг"},
+        ])
+        with self.assertRaises(ValueError):
+            list(load_ingredients.iter_csv(StringIO("соль,г,лишнее\n")))
+
+    def test_counts_duplicates_within_and_across_batches(self):
+        Ingredient.objects.create(**self.items[0])
+        # Повторы и внутри пачки, и в соседних пачках по 3 строки.
+        items = self.items[:5] + self.items[:5] + self.items[3:6]
+        path = self.write("ingredients.json", json.dumps(items))
+        output = self.load(path, batch_size=3, dry_run=True)
+        self.assertIn("добавлено 5, пропущено 8", output)
+        self.assertEqual(Ingredient.objects.count(), 1)
+
+        output = self.load(path, batch_size=3)
+        self.assertIn("добавлено 5, пропущено 8", output)
+        self.assertEqual(Ingredient.objects.count(), 6)
+
+        output = self.load(path, batch_size=3)
+        self.assertIn("добавлено 0, пропущено 13", output)
+        self.assertEqual(Ingredient.objects.count(), 6)
+
+    def test_csv_file(self):
+        path = self.write("ingredients.csv", "соль,г\nсоль,г\nмука,кг\n")
+        self.assertIn("добавлено 2, пропущено 1", self.load(path))
+        self.assertEqual(
+            set(Ingredient.objects.values_list("name", "measurement_unit")),
+            {("соль", "г"), ("мука", "кг")},
+        )
+
+    def test_malformed_file_is_command_error(self):
+        for name, text in (
+            ("broken.json", '[{"name": "соль", "measurement_unit": "г"}'),
+            ("missing.json", '[{"name": "соль"}]'),
+            ("columns.csv", "соль\n"),
+        ):
+            with self.subTest(name=name):
+                with self.assertRaises(CommandError):
+                    self.load(self.write(name, text))
+
+
+class RecipeTransferTests(RecipeTestCase):
+    """export_recipes и import_recipes переносят рецепты без потерь."""
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(
+            MEDIA_ROOT=media_root, IMAGE_PROCESSING_MODE="worker"
+        ))
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        for i, recipe in enumerate(self.recipes):
+            default_storage.save(recipe.image.name, BytesIO(bytes([i]) * 64))
+        # Разные рецепты автора с одним названием различаются датой.
+        Recipe.objects.filter(pk=self.recipes[3].pk).update(
+            name=self.recipes[1].name
+        )
+        for i, recipe in enumerate(self.recipes):
+            Recipe.objects.filter(pk=recipe.pk).update(
+                pub_date=timezone.now() - timedelta(days=i, microseconds=i)
+            )
+
+    def snapshot(self):
+        recipes = Recipe.objects.select_related("author").prefetch_related(
+            "recipe_ingredients__ingredient"
+        )
+        result = {}
+        for recipe in recipes:
+            with default_storage.open(recipe.image.name) as image:
+                content = image.read()
+            result[recipe.author.email, recipe.name, recipe.pub_date] = (
+                recipe.text,
+                recipe.cooking_time,
+                content,
+                {
+                    (item.ingredient.name, item.amount)
+                    for item in recipe.recipe_ingredients.all()
+                },
+            )
+        return result
+
+    def run_import(self):
+        out = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command("import_recipes", self.path, stdout=out)
+        return out.getvalue()
+
+    def test_round_trip(self):
+        expected = self.snapshot()
+        call_command("export_recipes", self.path, stdout=StringIO())
+        Recipe.objects.all().delete()
+
+        output = self.run_import()
+        self.assertIn("добавлено 6, уже были 0", output)
+        self.assertEqual(self.snapshot(), expected)
+        self.assertEqual(
+            ImageJob.objects.count(), self.recipes_count
+        )
+        for author in self.authors:
+            author.refresh_from_db()
+            self.assertEqual(author.recipes_count, 3)
+
+    def test_repeated_import_adds_nothing(self):
+        call_command("export_recipes", self.path, stdout=StringIO())
+        self.assertIn("добавлено 0, уже были 6", self.run_import())
+        self.assertEqual(Recipe.objects.count(), self.recipes_count)
+
+
+@override_settings(IMAGE_PROCESSING_MODE="worker")
+class ImageVariantsTests(RecipeTestCase):
+    variants = {"card": {"webp": "recipes/images/variants/0_card.webp"}}
+
+    def setUp(self):
+        super().setUp()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.recipe = self.recipes[0]
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_variants=self.variants
+        )
+        self.client.force_authenticate(self.recipe.author)
+
+    def patch(self, **data):
+        response = self.client.patch(
+            f"/api/recipes/{self.recipe.id}/",
+            {
+                "ingredients": [{"id": self.ingredients[0].id, "amount": 1}],
+                **data,
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        self.recipe.refresh_from_db()
+
+    def test_new_image_resets_variants(self):
+        buffer = BytesIO()
+        Image.new("RGB", (10, 10)).save(buffer, "PNG")
+        self.patch(image=(
+            "data:image/png;base64,"
+            + b64encode(buffer.getvalue()).decode()
+        ))
+        self.assertEqual(self.recipe.image_variants, {})
+        self.assertTrue(ImageJob.objects.filter(
+            object_id=self.recipe.id, source=self.recipe.image.name
+        ).exists())
+
+    def test_save_keeps_variants(self):
+        # Варианты, записанные обработкой после загрузки рецепта,
+        # не затираются при его сохранении.
+        stale = Recipe.objects.get(pk=self.recipe.pk)
+        processed = {"card": {"webp": "recipes/images/variants/1.webp"}}
+        Recipe.objects.filter(pk=self.recipe.pk).update(
+            image_variants=processed
+        )
+        stale.name = "Новое название"
+        stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.image_variants, processed)
+        self.patch(name="Ещё одно название")
+        self.assertEqual(self.recipe.image_variants, processed)
+
+    def test_stale_jobs_requeued(self):
+        old = timezone.now() - timedelta(
+            seconds=settings.IMAGE_PROCESSING_TIMEOUT + 1
+        )
+        fresh, stale, exhausted = ImageJob.objects.bulk_create(
+            ImageJob(
+                model="recipes.recipe",
+                object_id=self.recipe.id,
+                field="image",
+                source=self.recipe.image.name,
+                status=ImageJob.PROCESSING,
+                attempts=attempts,
+            )
+            for attempts in (1, 1, settings.IMAGE_PROCESSING_MAX_ATTEMPTS)
+        )
+        ImageJob.objects.exclude(pk=fresh.pk).update(updated_at=old)
+        self.assertEqual(requeue_stale_jobs(), 1)
+        statuses = dict(ImageJob.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[fresh.pk], ImageJob.PROCESSING)
+        self.assertEqual(statuses[stale.pk], ImageJob.PENDING)
+        self.assertEqual(statuses[exhausted.pk], ImageJob.FAILED)
@@ -1,29 +1,47 @@
-from datetime import datetime
-
-from django.db.models import Sum
-from django.http import HttpResponse
+from django.conf import settings
+from django.db import transaction
+from django.db.models import (
+    F,
+    Prefetch,
+    Window,
+)
+from django.db.models.functions import RowNumber
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.urls import reverse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
+from recipes import short_links, timeline
 from recipes.models import (
     Favorite,
     Ingredient,
-    IngredientRecipe,
     Recipe,
     ShoppingCart,
+    ShoppingCartTotal,
     Subscription,
     User,
 )
+from recipes.images import reset_variants
+from recipes.ingredient_index import ingredient_index
+from recipes.scores import get_scores_version
+from recipes.versions import RECIPES, get_version
+from .conditional import conditional_response, get_viewer_state
+from .feed_cache import feed_cache
 from .filters import IngredientFilter, RecipeFilter
+from .loaders import SubscriptionLoader
+from .negotiation import IgnoreClientContentNegotiation
 from .pagination import UserPagination, RecipePagination
 from .permissions import IsAuthorOrReadOnly
+from .representations import represent_ingredient_rows
 from .serializers import (
+    ID_MAX,
+    BulkIdsSerializer,
     CustomUserSerializer,
     IngredientSerializer,
     RecipeCreateUpdateSerializer,
@@ -32,6 +50,47 @@ from .serializers import (
     SubscribedAuthorSerializer,
     RecipeShortSerializer,
 )
+from .shopping_list import SHOPPING_LIST_RENDERERS
+
+
+RECIPES_LIMIT_MAX = 100
+INGREDIENTS_LIMIT_MAX = 100
+
+
+def parse_id(value):
+    """id из адреса; нечисловой id или id вне диапазона первичных
+    ключей — 404, как и несуществующий."""
+    try:
+        pk = int(value)
+    except (TypeError, ValueError):
+        raise NotFound
+    if not 1 <= pk <= ID_MAX:
+        raise NotFound
+    return pk
+
+
+def get_bulk_results(ids, found, changed, statuses, skipped=()):
+    """Итог массовой операции по каждому id.
+
+    found — id существующих объектов, changed — тех из них, что были
+    добавлены или удалены; statuses — названия для изменённых
+    и оставшихся как были; skipped — {id: статус} не обработанных.
+    """
+    changed_status, unchanged_status = statuses
+    skipped = dict(skipped)
+    return Response({
+        "results": [
+            {
+                "id": pk,
+                "status": (
+                    changed_status if pk in changed
+                    else unchanged_status if pk in found
+                    else skipped.get(pk, "not_found")
+                ),
+            }
+            for pk in ids
+        ]
+    })
 
 
 class UserViewSet(DjoserUserViewSet):
@@ -39,6 +98,32 @@ class UserViewSet(DjoserUserViewSet):
     serializer_class = CustomUserSerializer
     pagination_class = UserPagination
 
+    def get_recipes_limit(self):
+        try:
+            recipes_limit = int(
+                self.request.query_params.get("recipes_limit")
+            )
+        except (ValueError, TypeError):
+            return RECIPES_LIMIT_MAX
+        return min(max(recipes_limit, 0), RECIPES_LIMIT_MAX)
+
+    def get_subscribed_authors(self, authors):
+        """Добавляет к авторам превью последних рецептов.
+
+        Превью всех авторов страницы загружаются одним запросом: рецепты
+        нумеруются внутри автора (ROW_NUMBER) и обрезаются по recipes_limit.
+        """
+        recipes = Recipe.objects.annotate(
+            row_number=Window(
+                RowNumber(),
+                partition_by=F("author_id"),
+                order_by=(F("pub_date").desc(), F("id").desc()),
+            )
+        ).filter(row_number__lte=self.get_recipes_limit())
+        return authors.prefetch_related(
+            Prefetch("recipes", queryset=recipes, to_attr="recipes_preview")
+        )
+
     def get_permissions(self):
         if self.action == "me":
             return [IsAuthenticated()]
@@ -67,8 +152,10 @@ class UserViewSet(DjoserUserViewSet):
             )
 
         if request.method == "DELETE":
-            request.user.avatar = None
-            request.user.save()
+            with transaction.atomic():
+                reset_variants(request.user, "avatar")
+                request.user.avatar = None
+                request.user.save()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
     @action(
@@ -77,23 +164,36 @@ class UserViewSet(DjoserUserViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscribe(self, request, id=None):
+        # Подписка добавляется и удаляется одним запросом
+        # (см. RelationQuerySet), автор читается для ответа.
         current_user = request.user
-        author = get_object_or_404(User, id=id)
+        author_id = parse_id(id)
 
         if request.method == "POST":
-            if current_user == author:
+            if author_id == current_user.pk:
                 return Response(
                     {"errors": "Нельзя подписаться на себя"},
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            subscription, created = (
-                Subscription.objects.get_or_create(
-                    subscriber=current_user, author=author
+            with transaction.atomic():
+                created = Subscription.objects.add(
+                    "author", subscriber_id=current_user.pk,
+                    author_id=author_id,
                 )
-            )
+                if created:
+                    User.change_counters(author_id, subscribers_count=1)
+                    User.change_counters(
+                        current_user.pk,
+                        subscriptions_count=1,
+                        relations_version=1,
+                    )
+                    timeline.follow(
+                        current_user.pk, User.objects.get(pk=author_id)
+                    )
 
             if not created:
+                author = get_object_or_404(User, id=author_id)
                 return Response(
                     {
                         "errors": (
@@ -107,18 +207,33 @@ class UserViewSet(DjoserUserViewSet):
             context = {"request": request}
 
             serializer = SubscribedAuthorSerializer(
-                author, context=context
+                self.get_subscribed_authors(
+                    User.objects.filter(pk=author_id)
+                ).get(),
+                context=context,
             )
             return Response(
                 serializer.data, status=status.HTTP_201_CREATED
             )
 
         if request.method == "DELETE":
-            subscription = Subscription.objects.filter(
-                subscriber=current_user, author=author
-            ).first()
+            with transaction.atomic():
+                removed = Subscription.objects.remove(
+                    "author", subscriber_id=current_user.pk,
+                    author_id=author_id,
+                )
+                if removed:
+                    User.change_counters(author_id, subscribers_count=-1)
+                    User.change_counters(
+                        current_user.pk,
+                        subscriptions_count=-1,
+                        relations_version=1,
+                    )
+                    timeline.unfollow_many(current_user.pk, [author_id])
+                    timeline.refill([author_id])
 
-            if not subscription:
+            if not removed:
+                author = get_object_or_404(User, id=author_id)
                 return Response(
                     {
                         "errors": (
@@ -128,12 +243,67 @@ class UserViewSet(DjoserUserViewSet):
                     },
                     status=status.HTTP_400_BAD_REQUEST,
                 )
-
-            # Приятно видеть, когда в постмане все тесты зелёные,
-            # поэтому оставил так
-            subscription.delete()
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[IsAuthenticated],
+        url_path="subscribe",
+    )
+    def subscribe_bulk(self, request):
+        """Подписка на несколько авторов или отписка от них.
+
+        Принимает {"ids": [...]}, отвечает статусом по каждому id:
+        added/exists или removed/absent, not_found для несуществующих
+        авторов и self для собственного id.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        current_user = request.user
+
+        with transaction.atomic():
+            found = set(
+                User.objects.filter(pk__in=ids)
+                .exclude(pk=current_user.pk)
+                .values_list("pk", flat=True)
+            )
+            # Счётчики и ленты меняются только по строкам, которые
+            # действительно добавил или удалил этот запрос.
+            if request.method == "POST":
+                changed = Subscription.objects.add_many(
+                    "author", list(found), subscriber_id=current_user.pk
+                )
+                sign, statuses = 1, ("added", "exists")
+            else:
+                changed = Subscription.objects.remove_many(
+                    "author", list(found), subscriber_id=current_user.pk
+                )
+                sign, statuses = -1, ("removed", "absent")
+            if changed:
+                User.change_counters_in(changed, subscribers_count=sign)
+                User.change_counters(
+                    current_user.pk,
+                    subscriptions_count=sign * len(changed),
+                    relations_version=1,
+                )
+                if sign > 0:
+                    timeline.follow_many(
+                        current_user.pk, User.objects.filter(pk__in=changed)
+                    )
+                else:
+                    timeline.unfollow_many(current_user.pk, changed)
+                    timeline.refill(changed)
+
+        return get_bulk_results(
+            ids,
+            found,
+            changed,
+            statuses,
+            skipped={current_user.pk: "self"},
+        )
+
     @action(
         detail=False,
         methods=["get"],
@@ -142,10 +312,11 @@ class UserViewSet(DjoserUserViewSet):
     )
     def subscriptions(self, request):
         current_user = request.user
-        subscriptions = User.objects.filter(
-            subscribers__subscriber=current_user
-        )
+        subscriptions = self.get_subscribed_authors(
+            User.objects.filter(authors__subscriber=current_user)
+        ).order_by("username")
         page = self.paginate_queryset(subscriptions)
+        SubscriptionLoader.for_request(request).mark_subscribed(page)
 
         context = {"request": request}
 
@@ -163,22 +334,89 @@ class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    def get_limit(self):
+        try:
+            limit = int(self.request.query_params.get("limit"))
+        except (ValueError, TypeError):
+            return None
+        return min(max(limit, 0), INGREDIENTS_LIMIT_MAX)
+
+    def list(self, request, *args, **kwargs):
+        # Индекс обновляется один раз за запрос: его снимок даёт и версию
+        # для ETag, и результаты поиска.
+        snapshot = None
+        if settings.INGREDIENT_SEARCH_IN_MEMORY:
+            snapshot = ingredient_index.refresh()
+            version = snapshot.version
+        else:
+            version = ingredient_index.get_version()
+        return conditional_response(
+            request,
+            lambda: self.list_ingredients(request, snapshot),
+            version,
+        )
+
+    def list_ingredients(self, request, snapshot=None):
+        name = request.query_params.get("name")
+        limit = self.get_limit()
+        if name and snapshot is not None:
+            rows = snapshot.search(name, limit)
+        else:
+            rows = self.filter_queryset(self.get_queryset()).values_list(
+                "id", "name", "measurement_unit"
+            )
+            if limit is not None:
+                rows = rows[:limit]
+        return Response(represent_ingredient_rows(rows))
+
 
 class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = (
-        Recipe.objects.all()
-        .select_related("author")
-        .prefetch_related(
-            "recipe_ingredients__ingredient",
-            "favorite_recipes",
-            "shopping_carts",
-        )
-    )
+    # Продукты рецептов загружает RecipeReadSerializer (см.
+    # api.representations.get_ingredient_rows).
+    queryset = Recipe.objects.all().select_related("author")
     pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     http_method_names = ["get", "post", "patch", "delete"]
 
+    def get_queryset(self):
+        return super().get_queryset().with_user_flags(self.request.user)
+
+    def list(self, request, *args, **kwargs):
+        recipes = self.filter_queryset(self.get_queryset())
+        # Версия всех рецептов, а не выборки: это один поиск по ключу
+        # вместо COUNT и MAX по выборке в каждом запросе, в том числе
+        # курсорном.
+        version = (get_version(RECIPES),)
+        if request.query_params.get("ordering"):
+            version += (get_scores_version(),)
+
+        def get_response():
+            if feed_cache.can_cache(request):
+                return Response(feed_cache.get_page(self, recipes, version))
+            return super(RecipeViewSet, self).list(request, *args, **kwargs)
+
+        return conditional_response(
+            request,
+            get_response,
+            *version,
+            get_viewer_state(request.user),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        return conditional_response(
+            request,
+            lambda: Response(self.get_serializer(recipe).data),
+            recipe.updated_at,
+            recipe.is_favorited,
+            recipe.is_in_shopping_cart,
+            SubscriptionLoader.for_request(request).is_subscribed(
+                recipe.author
+            ),
+            last_modified=recipe.updated_at,
+        )
+
     def get_serializer_class(self):
         if self.action in ("list", "retrieve"):
             return RecipeReadSerializer
@@ -189,8 +427,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
             return [AllowAny()]
         return [IsAuthenticated(), IsAuthorOrReadOnly()]
 
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # Счётчик рецептов автора меняет сигнал (recipes.signals).
+        recipe = serializer.save(author=self.request.user)
+        timeline.fan_out([recipe])
+
+    def perform_destroy(self, instance):
+        # Итоги корзин и счётчик рецептов автора поправят сигналы
+        # (recipes.signals).
+        instance.delete()
 
     def _handle_m2m_relation(
         self,
@@ -198,15 +444,25 @@ class RecipeViewSet(viewsets.ModelViewSet):
         pk,
         model_class,
     ):
-        recipe = get_object_or_404(Recipe, pk=pk)
+        # Связь добавляется и удаляется одним запросом (см. RelationQuerySet),
+        # рецепт читается только для ответа или текста ошибки.
+        recipe_id = parse_id(pk)
         user = request.user
         verbose_name = model_class._meta.verbose_name
+        counter = model_class.recipe_counter
 
         if request.method == "POST":
-            relation, created = model_class.objects.get_or_create(
-                user=user, recipe=recipe
-            )
+            with transaction.atomic():
+                created = model_class.objects.add(
+                    "recipe", user_id=user.id, recipe_id=recipe_id
+                )
+                if created:
+                    Recipe.change_counters(recipe_id, **{counter: 1})
+                    User.change_counters(user.id, relations_version=1)
+                if created and model_class is ShoppingCart:
+                    ShoppingCartTotal.objects.add_recipe(user.id, recipe_id)
 
+            recipe = get_object_or_404(Recipe, pk=recipe_id)
             if not created:
                 return Response(
                     {
@@ -225,10 +481,18 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 serializer.data, status=status.HTTP_201_CREATED
             )
 
-        relation = model_class.objects.filter(
-            user=user, recipe=recipe
-        ).first()
-        if not relation:
+        with transaction.atomic():
+            removed = model_class.objects.remove(
+                "recipe", user_id=user.id, recipe_id=recipe_id
+            )
+            if removed:
+                Recipe.change_counters(recipe_id, **{counter: -1})
+                User.change_counters(user.id, relations_version=1)
+            if removed and model_class is ShoppingCart:
+                ShoppingCartTotal.objects.remove_recipe(user.id, recipe_id)
+
+        if not removed:
+            recipe = get_object_or_404(Recipe, pk=recipe_id)
             return Response(
                 {
                     "errors": (
@@ -238,10 +502,48 @@ class RecipeViewSet(viewsets.ModelViewSet):
                 },
                 status=status.HTTP_400_BAD_REQUEST,
             )
-
-        relation.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
+    def _handle_bulk_m2m_relation(self, request, model_class):
+        """Добавляет или убирает сразу несколько рецептов одним запросом
+        на проверку и одним на изменение.
+
+        Принимает {"ids": [...]}, отвечает статусом по каждому id:
+        added/exists или removed/absent, not_found для несуществующих
+        рецептов.
+        """
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data["ids"]
+        user = request.user
+        counter = model_class.recipe_counter
+
+        with transaction.atomic():
+            found = set(
+                Recipe.objects.filter(pk__in=ids).values_list("pk", flat=True)
+            )
+            # Счётчики и итоги меняются только по строкам, которые
+            # действительно добавил или удалил этот запрос.
+            if request.method == "POST":
+                changed = model_class.objects.add_many(
+                    "recipe", list(found), user_id=user.id
+                )
+                sign, statuses = 1, ("added", "exists")
+            else:
+                changed = model_class.objects.remove_many(
+                    "recipe", list(found), user_id=user.id
+                )
+                sign, statuses = -1, ("removed", "absent")
+            if changed:
+                Recipe.change_counters_in(changed, **{counter: sign})
+                User.change_counters(user.id, relations_version=1)
+                if model_class is ShoppingCart:
+                    ShoppingCartTotal.objects.add_recipes(
+                        user.id, changed, sign
+                    )
+
+        return get_bulk_results(ids, found, changed, statuses)
+
     @action(
         detail=True,
         methods=["post", "delete"],
@@ -266,58 +568,78 @@ class RecipeViewSet(viewsets.ModelViewSet):
             model_class=ShoppingCart,
         )
 
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[IsAuthenticated],
+        url_path="favorite",
+    )
+    def favorite_bulk(self, request):
+        return self._handle_bulk_m2m_relation(request, Favorite)
+
+    @action(
+        detail=False,
+        methods=["post", "delete"],
+        permission_classes=[IsAuthenticated],
+        url_path="shopping_cart",
+    )
+    def shopping_cart_bulk(self, request):
+        return self._handle_bulk_m2m_relation(request, ShoppingCart)
+
     @action(
         detail=False,
         methods=["get"],
         permission_classes=[IsAuthenticated],
     )
-    def download_shopping_cart(self, request):
-        user = request.user
-        ingredients = (
-            IngredientRecipe.objects.filter(
-                recipe__shopping_carts__user=user
-            )
-            .values(
-                "ingredient__name", "ingredient__measurement_unit"
-            )
-            .annotate(amount=Sum("amount"))
-            .order_by("ingredient__name")
+    def feed(self, request):
+        """Лента подписок, только курсорная (см. recipes.timeline)."""
+        paginator = self.paginator
+        paginator.request = request
+        paginator.use_cursor = True
+        position = paginator.decode_cursor(
+            request.query_params.get(paginator.cursor_query_param, ""),
+            [Recipe._meta.get_field(name) for name in ("pub_date", "id")],
         )
-
-        recipes = (
-            Recipe.objects.filter(shopping_carts__user=user)
-            .select_related("author")
-            .order_by("name")
+        if position is not None:
+            position = tuple(position)
+        recipe_ids, paginator.next_position = timeline.get_feed(
+            request.user, paginator.get_page_size(request), position
         )
-
-        today = datetime.today()
-
-        shopping_list = "\n".join(
-            [
-                (
-                    f"Список покупок для {user.get_full_name()}\n"
-                    f"Дата: {today:%d-%m-%Y}"
-                ),
-                "Ингредиенты:",
-                *[
-                    f"{i}. {item['ingredient__name'].capitalize()} "
-                    f"({item['ingredient__measurement_unit']}) - "
-                    f"{item['amount']}"
-                    for i, item in enumerate(ingredients, start=1)
-                ],
-                "Рецепты:",
-                *[
-                    f"- {recipe.name} (@ {recipe.author.get_full_name()})"
-                    for recipe in recipes
-                ],
-                f"\nFoodgram ({today:%Y})",
-            ]
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeReadSerializer(
+            [recipes[pk] for pk in recipe_ids if pk in recipes],
+            many=True,
+            context=self.get_serializer_context(),
         )
+        return paginator.get_paginated_response(serializer.data)
 
-        filename = f"{user.username}_shopping_list.txt"
+    @action(
+        detail=False,
+        methods=["get"],
+        permission_classes=[IsAuthenticated],
+        content_negotiation_class=IgnoreClientContentNegotiation,
+    )
+    def download_shopping_cart(self, request):
+        file_format = request.query_params.get("format", "txt")
+        renderer_class = SHOPPING_LIST_RENDERERS.get(file_format)
+        if renderer_class is None:
+            return Response(
+                {
+                    "errors": (
+                        f"Неизвестный формат {file_format}, доступны: "
+                        f"{', '.join(SHOPPING_LIST_RENDERERS)}"
+                    )
+                },
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
-        response = HttpResponse(shopping_list, content_type="text/plain")
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        renderer = renderer_class(request.user)
+        response = StreamingHttpResponse(
+            renderer.render(), content_type=renderer.content_type
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{renderer.get_filename()}"'
+        )
         return response
 
     @action(
@@ -326,12 +648,16 @@ class RecipeViewSet(viewsets.ModelViewSet):
         url_path='get-link',
     )
     def get_link(self, request, pk=None):
-        if not Recipe.objects.filter(pk=pk).exists():
+        recipe_id = parse_id(pk)
+        if not Recipe.objects.filter(pk=recipe_id).exists():
             return Response(
                 {"detail": f"Рецепт с идентификатором {pk} не найден"},
                 status=status.HTTP_404_NOT_FOUND
             )
         short_link = request.build_absolute_uri(
-            reverse("recipe-short-link-redirect", args=[pk])
+            reverse(
+                "recipe-short-link-redirect",
+                args=[short_links.encode(recipe_id)],
+            )
         )
         return Response({"short-link": short_link})
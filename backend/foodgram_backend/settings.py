@@ -35,6 +35,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'recipes.middleware.ShortLinkMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -86,10 +87,50 @@ else:
         'default': {
             'ENGINE': 'django.db.backends.sqlite3',
             'NAME': BASE_DIR / 'db.sqlite3',
+            # Транзакция сразу берёт блокировку на запись: иначе два
+            # запроса, прочитавшие данные, не могут оба начать запись и
+            # один из них получает «database is locked» без ожидания
+            'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 20},
+            # Тестовая БД в файле: в памяти общий кэш SQLite блокирует
+            # таблицы без ожидания, и тесты с потоками падают
+            'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
         }
     }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+RECIPE_FEED_PAGE_TIMEOUT = int(os.getenv('RECIPE_FEED_PAGE_TIMEOUT', 300))
+RECIPE_FEED_FRAGMENT_TIMEOUT = int(
+    os.getenv('RECIPE_FEED_FRAGMENT_TIMEOUT', 24 * 60 * 60)
+)
+
+# Лента по популярности: окно trending в днях и период, за который
+# вес добавления в избранное или корзину падает вдвое, в часах
+RECIPE_TRENDING_DAYS = int(os.getenv('RECIPE_TRENDING_DAYS', 7))
+RECIPE_TRENDING_HALF_LIFE_HOURS = float(
+    os.getenv('RECIPE_TRENDING_HALF_LIFE_HOURS', 24)
+)
+
+# Лента подписок: рецепты авторов, у которых подписчиков больше порога,
+# не раскладываются по лентам, а подмешиваются при чтении; при подписке
+# в ленту добавляются последние FEED_BACKFILL_SIZE рецептов автора
+FEED_FANOUT_MAX_SUBSCRIBERS = int(
+    os.getenv('FEED_FANOUT_MAX_SUBSCRIBERS', 1000)
+)
+FEED_BACKFILL_SIZE = int(os.getenv('FEED_BACKFILL_SIZE', 100))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -152,8 +193,24 @@ REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend',
     ],
+    # JSON через orjson, без него — стандартные JSONRenderer/JSONParser
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
 }
 
+# Порог, после которого пагинация на PostgreSQL берёт оценку числа строк
+# из планировщика вместо COUNT(*); 0 — всегда точный подсчёт
+PAGINATION_APPROXIMATE_COUNT_THRESHOLD = int(
+    os.getenv('PAGINATION_APPROXIMATE_COUNT_THRESHOLD', 0)
+)
+
 # DJOSER
 
 DJOSER = {
@@ -192,3 +249,57 @@ CORS_ALLOW_METHODS = [
 ]
 
 HOST_URL = os.getenv('HOST_URL', 'localhost')
+
+# INGREDIENT SEARCH
+
+# Поиск продуктов по индексу в памяти процесса; False — запросом к БД
+# (на PostgreSQL по индексам text_pattern_ops и pg_trgm)
+INGREDIENT_SEARCH_IN_MEMORY = os.getenv(
+    'INGREDIENT_SEARCH_IN_MEMORY', 'True'
+).lower() == 'true'
+
+# PANTRY INDEX
+
+# Как часто (в секундах) индекс подбора по продуктам проверяет версию
+# рецептов, и строить ли его при запуске процесса в wsgi.py, а не в
+# первом запросе
+PANTRY_INDEX_CHECK_INTERVAL = float(
+    os.getenv('PANTRY_INDEX_CHECK_INTERVAL', 1)
+)
+PANTRY_INDEX_WARM_UP = os.getenv(
+    'PANTRY_INDEX_WARM_UP', 'True'
+).lower() == 'true'
+
+# IMAGE PROCESSING
+
+# thread — пул потоков в процессе приложения; worker — только очередь в БД,
+# которую разбирает manage.py process_image_jobs; sync — сразу в запросе
+IMAGE_PROCESSING_MODE = os.getenv('IMAGE_PROCESSING_MODE', 'thread')
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+# Через сколько секунд задача в обработке считается зависшей и
+# возвращается в очередь (process_image_jobs, а в режиме thread — при
+# отправке задач, см. recipes.images.resubmit_jobs), и сколько попыток
+# даётся
+IMAGE_PROCESSING_TIMEOUT = int(os.getenv('IMAGE_PROCESSING_TIMEOUT', 600))
+IMAGE_PROCESSING_MAX_ATTEMPTS = int(
+    os.getenv('IMAGE_PROCESSING_MAX_ATTEMPTS', 3)
+)
+
+# SHORT LINKS
+
+# Ключ перестановки id в кодах коротких ссылок; при смене ключа
+# выданные ссылки перестают работать
+SHORT_LINK_KEY = os.getenv('SHORT_LINK_KEY', 'foodgram-short-links')
+# Размер и время жизни записей кэша существования рецептов в процессе
+SHORT_LINK_CACHE_SIZE = int(os.getenv('SHORT_LINK_CACHE_SIZE', 100_000))
+SHORT_LINK_CACHE_TIMEOUT = int(os.getenv('SHORT_LINK_CACHE_TIMEOUT', 60))
+# Как часто, секунд, кэш проверяет, не удаляли ли рецепты другие процессы
+SHORT_LINK_CHECK_INTERVAL = float(os.getenv('SHORT_LINK_CHECK_INTERVAL', 1))
+
+# SHOPPING LIST
+
+# TTF-шрифт с кириллицей для PDF; без него используется Helvetica
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf'
+)
@@ -7,10 +7,28 @@ For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/wsgi/
 """
 
+import logging
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
+from django.db import DatabaseError, connections
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram_backend.settings')
 
 application = get_wsgi_application()
+
+if settings.PANTRY_INDEX_WARM_UP:
+    # Индекс подбора по продуктам строится при запуске процесса,
+    # а не в первом запросе к нему
+    from recipes.pantry_index import pantry_index
+
+    try:
+        pantry_index.refresh()
+    except DatabaseError:
+        logging.getLogger(__name__).exception(
+            'Не удалось построить индекс подбора по продуктам'
+        )
+    finally:
+        # Соединение не должно достаться процессам, порождённым fork
+        connections.close_all()
@@ -1,12 +1,13 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from django.db.models import Count
+from django.db.models import Count, Q
 from django.utils.safestring import mark_safe
 
 from .models import (
     Favorite, Ingredient, IngredientRecipe, Recipe, ShoppingCart,
     User, Subscription
 )
+from .search import search_recipes, update_search_index
 
 
 YES_OR_NO_VARIANTS = (
@@ -16,46 +17,38 @@ YES_OR_NO_VARIANTS = (
 
 
 class BooleanFilter(admin.SimpleListFilter):
-    count_field = None
-    annotation_name = None
+    counter_field = None
 
     def lookups(self, request, model_admin):
         return YES_OR_NO_VARIANTS
 
     def queryset(self, request, queryset):
-        if not self.count_field or not self.annotation_name:
+        if not self.counter_field:
             return queryset
 
         if self.value() == 'yes':
-            return queryset.annotate(**{
-                self.annotation_name: Count(self.count_field)
-            }).filter(**{f"{self.annotation_name}__gt": 0})
+            return queryset.filter(**{f"{self.counter_field}__gt": 0})
         if self.value() == 'no':
-            return queryset.annotate(**{
-                self.annotation_name: Count(self.count_field)
-            }).filter(**{self.annotation_name: 0})
+            return queryset.filter(**{self.counter_field: 0})
         return queryset
 
 
 class HasRecipesFilter(BooleanFilter):
     title = 'есть рецепты'
     parameter_name = 'has_recipes'
-    count_field = 'recipes'
-    annotation_name = 'recipe_count'
+    counter_field = 'recipes_count'
 
 
 class HasSubscriptionsFilter(BooleanFilter):
     title = 'есть подписки'
     parameter_name = 'has_subscriptions'
-    count_field = 'authors'
-    annotation_name = 'subscr_count'
+    counter_field = 'subscriptions_count'
 
 
 class HasSubscribersFilter(BooleanFilter):
     title = 'есть подписчики'
     parameter_name = 'has_subscribers'
-    count_field = 'subscribers'
-    annotation_name = 'subs_count'
+    counter_field = 'subscribers_count'
 
 
 class IsInRecipesFilter(admin.SimpleListFilter):
@@ -109,14 +102,6 @@ class UserAdmin(BaseUserAdmin):
 
     readonly_fields = ['get_avatar']
 
-    def get_queryset(self, request):
-        users = super().get_queryset(request)
-        return users.annotate(
-            recipe_count=Count('recipes', distinct=True),
-            subscription_count=Count('authors', distinct=True),
-            subscriber_count=Count('subscribers', distinct=True)
-        )
-
     @admin.display(description='ФИО')
     def get_full_name(self, obj):
         return f"{obj.first_name} {obj.last_name}"
@@ -128,17 +113,17 @@ class UserAdmin(BaseUserAdmin):
             return f'<img src="{obj.avatar.url}" width="80" height="80" />'
         return 'Нет аватара'
 
-    @admin.display(description='Рецептов')
+    @admin.display(description='Рецептов', ordering='recipes_count')
     def get_recipe_count(self, obj):
-        return obj.recipe_count
+        return obj.recipes_count
 
-    @admin.display(description='Подписок')
+    @admin.display(description='Подписок', ordering='subscriptions_count')
     def get_subscription_count(self, obj):
-        return obj.subscription_count
+        return obj.subscriptions_count
 
-    @admin.display(description='Подписчиков')
+    @admin.display(description='Подписчиков', ordering='subscribers_count')
     def get_subscriber_count(self, obj):
-        return obj.subscriber_count
+        return obj.subscribers_count
 
 
 @admin.register(Subscription)
@@ -179,9 +164,25 @@ class RecipeAdmin(admin.ModelAdmin):
     list_filter = ('author',)
     inlines = (IngredientRecipeInline,)
 
-    @admin.display(description='В избранном')
+    def get_search_results(self, request, queryset, search_term):
+        # Название — полнотекстовым поиском (recipes.search), автор —
+        # по вхождению в ник.
+        if not search_term:
+            return queryset, False
+        return queryset.filter(
+            Q(id__in=search_recipes(
+                Recipe.objects.all(), search_term
+            ).values('id'))
+            | Q(author__username__icontains=search_term)
+        ), False
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        update_search_index([form.instance.pk])
+
+    @admin.display(description='В избранном', ordering='favorites_count')
     def favorite_count(self, recipe):
-        return recipe.favorite_recipes.count()
+        return recipe.favorites_count
 
     @admin.display(description='Изображение')
     @mark_safe
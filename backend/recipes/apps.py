@@ -5,3 +5,10 @@ class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
     verbose_name = 'Рецепты'
+
+    def ready(self):
+        from . import (  # noqa: F401
+            ingredient_index,
+            short_links,
+            signals,
+        )
@@ -0,0 +1,271 @@
+import logging
+import posixpath
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from functools import partial
+from io import BytesIO
+
+from django.apps import apps
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import (
+    OperationalError, close_old_connections, connection, transaction
+)
+from django.db.models import F
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from .models import ImageJob, Recipe
+from .versions import RECIPES, bump_version
+
+logger = logging.getLogger(__name__)
+
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1280, 1280),
+}
+FORMATS = (
+    ('jpeg', 'jpg', {'quality': 85, 'optimize': True}),
+    ('webp', 'webp', {'quality': 80, 'method': 4}),
+)
+# Поле изображения -> поле с его вариантами
+VARIANT_FIELDS = {
+    'image': 'image_variants',
+    'avatar': 'avatar_variants',
+}
+
+# Попытки записи, если SQLite отвечает, что таблица заблокирована
+LOCKED_RETRIES = 5
+LOCKED_DELAY = 0.05
+# Как часто режим 'thread' ищет забытые задачи, секунд
+RESUBMIT_INTERVAL = 60
+
+_executor = None
+_resubmitted_at = None
+
+
+def render_variants(source):
+    """Сохраняет уменьшенные копии source в JPEG и WebP.
+
+    Возвращает {вариант: {формат: имя файла в хранилище}}.
+    """
+    with default_storage.open(source) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    directory, filename = posixpath.split(source)
+    stem = posixpath.splitext(filename)[0]
+    variants = {}
+    for variant, size in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size)
+        variants[variant] = {}
+        for image_format, extension, options in FORMATS:
+            converted = resized
+            if image_format == 'jpeg' and resized.mode != 'RGB':
+                converted = resized.convert('RGB')
+            buffer = BytesIO()
+            converted.save(buffer, image_format.upper(), **options)
+            variants[variant][image_format] = default_storage.save(
+                f'{directory}/variants/{stem}_{variant}.{extension}',
+                ContentFile(buffer.getvalue()),
+            )
+    return variants
+
+
+def delete_variants(variants):
+    for formats in variants.values():
+        for name in formats.values():
+            default_storage.delete(name)
+
+
+def retry_locked(func, *args, **kwargs):
+    """Вызывает func, повторяя её, пока SQLite отвечает «database table
+    is locked»: иначе задача потерялась бы из-за чужой записи.
+
+    Внутри транзакции не повторяет — она уже сломана ошибкой.
+    """
+    for attempt in range(LOCKED_RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as error:
+            if (
+                'locked' not in str(error)
+                or connection.in_atomic_block
+                or attempt == LOCKED_RETRIES - 1
+            ):
+                raise
+            time.sleep(LOCKED_DELAY * 2 ** attempt)
+
+
+def claim_job(job_id):
+    """Переводит задачу в PROCESSING, если её ещё не забрал другой
+    обработчик."""
+    # update() не заполняет auto_now: updated_at нужен для
+    # requeue_stale_jobs.
+    return ImageJob.objects.filter(
+        pk=job_id, status=ImageJob.PENDING
+    ).update(
+        status=ImageJob.PROCESSING,
+        attempts=F('attempts') + 1,
+        updated_at=timezone.now(),
+    )
+
+
+def apply_variants(job, variants):
+    """Записывает варианты в объект задачи, если его изображение
+    не заменили, пока шла обработка."""
+    model = apps.get_model(job.model)
+    variants_field = VARIANT_FIELDS[job.field]
+    with transaction.atomic():
+        instance = model.objects.select_for_update().filter(
+            pk=job.object_id, **{job.field: job.source}
+        ).first()
+        if instance is None:
+            transaction.on_commit(partial(delete_variants, variants))
+            return
+        old_variants = getattr(instance, variants_field)
+        changes = {variants_field: variants}
+        if model is Recipe:
+            changes['updated_at'] = timezone.now()
+        model.objects.filter(pk=instance.pk).update(**changes)
+        # Аватар входит в ответы рецептов автора.
+        if model is Recipe or Recipe.objects.filter(
+            author=instance
+        ).update(updated_at=timezone.now()):
+            bump_version(RECIPES)
+        transaction.on_commit(partial(delete_variants, old_variants))
+
+
+def process_image_job(job_id):
+    """Выполняет задачу, если её ещё не забрал другой обработчик."""
+    if not retry_locked(claim_job, job_id):
+        return
+    job = ImageJob.objects.get(pk=job_id)
+    try:
+        variants = render_variants(job.source)
+        retry_locked(apply_variants, job, variants)
+    except Exception as error:
+        logger.exception('Не удалось обработать изображение %s', job)
+        job.status = ImageJob.FAILED
+        job.error = str(error)
+    else:
+        job.status = ImageJob.DONE
+        job.error = ''
+    retry_locked(job.save, update_fields=['status', 'error', 'updated_at'])
+
+
+def _run_in_thread(func, *args):
+    close_old_connections()
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Ошибка в обработке изображений')
+    finally:
+        close_old_connections()
+
+
+def _submit_to_pool(func, *args):
+    global _executor
+
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_PROCESSING_WORKERS,
+            thread_name_prefix='image-processing',
+        )
+    _executor.submit(_run_in_thread, func, *args)
+
+
+def resubmit_jobs():
+    """Режим 'thread': возвращает в очередь зависшие задачи и заново
+    отправляет в пул ожидающие — например, оставшиеся от упавшего или
+    перезапущенного процесса. Задачу, уже стоящую в пуле, обработает
+    только тот, кто первым её заберёт (claim_job).
+    """
+    requeue_stale_jobs()
+    for job_id in ImageJob.objects.filter(
+        status=ImageJob.PENDING
+    ).values_list('id', flat=True).iterator():
+        _submit_to_pool(process_image_job, job_id)
+
+
+def submit(job_id):
+    global _resubmitted_at
+
+    mode = settings.IMAGE_PROCESSING_MODE
+    if mode == 'sync':
+        process_image_job(job_id)
+    elif mode == 'thread':
+        _submit_to_pool(process_image_job, job_id)
+        # Забытые задачи ищутся при первой задаче процесса и затем
+        # не чаще раза в RESUBMIT_INTERVAL: отдельного планировщика нет.
+        now = time.monotonic()
+        if (
+            _resubmitted_at is None
+            or now - _resubmitted_at >= RESUBMIT_INTERVAL
+        ):
+            _resubmitted_at = now
+            _submit_to_pool(resubmit_jobs)
+    # В режиме 'worker' задачи забирает команда process_image_jobs.
+
+
+def requeue_stale_jobs():
+    """Возвращает в очередь задачи, которые дольше
+    IMAGE_PROCESSING_TIMEOUT остаются в PROCESSING: их обработчик упал
+    или был перезапущен. Задачи, исчерпавшие IMAGE_PROCESSING_MAX_ATTEMPTS
+    попыток, помечаются ошибкой. Возвращает число возвращённых задач.
+    """
+    now = timezone.now()
+    stale = ImageJob.objects.filter(
+        status=ImageJob.PROCESSING,
+        updated_at__lt=now - timedelta(
+            seconds=settings.IMAGE_PROCESSING_TIMEOUT
+        ),
+    )
+    stale.filter(
+        attempts__gte=settings.IMAGE_PROCESSING_MAX_ATTEMPTS
+    ).update(
+        status=ImageJob.FAILED,
+        error='Превышено время обработки',
+        updated_at=now,
+    )
+    return stale.update(status=ImageJob.PENDING, updated_at=now)
+
+
+def reset_variants(instance, field):
+    """Очищает варианты изображения instance.field: они относятся
+    к прежнему изображению. Их файлы удаляются после коммита.
+
+    Поле вариантов не пишется save() (background_fields), поэтому
+    сбрасывается через update().
+    """
+    model = type(instance)
+    variants_field = VARIANT_FIELDS[field]
+    with transaction.atomic():
+        old_variants = model.objects.select_for_update().filter(
+            pk=instance.pk
+        ).values_list(variants_field, flat=True).first()
+        if old_variants:
+            model.objects.filter(pk=instance.pk).update(
+                **{variants_field: {}}
+            )
+            transaction.on_commit(partial(delete_variants, old_variants))
+    setattr(instance, variants_field, {})
+
+
+def enqueue_image_processing(instance, field):
+    """Ставит изображение instance.field в очередь после коммита."""
+    reset_variants(instance, field)
+    source = getattr(instance, field)
+    if not source:
+        return None
+    job = ImageJob.objects.create(
+        model=instance._meta.label_lower,
+        object_id=instance.pk,
+        field=field,
+        source=source.name,
+    )
+    transaction.on_commit(lambda: submit(job.pk))
+    return job
@@ -0,0 +1,107 @@
+from bisect import bisect_left
+from threading import Lock
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Ingredient
+from .versions import INGREDIENTS, bump_version, get_version
+
+
+class IngredientSnapshot:
+    """Неизменяемый снимок индекса: версия, ключи и строки продуктов.
+
+    keys[i] — название rows[i] в casefold; строки отсортированы по нему.
+    """
+
+    __slots__ = ('version', 'keys', 'rows')
+
+    def __init__(self, version=None, keys=(), rows=()):
+        self.version = version
+        self.keys = keys
+        self.rows = rows
+
+    def search(self, query, limit=None):
+        """Продукты, в названии которых есть query.
+
+        Сначала идут продукты, название которых начинается с query,
+        затем остальные совпадения; внутри групп — по алфавиту.
+        Возвращает кортежи (id, name, measurement_unit).
+        """
+        keys, rows = self.keys, self.rows
+        query = query.casefold()
+        found = []
+        start = bisect_left(keys, query)
+        end = start
+        while end < len(keys) and keys[end].startswith(query):
+            end += 1
+        found.extend(rows[start:end])
+        if limit is not None and len(found) >= limit:
+            return found[:limit]
+        for i, key in enumerate(keys):
+            if start <= i < end or query not in key:
+                continue
+            found.append(rows[i])
+            if limit is not None and len(found) >= limit:
+                break
+        return found
+
+
+class IngredientIndex:
+    """Отсортированный в памяти индекс названий продуктов для автодополнения.
+
+    Строится лениво при первом поиске. Версия индекса — строка
+    DataVersion продуктов (recipes.versions): её увеличивают сигналы
+    изменения продуктов и load_ingredients, и её видят все процессы,
+    даже когда кэш не общий (LocMem).
+
+    Построенный снимок (IngredientSnapshot) подменяется одним
+    присваиванием, поэтому поиск в других потоках всегда видит
+    согласованные версию, ключи и строки.
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.snapshot = IngredientSnapshot()
+
+    def get_version(self):
+        return get_version(INGREDIENTS)
+
+    def build(self, version):
+        rows = tuple(sorted(
+            Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            ).iterator(),
+            key=lambda row: (row[1].casefold(), row[1], row[2]),
+        ))
+        return IngredientSnapshot(
+            version, tuple(name.casefold() for _, name, _ in rows), rows
+        )
+
+    def refresh(self):
+        """Перестраивает индекс, если продукты изменились; возвращает
+        актуальный снимок."""
+        version = self.get_version()
+        snapshot = self.snapshot
+        if version == snapshot.version:
+            return snapshot
+        with self.lock:
+            if version != self.snapshot.version:
+                self.snapshot = self.build(version)
+            return self.snapshot
+
+    def search(self, query, limit=None):
+        return self.refresh().search(query, limit)
+
+
+ingredient_index = IngredientIndex()
+
+
+def invalidate_ingredient_index():
+    bump_version(INGREDIENTS)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+def ingredient_changed(**kwargs):
+    invalidate_ingredient_index()
@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Prefetch
+
+from recipes.models import IngredientRecipe, Recipe
+
+CHUNK_SIZE = 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает рецепты в каталог: recipes.jsonl "
+        "и изображения в media/"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="Каталог для выгрузки")
+        parser.add_argument(
+            "--author",
+            type=str,
+            help="Выгрузить только рецепты автора с этой почтой",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if os.path.exists(path) and os.listdir(path):
+            raise CommandError(f"Каталог {path} не пуст")
+        os.makedirs(os.path.join(path, "media"), exist_ok=True)
+
+        recipes = (
+            Recipe.objects.select_related("author")
+            .prefetch_related(Prefetch(
+                "recipe_ingredients",
+                queryset=IngredientRecipe.objects.select_related(
+                    "ingredient"
+                ),
+            ))
+            .order_by("id")
+        )
+        if options["author"]:
+            recipes = recipes.filter(author__email=options["author"])
+
+        count = 0
+        with open(
+            os.path.join(path, "recipes.jsonl"), "w", encoding="utf-8"
+        ) as file:
+            for recipe in recipes.iterator(chunk_size=CHUNK_SIZE):
+                self.copy_image(recipe.image.name, path)
+                file.write(json.dumps({
+                    "author": recipe.author.email,
+                    "name": recipe.name,
+                    "text": recipe.text,
+                    "cooking_time": recipe.cooking_time,
+                    "pub_date": recipe.pub_date.isoformat(),
+                    "image": recipe.image.name,
+                    "ingredients": [
+                        {
+                            "name": item.ingredient.name,
+                            "measurement_unit":
+                                item.ingredient.measurement_unit,
+                            "amount": item.amount,
+                        }
+                        for item in recipe.recipe_ingredients.all()
+                    ],
+                }, ensure_ascii=False) + "\n")
+                count += 1
+                if count % CHUNK_SIZE == 0:
+                    self.stdout.write(f"Выгружено {count} рецептов")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Выгрузка завершена: {count} рецептов")
+        )
+
+    def copy_image(self, name, path):
+        target = os.path.join(path, "media", name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with default_storage.open(name) as source, open(target, "wb") as out:
+            shutil.copyfileobj(source, out)
@@ -0,0 +1,148 @@
+import random
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes import timeline
+from recipes.models import Recipe, Subscription, User
+
+PAGE_SIZE = 6
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает ленту подписок с запросом через Subscription "
+        "на синтетическом графе подписок"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=2000)
+        parser.add_argument(
+            "--follows",
+            type=int,
+            default=200,
+            help="Подписок у каждого пользователя (дефолт - 200)",
+        )
+        parser.add_argument(
+            "--popular-authors",
+            type=int,
+            default=3,
+            help="Авторов, на которых подписаны все (дефолт - 3)",
+        )
+        parser.add_argument(
+            "--recipes",
+            type=int,
+            default=3,
+            help="Рецептов у каждого автора (дефолт - 3)",
+        )
+        parser.add_argument("--samples", type=int, default=50)
+        parser.add_argument(
+            "--keep",
+            action="store_true",
+            help="Не откатывать созданные данные",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                users = self.seed(options)
+                self.measure(users, options["samples"])
+                if not options["keep"]:
+                    raise Rollback
+        except Rollback:
+            self.stdout.write("Синтетические данные удалены")
+
+    def seed(self, options):
+        started = time.monotonic()
+        prefix = f"bench{int(time.time())}"
+        users = User.objects.bulk_create(
+            User(
+                username=f"{prefix}_{i}",
+                email=f"{prefix}_{i}@example.com",
+                first_name="Bench",
+                last_name=str(i),
+                password="!",
+            )
+            for i in range(options["users"])
+        )
+        popular = users[:options["popular_authors"]]
+        follows = set()
+        for user in users:
+            authors = random.sample(
+                users, min(options["follows"], len(users))
+            ) + popular
+            follows.update(
+                (user.pk, author.pk) for author in authors
+                if author.pk != user.pk
+            )
+        Subscription.objects.bulk_create(
+            (
+                Subscription(subscriber_id=subscriber_id, author_id=author_id)
+                for subscriber_id, author_id in follows
+            ),
+            batch_size=5000,
+        )
+        subscribers = Counter(author_id for _, author_id in follows)
+        for user in users:
+            user.subscribers_count = subscribers[user.pk]
+        User.objects.bulk_update(
+            users, ["subscribers_count"], batch_size=5000
+        )
+
+        now = timezone.now()
+        recipes = Recipe.objects.bulk_create(
+            (
+                Recipe(
+                    author=user,
+                    name=f"Рецепт {user.last_name}.{i}",
+                    text="-",
+                    cooking_time=1,
+                    image="recipes/images/benchmark.png",
+                )
+                for user in users
+                for i in range(options["recipes"])
+            ),
+            batch_size=5000,
+        )
+        for recipe in recipes:
+            recipe.pub_date = now - timedelta(
+                minutes=random.randint(0, 60 * 24 * 30)
+            )
+        Recipe.objects.bulk_update(recipes, ["pub_date"], batch_size=5000)
+        timeline.fan_out(recipes)
+        self.stdout.write(
+            f"Граф: {len(users)} пользователей, {len(follows)} подписок, "
+            f"{len(recipes)} рецептов, популярных авторов "
+            f"{len(popular)} ({time.monotonic() - started:.1f} с)"
+        )
+        return users
+
+    def measure(self, users, samples):
+        sample = random.sample(users, min(samples, len(users)))
+        naive = timeline_time = 0
+        for user in sample:
+            started = time.monotonic()
+            expected = list(
+                Recipe.objects.filter(author__authors__subscriber=user)
+                .order_by("-pub_date", "-id")
+                .values_list("id", flat=True)[:PAGE_SIZE]
+            )
+            naive += time.monotonic() - started
+            started = time.monotonic()
+            recipe_ids, _ = timeline.get_feed(user, PAGE_SIZE)
+            timeline_time += time.monotonic() - started
+            if recipe_ids != expected:
+                self.stderr.write(f"Ленты {user} не совпали")
+        self.stdout.write(
+            f"Первая страница, среднее по {len(sample)} пользователям: "
+            f"через Subscription {naive / len(sample) * 1000:.2f} мс, "
+            f"лента подписок {timeline_time / len(sample) * 1000:.2f} мс"
+        )
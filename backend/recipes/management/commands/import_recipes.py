@@ -0,0 +1,200 @@
+import json
+import os
+import time
+from collections import Counter
+from itertools import islice
+
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.dateparse import parse_datetime
+
+from recipes import timeline
+from recipes.search import update_search_index
+from recipes.versions import RECIPES, bump_version
+from recipes.models import (
+    ImageJob,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    User,
+)
+
+BATCH_SIZE = 500
+
+
+class Command(BaseCommand):
+    help = "Загружает рецепты из каталога, созданного export_recipes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", type=str, help="Каталог с выгрузкой")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"Рецептов в одной транзакции (дефолт - {BATCH_SIZE})",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        self.verbosity = options["verbosity"]
+        jsonl_path = os.path.join(path, "recipes.jsonl")
+        if not os.path.exists(jsonl_path):
+            raise CommandError(f"Не найден файл {jsonl_path}")
+
+        self.authors = dict(User.objects.values_list("email", "id"))
+        self.ingredients = {
+            (name, unit): pk
+            for pk, name, unit in Ingredient.objects.values_list(
+                "id", "name", "measurement_unit"
+            ).iterator()
+        }
+        self.counts = {"imported": 0, "existing": 0, "skipped": 0}
+        started = time.monotonic()
+
+        with open(jsonl_path, encoding="utf-8") as file:
+            lines = (line for line in file if line.strip())
+            while batch := list(islice(lines, options["batch_size"])):
+                self.import_batch(path, [self.decode(line) for line in batch])
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"Загружено {self.counts['imported']} рецептов "
+                    f"({self.counts['imported'] / (elapsed or 1):.0f} в с)"
+                )
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Загрузка завершена: добавлено {self.counts['imported']}, "
+                f"уже были {self.counts['existing']}, "
+                f"пропущено с ошибками {self.counts['skipped']} рецептов. "
+                f"Уменьшенные копии изображений подготовит "
+                f"process_image_jobs"
+            )
+        )
+
+    def decode(self, line):
+        item = json.loads(line)
+        item["pub_date"] = parse_datetime(item["pub_date"])
+        return item
+
+    def resolve(self, item):
+        """id автора и продуктов рецепта или None, если чего-то нет."""
+        author_id = self.authors.get(item["author"])
+        if author_id is None:
+            self.stderr.write(
+                f"Рецепт \"{item['name']}\": нет автора {item['author']}"
+            )
+            return None
+        amounts = {}
+        for ingredient in item["ingredients"]:
+            key = (ingredient["name"], ingredient["measurement_unit"])
+            if key not in self.ingredients:
+                self.stderr.write(
+                    f"Рецепт \"{item['name']}\": нет продукта {key}"
+                )
+                return None
+            amounts[self.ingredients[key]] = ingredient["amount"]
+        return author_id, amounts
+
+    def import_batch(self, path, items):
+        resolved = []
+        for item in items:
+            ids = self.resolve(item)
+            if ids is None:
+                self.counts["skipped"] += 1
+            else:
+                resolved.append((item, *ids))
+        resolved = self.exclude_existing(resolved)
+        for item, _, _ in resolved:
+            if not os.path.isfile(self.get_image_path(path, item)):
+                raise CommandError(
+                    f"Рецепт \"{item['name']}\": нет файла изображения "
+                    f"{item['image']}"
+                )
+
+        # Файлы сохраняются вместе с транзакцией пачки и удаляются,
+        # если она не прошла, чтобы не оставлять файлов без рецептов.
+        saved = []
+        try:
+            with transaction.atomic():
+                self.save_batch(path, resolved, saved)
+        except BaseException:
+            for name in saved:
+                default_storage.delete(name)
+            raise
+        self.counts["imported"] += len(resolved)
+
+    def exclude_existing(self, resolved):
+        """Убирает рецепты, которые уже загружены: повторная загрузка той
+        же выгрузки не создаёт дублей.
+
+        Рецепт узнаётся по автору, названию и дате публикации — дата
+        переносится из выгрузки как есть, а разные рецепты автора с одним
+        названием различаются датой.
+        """
+        existing = set(Recipe.objects.filter(
+            author_id__in={author_id for _, author_id, _ in resolved},
+            name__in={item["name"] for item, _, _ in resolved},
+            pub_date__in={item["pub_date"] for item, _, _ in resolved},
+        ).values_list("author_id", "name", "pub_date"))
+        fresh = []
+        for item, author_id, amounts in resolved:
+            key = (author_id, item["name"], item["pub_date"])
+            if key in existing:
+                self.counts["existing"] += 1
+                if self.verbosity > 1:
+                    self.stdout.write(
+                        f"Рецепт \"{item['name']}\" от "
+                        f"{item['pub_date']:%d.%m.%Y %H:%M} уже загружен"
+                    )
+                continue
+            existing.add(key)
+            fresh.append((item, author_id, amounts))
+        return fresh
+
+    def get_image_path(self, path, item):
+        return os.path.join(path, "media", item["image"])
+
+    def save_batch(self, path, resolved, saved):
+        recipes = []
+        for item, author_id, _ in resolved:
+            with open(self.get_image_path(path, item), "rb") as f:
+                image = default_storage.save(item["image"], File(f))
+            saved.append(image)
+            recipes.append(Recipe(
+                author_id=author_id,
+                name=item["name"],
+                text=item["text"],
+                cooking_time=item["cooking_time"],
+                pub_date=item["pub_date"],
+                image=image,
+            ))
+
+        Recipe.objects.bulk_create(recipes)
+        IngredientRecipe.objects.bulk_create(
+            IngredientRecipe(
+                recipe=recipe, ingredient_id=ingredient_id, amount=amount
+            )
+            for recipe, (_, _, amounts) in zip(recipes, resolved)
+            for ingredient_id, amount in amounts.items()
+        )
+        update_search_index(recipe.pk for recipe in recipes)
+        ImageJob.objects.bulk_create(
+            ImageJob(
+                model=Recipe._meta.label_lower,
+                object_id=recipe.pk,
+                field="image",
+                source=recipe.image.name,
+            )
+            for recipe in recipes
+        )
+        RecipeScore.objects.bulk_create(
+            RecipeScore(recipe=recipe) for recipe in recipes
+        )
+        timeline.fan_out(recipes)
+        authors = Counter(recipe.author_id for recipe in recipes)
+        for author_id, count in authors.items():
+            User.change_counters(author_id, recipes_count=count)
+        bump_version(RECIPES)
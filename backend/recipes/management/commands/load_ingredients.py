@@ -1,10 +1,105 @@
+import csv
 import json
-from django.core.management.base import BaseCommand
+import os
+import re
+import time
+from io import StringIO
+from itertools import islice
+from queue import Queue
+from threading import Thread
 
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recipes.ingredient_index import invalidate_ingredient_index
 from recipes.models import Ingredient
 
 # Думаю, лучше сделать константу, не понимаю почему "лишняя строка"
 BATCH_SIZE = 1000
+READ_CHUNK_SIZE = 64 * 1024
+QUEUE_SIZE = 4
+WHITESPACE = re.compile(r"[ \t\n\r]*")
+
+
+def iter_json(file):
+    """Читает JSON-массив объектов по одному, не загружая файл целиком.
+
+    Позиция в буфере сдвигается без копирования хвоста: буфер
+    пересобирается только при чтении следующего куска файла.
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    position = 0
+    started = False
+    eof = False
+    while True:
+        position = WHITESPACE.match(buffer, position).end()
+        char = buffer[position:position + 1]
+        if not started and char:
+            if char != "[":
+                raise ValueError("Ожидался JSON-массив")
+            position += 1
+            started = True
+            continue
+        if char == ",":
+            position += 1
+            continue
+        if char == "]":
+            return
+        try:
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                if not char:
+                    raise ValueError("JSON-массив не закрыт")
+                raise
+            chunk = file.read(READ_CHUNK_SIZE)
+            eof = not chunk
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+        yield item
+
+
+def iter_csv(file):
+    for row in csv.reader(file):
+        if not row:
+            continue
+        if len(row) != 2:
+            raise ValueError(f"Ожидалось 2 столбца, получено: {row}")
+        yield {"name": row[0], "measurement_unit": row[1]}
+
+
+READERS = {
+    "json": iter_json,
+    "csv": iter_csv,
+}
+
+
+def iter_batches(rows, batch_size):
+    rows = iter(rows)
+    while batch := list(islice(rows, batch_size)):
+        yield batch
+
+
+def prefetch(iterable, size=QUEUE_SIZE):
+    """Разбирает файл в отдельном потоке, пока основной пишет в БД."""
+    queue = Queue(maxsize=size)
+    done = object()
+
+    def produce():
+        try:
+            for item in iterable:
+                queue.put(item)
+        except Exception as error:
+            queue.put(error)
+        queue.put(done)
+
+    Thread(target=produce, daemon=True).start()
+    while (item := queue.get()) is not done:
+        if isinstance(item, Exception):
+            raise item
+        yield item
 
 
 class Command(BaseCommand):
@@ -16,41 +111,187 @@ class Command(BaseCommand):
             type=str,
             help="Путь к файлу с продуктами (дефолт - data/ingredients.json)",
         )
+        parser.add_argument(
+            "--format",
+            choices=READERS,
+            help="Формат файла (дефолт - по расширению)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=BATCH_SIZE,
+            help=f"Размер пачки (дефолт - {BATCH_SIZE})",
+        )
+        parser.add_argument(
+            "--copy",
+            action="store_true",
+            help="PostgreSQL: COPY во временную таблицу и слияние",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Посчитать новые продукты, ничего не записывая",
+        )
 
     def handle(self, *args, **options):
+        file_path = options.get("path") or "/app/data/ingredients.json"
+        file_format = (
+            options["format"]
+            or os.path.splitext(file_path)[1].lstrip(".").lower()
+        )
+        if file_format not in READERS:
+            raise CommandError(f"Неизвестный формат файла: {file_path}")
+        if options["batch_size"] < 1:
+            raise CommandError("Размер пачки должен быть положительным")
+        if options["copy"] and connection.vendor != "postgresql":
+            raise CommandError("--copy работает только с PostgreSQL")
+
+        started = time.monotonic()
+        self.counts = {"inserted": 0, "skipped": 0}
+        self.seen = set()
         try:
-            file_path = (
-                options.get("path") or "/app/data/ingredients.json"
+            with open(file_path, "r", encoding="utf-8") as file:
+                batches = prefetch(iter_batches(
+                    READERS[file_format](file), options["batch_size"]
+                ))
+                if options["copy"]:
+                    self.load_copy(batches, options["dry_run"])
+                else:
+                    for batch in batches:
+                        self.load_batch(batch, options["dry_run"])
+                        self.report(started)
+        except (OSError, ValueError, TypeError, KeyError) as error:
+            raise CommandError(
+                f"Ошибка при работе с файлом {file_path}: {error}"
             )
 
-            with open(file_path, "r", encoding="utf-8") as file:
-                ingredients_data = json.load(file)
-                total_count = 0
-
-                for i in range(0, len(ingredients_data), BATCH_SIZE):
-                    batch = ingredients_data[i:i + BATCH_SIZE]
-                    ingredient_batch = [
-                        Ingredient(**ingredient)
-                        for ingredient in batch
-                    ]
-
-                    created = Ingredient.objects.bulk_create(
-                        ingredient_batch,
-                        ignore_conflicts=True
-                    )
-                    total_count += len(created)
-
-            # Не понял что значит "замените на анализ ответа от bulk_create"
-            self.stdout.write(
-                self.style.SUCCESS(
-                    f"Загрузка завершена: "
-                    f"считано {total_count} продуктов"
-                )
+        if not options["dry_run"]:
+            invalidate_ingredient_index()
+
+        total = sum(self.counts.values())
+        elapsed = time.monotonic() - started
+        # Единственные поля продукта и есть его ключ (название и единица),
+        # поэтому существующие строки нечем обновлять — они пропускаются.
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Загрузка {'(пробная) ' if options['dry_run'] else ''}"
+                f"завершена: считано {total}, "
+                f"добавлено {self.counts['inserted']}, "
+                f"пропущено {self.counts['skipped']} продуктов "
+                f"за {elapsed:.1f} с ({total / (elapsed or 1):.0f} строк/с)"
             )
+        )
+
+    def report(self, started):
+        total = sum(self.counts.values())
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f"Обработано {total} строк "
+            f"({total / (elapsed or 1):.0f} строк/с)"
+        )
+
+    def load_batch(self, batch, dry_run):
+        keys = list(dict.fromkeys(
+            (item["name"], item["measurement_unit"]) for item in batch
+        ))
+        if dry_run:
+            inserted = self.count_new(keys)
+        else:
+            inserted = self.insert(keys)
+        self.counts["inserted"] += inserted
+        self.counts["skipped"] += len(batch) - inserted
 
-        except Exception as e:
-            self.stderr.write(
-                self.style.ERROR(
-                    f"Ошибка при работе с файлом {file_path}: {str(e)}"
+    def count_new(self, keys):
+        """Сколько продуктов из keys добавила бы загрузка; ключи из
+        прошлых пачек (self.seen) уже посчитаны и не считаются снова."""
+        existing = set(
+            Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            ).values_list("name", "measurement_unit")
+        )
+        new = [
+            key for key in keys
+            if key not in existing and key not in self.seen
+        ]
+        self.seen.update(new)
+        return len(new)
+
+    def insert(self, keys):
+        """Добавляет продукты keys; возвращает, сколько строк добавлено.
+
+        INSERT ... ON CONFLICT DO NOTHING RETURNING возвращает только
+        вставленные этим запросом строки, поэтому число верно и при
+        одновременных загрузках. Без RETURNING — разница числа строк
+        с этими названиями до и после bulk_create.
+        """
+        if not connection.features.can_return_columns_from_insert:
+            matching = Ingredient.objects.filter(
+                name__in={name for name, _ in keys}
+            )
+            with transaction.atomic():
+                before = matching.count()
+                Ingredient.objects.bulk_create(
+                    (
+                        Ingredient(name=name, measurement_unit=unit)
+                        for name, unit in keys
+                    ),
+                    ignore_conflicts=True,
+                )
+                return matching.count() - before
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        size = connection.ops.bulk_batch_size(
+            ["name", "measurement_unit"], keys
+        )
+        inserted = 0
+        with connection.cursor() as cursor:
+            for chunk in iter_batches(keys, size):
+                cursor.execute(
+                    f"INSERT INTO {table} (name, measurement_unit) VALUES "
+                    + ", ".join(["(%s, %s)"] * len(chunk))
+                    + " ON CONFLICT (name, measurement_unit) DO NOTHING "
+                    "RETURNING id",
+                    [value for key in chunk for value in key],
                 )
+                inserted += len(cursor.fetchall())
+        return inserted
+
+    def load_copy(self, batches, dry_run):
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                "CREATE TEMP TABLE ingredient_staging "
+                "(name varchar(128), measurement_unit varchar(64)) "
+                "ON COMMIT DROP"
             )
+            total = 0
+            for batch in batches:
+                buffer = StringIO()
+                csv.writer(buffer).writerows(
+                    (item["name"], item["measurement_unit"])
+                    for item in batch
+                )
+                buffer.seek(0)
+                cursor.cursor.copy_expert(
+                    "COPY ingredient_staging FROM STDIN WITH (FORMAT csv)",
+                    buffer,
+                )
+                total += len(batch)
+            if dry_run:
+                cursor.execute(
+                    "SELECT count(*) FROM ("
+                    "SELECT DISTINCT name, measurement_unit "
+                    "FROM ingredient_staging s WHERE NOT EXISTS ("
+                    "SELECT 1 FROM recipes_ingredient i "
+                    "WHERE i.name = s.name "
+                    "AND i.measurement_unit = s.measurement_unit)) new"
+                )
+                inserted = cursor.fetchone()[0]
+            else:
+                cursor.execute(
+                    "INSERT INTO recipes_ingredient (name, measurement_unit) "
+                    "SELECT DISTINCT name, measurement_unit "
+                    "FROM ingredient_staging "
+                    "ON CONFLICT (name, measurement_unit) DO NOTHING"
+                )
+                inserted = cursor.rowcount
+        self.counts["inserted"] += inserted
+        self.counts["skipped"] += total - inserted
@@ -0,0 +1,94 @@
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes.management.commands.load_ingredients import BATCH_SIZE
+from recipes.models import Ingredient
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает загрузку продуктов (load_ingredients) с прежней "
+        "json.load и bulk_create на синтетическом файле"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=200_000)
+        parser.add_argument(
+            "--duplicates",
+            type=float,
+            default=0.1,
+            help="Доля повторяющихся строк в файле (дефолт - 0.1)",
+        )
+        parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        unique = rows - int(rows * options["duplicates"])
+        prefix = f"bench{int(time.time())}"
+        items = [
+            {"name": f"{prefix} продукт {i % unique}", "measurement_unit": "г"}
+            for i in range(rows)
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "ingredients.json")
+            with open(path, "w", encoding="utf-8") as file:
+                json.dump(items, file, ensure_ascii=False)
+            size = os.path.getsize(path)
+            del items
+            self.stdout.write(
+                f"Файл: {rows} строк, {unique} уникальных, "
+                f"{size / 2 ** 20:.1f} МБ"
+            )
+            for label, load in (
+                ("json.load + bulk_create", self.load_baseline),
+                ("load_ingredients", self.load_streaming),
+            ):
+                self.measure(label, load, path, rows, options["batch_size"])
+
+    def measure(self, label, load, path, rows, batch_size):
+        try:
+            with transaction.atomic():
+                before = Ingredient.objects.count()
+                tracemalloc.start()
+                started = time.monotonic()
+                load(path, batch_size)
+                elapsed = time.monotonic() - started
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                inserted = Ingredient.objects.count() - before
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write(
+            f"{label}: {elapsed:.2f} с, {rows / elapsed:.0f} строк/с, "
+            f"добавлено {inserted}, пик памяти {peak / 2 ** 20:.1f} МБ"
+        )
+
+    def load_baseline(self, path, batch_size):
+        with open(path, "r", encoding="utf-8") as file:
+            items = json.load(file)
+        ingredients = [Ingredient(**item) for item in items]
+        for start in range(0, len(ingredients), batch_size):
+            Ingredient.objects.bulk_create(
+                ingredients[start:start + batch_size], ignore_conflicts=True
+            )
+
+    def load_streaming(self, path, batch_size):
+        call_command(
+            "load_ingredients",
+            path=path,
+            batch_size=batch_size,
+            stdout=StringIO(),
+        )
@@ -0,0 +1,100 @@
+import random
+import time
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand
+
+from recipes.pantry_index import PantryIndex
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет подбор рецептов по продуктам (PantryIndex) "
+        "на синтетических данных, без обращения к БД"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=1_000_000)
+        parser.add_argument("--ingredients", type=int, default=2000)
+        parser.add_argument(
+            "--queries",
+            type=int,
+            default=20,
+            help="Запросов на каждый размер набора продуктов (дефолт - 20)",
+        )
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        ingredients = range(1, options["ingredients"] + 1)
+        # Популярность продуктов по закону Ципфа: соль и лук встречаются
+        # почти везде, редкие продукты — в единицах рецептов.
+        weights = list(accumulate(1 / rank for rank in ingredients))
+
+        def pick(count):
+            chosen = set()
+            while len(chosen) < count:
+                chosen.update(rng.choices(
+                    ingredients, cum_weights=weights, k=count - len(chosen)
+                ))
+            return chosen
+
+        started = time.monotonic()
+        postings = {ingredient_id: [] for ingredient_id in ingredients}
+        for recipe_id in range(1, options["recipes"] + 1):
+            for ingredient_id in pick(rng.randint(3, 12)):
+                postings[ingredient_id].append(recipe_id)
+        self.stdout.write(
+            f"Сгенерировано {options['recipes']} рецептов "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+
+        index = PantryIndex()
+        index.refresh = lambda: None
+        started = time.monotonic()
+        index.load(
+            (ingredient_id, recipe_id)
+            for ingredient_id, recipes in postings.items()
+            for recipe_id in recipes
+        )
+        size = sum(
+            recipes.itemsize * len(recipes)
+            for recipes in index.postings.values()
+        ) + index.sizes.itemsize * len(index.sizes) + sum(
+            (bitmap.bit_length() + 7) // 8
+            for bitmap in (*index.bitmaps.values(), *index.size_planes)
+        )
+        self.stdout.write(
+            f"Индекс построен за {time.monotonic() - started:.1f} с, "
+            f"массивы и битовые карты занимают {size / 2 ** 20:.1f} МБ"
+        )
+        del postings
+
+        for pantry_size in (5, 10, 20):
+            for max_missing in (0, 2):
+                timings = []
+                found = 0
+                for _ in range(options["queries"]):
+                    pantry = pick(pantry_size)
+                    started = time.monotonic()
+                    found += len(index.match(pantry, max_missing, 1000))
+                    timings.append(time.monotonic() - started)
+                timings.sort()
+                self.stdout.write(
+                    f"{pantry_size} продуктов, не хватает до {max_missing}: "
+                    f"медиана {timings[len(timings) // 2] * 1000:.1f} мс, "
+                    f"максимум {timings[-1] * 1000:.1f} мс, "
+                    f"в среднем найдено {found / len(timings):.0f}"
+                )
+
+        started = time.monotonic()
+        updates = 100
+        for _ in range(updates):
+            index.update_recipe(
+                rng.randint(1, options["recipes"]),
+                list(pick(rng.randint(3, 12))),
+            )
+        self.stdout.write(
+            f"Изменение продуктов рецепта: "
+            f"{(time.monotonic() - started) / updates * 1000:.1f} мс"
+        )
@@ -0,0 +1,60 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.images import process_image_job, requeue_stale_jobs
+from recipes.models import ImageJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Обрабатывает очередь изображений (ImageJob) и возвращает в неё "
+        "задачи, зависшие в обработке дольше IMAGE_PROCESSING_TIMEOUT"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Обработать текущую очередь и завершиться",
+        )
+        parser.add_argument(
+            "--retry-failed",
+            action="store_true",
+            help="Вернуть в очередь задачи, завершившиеся ошибкой",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2,
+            help="Пауза между проверками очереди, секунд (дефолт - 2)",
+        )
+
+    def handle(self, *args, **options):
+        if options["retry_failed"]:
+            ImageJob.objects.filter(status=ImageJob.FAILED).update(
+                status=ImageJob.PENDING
+            )
+        requeued_at = None
+        while True:
+            # Зависшие задачи ищутся не чаще раза в минуту: в отличие от
+            # очереди, для них нет частичного индекса.
+            if requeued_at is None or time.monotonic() - requeued_at >= 60:
+                requeued = requeue_stale_jobs()
+                requeued_at = time.monotonic()
+                if requeued:
+                    self.stdout.write(
+                        f"Возвращено в очередь зависших задач: {requeued}"
+                    )
+            job_ids = list(
+                ImageJob.objects.filter(status=ImageJob.PENDING)
+                .values_list("id", flat=True)[:100]
+            )
+            for job_id in job_ids:
+                process_image_job(job_id)
+            if job_ids:
+                self.stdout.write(f"Обработано задач: {len(job_ids)}")
+            elif options["once"]:
+                break
+            else:
+                time.sleep(options["interval"])
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes.models import ShoppingCartTotal
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает итоги корзин (ShoppingCartTotal) с нуля"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--verify",
+            action="store_true",
+            help="Только сравнить сохранённые итоги с пересчитанными",
+        )
+
+    def handle(self, *args, **options):
+        if not options["verify"]:
+            ShoppingCartTotal.objects.rebuild()
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Итоги корзин пересчитаны: "
+                    f"{ShoppingCartTotal.objects.count()} строк"
+                )
+            )
+            return
+
+        expected = {
+            (row["recipe__shopping_carts__user"], row["ingredient"]):
+                row["total"]
+            for row in ShoppingCartTotal.objects.compute().iterator()
+        }
+        stored = {
+            (user_id, ingredient_id): amount
+            for user_id, ingredient_id, amount
+            in ShoppingCartTotal.objects.values_list(
+                "user_id", "ingredient_id", "amount"
+            ).iterator()
+        }
+        mismatches = [
+            key for key in expected.keys() | stored.keys()
+            if expected.get(key) != stored.get(key)
+        ]
+        for user_id, ingredient_id in mismatches:
+            self.stdout.write(
+                f"Пользователь {user_id}, продукт {ingredient_id}: "
+                f"сохранено {stored.get((user_id, ingredient_id), 0)}, "
+                f"ожидалось {expected.get((user_id, ingredient_id), 0)}"
+            )
+        if mismatches:
+            raise CommandError(
+                f"Расхождений в итогах корзин: {len(mismatches)}"
+            )
+        self.stdout.write(self.style.SUCCESS("Итоги корзин совпадают"))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipes import timeline
+from recipes.models import Subscription, TimelineEntry
+
+
+class Command(BaseCommand):
+    help = "Пересобирает ленты подписок (TimelineEntry)"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            TimelineEntry.objects.all().delete()
+            subscriptions = Subscription.objects.select_related("author")
+            for subscription in subscriptions.iterator():
+                timeline.follow(
+                    subscription.subscriber_id, subscription.author
+                )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ленты пересобраны: {TimelineEntry.objects.count()} записей"
+            )
+        )
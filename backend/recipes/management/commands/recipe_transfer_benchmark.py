@@ -0,0 +1,144 @@
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from recipes.models import Ingredient, IngredientRecipe, Recipe, User
+
+TARGET = 100_000
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет export_recipes и import_recipes на синтетических "
+        f"рецептах и оценивает время переноса {TARGET} рецептов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--recipes", type=int, default=10_000)
+        parser.add_argument(
+            "--ingredients",
+            type=int,
+            default=8,
+            help="Продуктов в рецепте (дефолт - 8)",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        export_path = tempfile.mkdtemp()
+        try:
+            with override_settings(
+                MEDIA_ROOT=media_root, IMAGE_PROCESSING_MODE="worker"
+            ), transaction.atomic():
+                self.measure(options, media_root, export_path)
+                raise Rollback
+        except Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root)
+            shutil.rmtree(export_path)
+
+    def seed(self, options, media_root):
+        started = time.monotonic()
+        prefix = f"transfer{int(time.time())}"
+        author = User.objects.create_user(
+            username=prefix,
+            email=f"{prefix}@example.com",
+            password="!",
+            first_name="Transfer",
+            last_name="Benchmark",
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f"{prefix} продукт {i}", measurement_unit="г")
+            for i in range(options["ingredients"])
+        )
+        images = os.path.join(media_root, "recipes", "images")
+        os.makedirs(images)
+        now = timezone.now()
+        recipes = []
+        for i in range(options["recipes"]):
+            name = f"recipes/images/{prefix}_{i}.jpg"
+            # Изображения обычного размера: перенос упирается в копирование.
+            with open(os.path.join(media_root, name), "wb") as file:
+                file.write(os.urandom(64 * 1024))
+            recipes.append(Recipe(
+                author=author,
+                # Одинаковые названия: различаются датой публикации.
+                name=f"Рецепт {i % 100}",
+                text="Описание " * 50,
+                cooking_time=i % 120 + 1,
+                pub_date=now - timedelta(minutes=i),
+                image=name,
+            ))
+        recipes = Recipe.objects.bulk_create(recipes, batch_size=1000)
+        IngredientRecipe.objects.bulk_create(
+            (
+                IngredientRecipe(
+                    recipe=recipe, ingredient=ingredient, amount=i
+                )
+                for i, recipe in enumerate(recipes, 1)
+                for ingredient in ingredients
+            ),
+            batch_size=1000,
+        )
+        self.stdout.write(
+            f"Сгенерировано {len(recipes)} рецептов "
+            f"за {time.monotonic() - started:.1f} с"
+        )
+        return author
+
+    def measure(self, options, media_root, export_path):
+        author = self.seed(options, media_root)
+        count = options["recipes"]
+        timings = {}
+
+        started = time.monotonic()
+        call_command(
+            "export_recipes",
+            export_path,
+            author=author.email,
+            stdout=StringIO(),
+        )
+        timings["export_recipes"] = time.monotonic() - started
+
+        # Загружаем выгрузку новому автору с той же почтой.
+        email = author.email
+        author.email = f"old_{email}"
+        author.save(update_fields=["email"])
+        User.objects.create_user(
+            username=f"{author.username}_copy",
+            email=email,
+            password="!",
+            first_name="Transfer",
+            last_name="Copy",
+        )
+        started = time.monotonic()
+        call_command(
+            "import_recipes",
+            export_path,
+            batch_size=options["batch_size"],
+            stdout=StringIO(),
+        )
+        timings["import_recipes"] = time.monotonic() - started
+        imported = Recipe.objects.filter(author__email=email).count()
+
+        for name, elapsed in timings.items():
+            self.stdout.write(
+                f"{name}: {elapsed:.1f} с, {count / elapsed:.0f} рецептов/с, "
+                f"{TARGET} рецептов — около "
+                f"{elapsed * TARGET / count / 60:.1f} мин"
+            )
+        self.stdout.write(f"Загружено {imported} из {count} рецептов")
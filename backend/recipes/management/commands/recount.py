@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.models import Favorite, Recipe, ShoppingCart, Subscription, User
+
+
+def count_of(model, field):
+    """Число строк model, ссылающихся полем field на текущий объект."""
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(count=Count("pk"))
+            .values("count")
+        ),
+        0,
+    )
+
+
+COUNTERS = (
+    (Recipe, "favorites_count", count_of(Favorite, "recipe")),
+    (Recipe, "in_carts_count", count_of(ShoppingCart, "recipe")),
+    (User, "recipes_count", count_of(Recipe, "author")),
+    (User, "subscribers_count", count_of(Subscription, "author")),
+    (User, "subscriptions_count", count_of(Subscription, "subscriber")),
+)
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает счётчики рецептов и пользователей"
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            for model, field, expression in COUNTERS:
+                fixed = model.objects.exclude(
+                    **{field: expression}
+                ).update(**{field: expression})
+                self.stdout.write(
+                    f"{model._meta.verbose_name_plural}.{field}: "
+                    f"исправлено {fixed}"
+                )
+        self.stdout.write(self.style.SUCCESS("Счётчики пересчитаны"))
@@ -0,0 +1,80 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client, override_settings
+
+from recipes.models import Recipe, User
+from recipes.short_links import encode, recipe_existence_cache
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Замеряет переход по короткой ссылке: через весь стек middleware "
+        "и через ShortLinkMiddleware с пустым и заполненным кэшем"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                author = User.objects.create(
+                    username=f"links{int(time.time())}",
+                    email=f"links{int(time.time())}@example.com",
+                    first_name="Links",
+                    last_name="Benchmark",
+                )
+                recipe = Recipe.objects.create(
+                    author=author,
+                    name="Рецепт",
+                    text="-",
+                    cooking_time=1,
+                    image="recipes/images/links.png",
+                )
+                self.measure(f"/s/{encode(recipe.pk)}/", options["requests"])
+                raise Rollback
+        except Rollback:
+            pass
+
+    def measure(self, path, requests):
+        full_stack = [
+            middleware for middleware in settings.MIDDLEWARE
+            if middleware != "recipes.middleware.ShortLinkMiddleware"
+        ]
+        with override_settings(MIDDLEWARE=full_stack):
+            self.report(
+                "Все middleware, без кэша", Client(), path, requests,
+                cold=True,
+            )
+        client = Client()
+        self.report(
+            "ShortLinkMiddleware, без кэша", client, path, requests,
+            cold=True,
+        )
+        self.report(
+            "ShortLinkMiddleware, с кэшем", client, path, requests,
+            cold=False,
+        )
+
+    def report(self, title, client, path, requests, cold):
+        timings = []
+        for _ in range(requests):
+            if cold:
+                recipe_existence_cache.clear()
+            started = time.perf_counter()
+            response = client.get(path)
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 302:
+                raise CommandError(f"{path}: ответ {response.status_code}")
+        timings.sort()
+        self.stdout.write(
+            f"{title}: медиана {timings[len(timings) // 2] * 1e6:.0f} мкс, "
+            f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} мкс"
+        )
@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from recipes.scores import refresh_scores
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает оценки рецептов для лент popular и trending"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Пересчитать один раз и завершиться",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=300,
+            help="Пауза между пересчётами, секунд (дефолт - 300)",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.monotonic()
+            counts = refresh_scores()
+            self.stdout.write(
+                f"Оценки пересчитаны за "
+                f"{time.monotonic() - started:.2f} с: "
+                f"новых {counts['created']}, "
+                f"popular {counts['popular']}, "
+                f"trending {counts['trending']}"
+            )
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,22 @@
+import re
+
+from .views import recipe_short_link_redirect
+
+SHORT_LINK_PATH = re.compile(r"^/s/(?P<code>[0-9A-Za-z]+)/$")
+
+
+class ShortLinkMiddleware:
+    """Отвечает на короткие ссылки, не пропуская запрос дальше.
+
+    Стоит первой в MIDDLEWARE: переходам по ссылкам не нужны ни сессии,
+    ни аутентификация, ни DRF, а ссылки открывают пачками.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        match = SHORT_LINK_PATH.match(request.path_info)
+        if match is None:
+            return self.get_response(request)
+        return recipe_short_link_redirect(request, match["code"])
@@ -0,0 +1,71 @@
+import logging
+
+from django.db import DatabaseError, migrations, transaction
+
+logger = logging.getLogger(__name__)
+
+POSTGRES_INDEXES = (
+    (
+        'recipes_ingredient_name_upper_like',
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_like '
+        'ON recipes_ingredient (UPPER(name::text) text_pattern_ops)',
+    ),
+    (
+        'recipes_ingredient_name_upper_trgm',
+        'CREATE INDEX IF NOT EXISTS recipes_ingredient_name_upper_trgm '
+        'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops)',
+    ),
+)
+
+
+def create_trgm_extension(connection):
+    """Создаёт pg_trgm, если её ещё нет; False, если не хватило прав.
+
+    CREATE EXTENSION требует прав суперпользователя (или владельца БД
+    для доверенных расширений), см. README.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'"
+        )
+        if cursor.fetchone():
+            return True
+        try:
+            with transaction.atomic(using=connection.alias):
+                cursor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        except DatabaseError as error:
+            logger.warning(
+                'Не удалось создать расширение pg_trgm (%s): индекс '
+                'recipes_ingredient_name_upper_trgm не создан', error
+            )
+            return False
+    return True
+
+
+def create_search_indexes(apps, schema_editor):
+    # Индексы под istartswith/icontains нужны только PostgreSQL.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    has_trgm = create_trgm_extension(schema_editor.connection)
+    for name, sql in POSTGRES_INDEXES:
+        if name.endswith('_trgm') and not has_trgm:
+            continue
+        schema_editor.execute(sql)
+
+
+def drop_search_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _ in POSTGRES_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_shoppingcarttotal'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-17 08:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='relations_version',
+            field=models.PositiveBigIntegerField(default=0, verbose_name='Версия избранного, корзины и подписок'),
+        ),
+    ]
@@ -1,11 +1,52 @@
+from collections import defaultdict
+
 from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
+from django.db.models import Exists, OuterRef, Value
+from django.utils import timezone
+
+
+class CounterFieldsMixin:
+    """Не перезаписывает счётчики при сохранении объекта целиком.
+
+    Счётчики меняются только атомарными UPDATE ... SET x = x + 1, поэтому
+    save() изменённого объекта не должен затирать их устаревшими
+    значениями, прочитанными раньше. То же для background_fields — полей,
+    которые пишет только фоновая обработка через update() (варианты
+    изображений, см. recipes.images).
+    """
+
+    counter_fields = ()
+    background_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            skipped = (*self.counter_fields, *self.background_fields)
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in skipped
+            ]
+        super().save(*args, **kwargs)
 
+    @classmethod
+    def change_counters(cls, pk, **deltas):
+        """Атомарно прибавляет deltas к счётчикам объекта pk."""
+        cls.change_counters_in([pk], **deltas)
 
-class User(AbstractUser):
+    @classmethod
+    def change_counters_in(cls, pks, **deltas):
+        """То же для нескольких объектов одним запросом."""
+        cls._default_manager.filter(pk__in=pks).update(**{
+            field: models.F(field) + delta
+            for field, delta in deltas.items()
+        })
+
+
+class User(CounterFieldsMixin, AbstractUser):
     email = models.EmailField('Электронная почта', unique=True)
     username = models.CharField(
         'Ник',
@@ -29,6 +70,27 @@ class User(AbstractUser):
         blank=True,
         null=True
     )
+    avatar_variants = models.JSONField(
+        'Варианты аватара',
+        default=dict,
+        blank=True,
+    )
+    recipes_count = models.PositiveIntegerField('Рецептов', default=0)
+    subscribers_count = models.PositiveIntegerField('Подписчиков', default=0)
+    subscriptions_count = models.PositiveIntegerField('Подписок', default=0)
+    # Растёт при каждом изменении избранного, корзины и подписок
+    # пользователя; входит в ETag ответов с рецептами.
+    relations_version = models.PositiveBigIntegerField(
+        'Версия избранного, корзины и подписок', default=0
+    )
+
+    counter_fields = (
+        'recipes_count',
+        'subscribers_count',
+        'subscriptions_count',
+        'relations_version',
+    )
+    background_fields = ('avatar_variants',)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ['username', 'first_name', 'last_name']
@@ -43,19 +105,176 @@ class User(AbstractUser):
         return self.username
 
 
+class RelationQuerySet(models.QuerySet):
+    """Добавление и удаление связей одним запросом, без гонок.
+
+    Методы не отправляют сигналов: вызывающий код сам меняет счётчики,
+    версии и итоги корзин по тем id, которые вернул метод.
+    """
+
+    def add(self, target, **values):
+        """Создаёт связь values, если объект по внешнему ключу target
+        существует, а такой связи ещё нет; возвращает, создана ли она.
+
+        Выполняется одним INSERT ... SELECT ... ON CONFLICT DO NOTHING
+        RETURNING: из одновременных запросов строку создаёт ровно один,
+        остальные получают False без IntegrityError. Без RETURNING
+        (SQLite до 3.35) — проверка объекта и bulk_create. Как и
+        bulk_create, сигнал post_save не отправляется.
+        """
+        connection = connections[self.db]
+        target_field = self.model._meta.get_field(target)
+        target_id = values.pop(target_field.attname)
+        if not connection.features.can_return_columns_from_insert:
+            if not target_field.related_model._default_manager.filter(
+                pk=target_id
+            ).exists():
+                return False
+            try:
+                with transaction.atomic(using=self.db):
+                    self.bulk_create([self.model(
+                        **values, **{target_field.attname: target_id}
+                    )])
+            except IntegrityError:
+                return False
+            return True
+        return target_id in self.add_many(target, [target_id], **values)
+
+    def add_many(self, target, target_ids, **values):
+        """Создаёт связи values с существующими объектами target_ids,
+        которых ещё нет; возвращает множество id объектов, связь с
+        которыми создал именно этот запрос.
+
+        Один INSERT ... SELECT ... WHERE pk IN ... ON CONFLICT DO NOTHING
+        RETURNING, поэтому счётчики можно менять по результату: связь,
+        созданную одновременным запросом, он не вернёт. Без RETURNING —
+        add() по каждому id.
+        """
+        self._for_write = True
+        connection = connections[self.db]
+        meta = self.model._meta
+        target_field = meta.get_field(target)
+        if not target_ids:
+            return set()
+        if not connection.features.can_return_columns_from_insert:
+            return {
+                target_id for target_id in target_ids
+                if self.add(
+                    target, **values, **{target_field.attname: target_id}
+                )
+            }
+
+        target_meta = target_field.related_model._meta
+        instance = self.model(**values)
+        fields = [
+            field for field in meta.local_concrete_fields
+            if not field.primary_key
+        ]
+        quote = connection.ops.quote_name
+        target_pk = (
+            f'{quote(target_meta.db_table)}.{quote(target_meta.pk.column)}'
+        )
+        # Тип параметров в SELECT PostgreSQL сам не выводит
+        columns = [
+            target_pk if field is target_field
+            else f'CAST(%s AS {field.cast_db_type(connection)})'
+            if connection.vendor == 'postgresql' else '%s'
+            for field in fields
+        ]
+        sql = (
+            f'INSERT INTO {quote(meta.db_table)} '
+            f'({", ".join(quote(field.column) for field in fields)}) '
+            f'SELECT {", ".join(columns)} '
+            f'FROM {quote(target_meta.db_table)} '
+            f'WHERE {target_pk} IN ({", ".join(["%s"] * len(target_ids))}) '
+            f'ON CONFLICT DO NOTHING RETURNING {quote(target_field.column)}'
+        )
+        params = [
+            field.get_db_prep_save(field.pre_save(instance, True), connection)
+            for field in fields
+            if field is not target_field
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, *target_ids])
+            return {target_id for target_id, in cursor.fetchall()}
+
+    def remove(self, target, **values):
+        """Удаляет связь values; возвращает, была ли она.
+
+        Как и add(), сигналов не отправляет (см. remove_many).
+        """
+        target_field = self.model._meta.get_field(target)
+        target_id = values.pop(target_field.attname)
+        return target_id in self.remove_many(target, [target_id], **values)
+
+    def remove_many(self, target, target_ids, **values):
+        """Удаляет связи values с объектами target_ids; возвращает
+        множество id объектов, связь с которыми удалил этот запрос.
+
+        Один DELETE ... RETURNING: строку, удалённую одновременным
+        запросом, он не вернёт. Сигналы post_delete не отправляются, и
+        удаление не разбирается на строки, поэтому счётчики, версии и
+        итоги корзин правит вызывающий код — одним запросом на все id.
+        Без RETURNING — SELECT ... FOR UPDATE и удаление найденных строк.
+        values — значения внешних ключей по attname (user_id=...).
+        """
+        if not target_ids:
+            return set()
+        self._for_write = True
+        connection = connections[self.db]
+        meta = self.model._meta
+        target_field = meta.get_field(target)
+        if not connection.features.can_return_columns_from_insert:
+            rows = dict(
+                self.filter(
+                    **values, **{f'{target_field.attname}__in': target_ids}
+                )
+                .select_for_update()
+                .values_list('pk', target_field.attname)
+            )
+            self.filter(pk__in=rows)._raw_delete(self.db)
+            return set(rows.values())
+
+        quote = connection.ops.quote_name
+        fields = [meta.get_field(name) for name in values]
+        conditions = [f'{quote(field.column)} = %s' for field in fields]
+        conditions.append(
+            f'{quote(target_field.column)} '
+            f'IN ({", ".join(["%s"] * len(target_ids))})'
+        )
+        sql = (
+            f'DELETE FROM {quote(meta.db_table)} '
+            f'WHERE {" AND ".join(conditions)} '
+            f'RETURNING {quote(target_field.column)}'
+        )
+        params = [
+            field.get_db_prep_value(values[name], connection)
+            for name, field in zip(values, fields)
+        ]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [*params, *target_ids])
+            return {target_id for target_id, in cursor.fetchall()}
+
+
 class Subscription(models.Model):
+    # Отдельные индексы по внешним ключам не нужны: по автору ищет
+    # уникальный индекс, по подписчику — subscription_subscriber_idx.
     author = models.ForeignKey(
         User,
         verbose_name='Автор',
         on_delete=models.CASCADE,
+        db_index=False,
     )
     subscriber = models.ForeignKey(
         User,
         verbose_name='Подписчик',
         on_delete=models.CASCADE,
         related_name='subscribers',
+        db_index=False,
     )
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Подписка'
         verbose_name_plural = 'Подписки'
@@ -66,6 +285,12 @@ class Subscription(models.Model):
                 name='unique_subscription'
             ),
         ]
+        indexes = [
+            models.Index(
+                fields=['subscriber', 'author'],
+                name='subscription_subscriber_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.subscriber} подписан на {self.author}'
@@ -96,17 +321,43 @@ class Ingredient(models.Model):
         return f'{self.name}, {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами избранного и корзины для user."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False),
+                is_in_shopping_cart=Value(False),
+            )
+        return self.annotate(
+            is_favorited=Exists(
+                Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+            is_in_shopping_cart=Exists(
+                ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+            ),
+        )
+
+
+class Recipe(CounterFieldsMixin, models.Model):
+    # По автору ищет recipe_author_pub_date_idx
     author = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        verbose_name='Автор'
+        verbose_name='Автор',
+        db_index=False,
     )
     name = models.CharField('Название', max_length=256)
     image = models.ImageField(
         'Изображение',
         upload_to='recipes/images/',
     )
+    image_variants = models.JSONField(
+        'Варианты изображения',
+        default=dict,
+        blank=True,
+    )
     text = models.TextField('Описание')
     ingredients = models.ManyToManyField(
         Ingredient,
@@ -117,28 +368,58 @@ class Recipe(models.Model):
         'Время приготовления',
         validators=[MinValueValidator(1)]
     )
-    pub_date = models.DateTimeField('Дата публикации', auto_now_add=True)
+    favorites_count = models.PositiveIntegerField('В избранном', default=0)
+    in_carts_count = models.PositiveIntegerField('В корзинах', default=0)
+    # Не auto_now_add: import_recipes переносит дату из выгрузки.
+    pub_date = models.DateTimeField(
+        'Дата публикации', default=timezone.now, editable=False
+    )
+    updated_at = models.DateTimeField(
+        'Дата изменения', auto_now=True, db_index=True
+    )
+    # Заполняется только на PostgreSQL, см. recipes.search
+    search_vector = SearchVectorField(
+        'Поисковый вектор', null=True, editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
+
+    counter_fields = ('favorites_count', 'in_carts_count')
+    background_fields = ('image_variants',)
 
     class Meta:
         ordering = ('-pub_date',)
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         default_related_name = 'recipes'
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='recipe_pub_date_id_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='recipe_author_pub_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class IngredientRecipe(models.Model):
+    # По продукту ищет уникальный индекс, по рецепту —
+    # ingredient_recipe_recipe_idx.
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.CASCADE,
         verbose_name='Продукт',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
         verbose_name='Рецепт',
+        db_index=False,
     )
     amount = models.PositiveSmallIntegerField(
         'Количество',
@@ -155,6 +436,12 @@ class IngredientRecipe(models.Model):
                 name='unique_ingredient_recipe'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                name='ingredient_recipe_recipe_idx'
+            ),
+        ]
 
     def __str__(self):
         return (
@@ -164,17 +451,26 @@ class IngredientRecipe(models.Model):
 
 
 class UserRecipeRelation(models.Model):
+    # По пользователю ищет уникальный индекс, по рецепту —
+    # индекс (recipe, user), из которого сразу читаются пользователи.
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
-        verbose_name='Пользователь'
+        verbose_name='Пользователь',
+        db_index=False,
     )
     recipe = models.ForeignKey(
         Recipe,
         on_delete=models.CASCADE,
-        verbose_name='Рецепт'
+        verbose_name='Рецепт',
+        db_index=False,
+    )
+    created_at = models.DateTimeField(
+        'Добавлен', auto_now_add=True, db_index=True
     )
 
+    objects = RelationQuerySet.as_manager()
+
     class Meta:
         abstract = True
         constraints = [
@@ -183,12 +479,18 @@ class UserRecipeRelation(models.Model):
                 name='%(app_label)s_%(class)s_unique'
             )
         ]
+        indexes = [
+            models.Index(
+                fields=['recipe', 'user'], name='%(class)s_recipe_user_idx'
+            ),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.recipe.name}'
 
 
 class Favorite(UserRecipeRelation):
+    recipe_counter = 'favorites_count'
 
     class Meta(UserRecipeRelation.Meta):
         verbose_name = 'Избранный рецепт'
@@ -197,8 +499,287 @@ class Favorite(UserRecipeRelation):
 
 
 class ShoppingCart(UserRecipeRelation):
+    recipe_counter = 'in_carts_count'
 
     class Meta(UserRecipeRelation.Meta):
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзины'
         default_related_name = 'shopping_carts'
+
+
+class RecipeScore(models.Model):
+    """Оценки рецепта для сортировки ленты по популярности.
+
+    Пересчитываются командой update_recipe_scores, см. recipes.scores.
+    """
+
+    recipe = models.OneToOneField(
+        Recipe,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='score',
+        verbose_name='Рецепт',
+    )
+    popular = models.PositiveIntegerField('Популярность', default=0)
+    trending = models.FloatField('Набирает популярность', default=0)
+    updated_at = models.DateTimeField(
+        'Пересчитано', auto_now=True, db_index=True
+    )
+
+    class Meta:
+        verbose_name = 'Оценка рецепта'
+        verbose_name_plural = 'Оценки рецептов'
+        indexes = [
+            models.Index(
+                fields=['-popular', '-recipe'], name='recipe_score_popular_idx'
+            ),
+            models.Index(
+                fields=['-trending', '-recipe'],
+                name='recipe_score_trending_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.recipe}: {self.popular} / {self.trending:.2f}'
+
+
+class TimelineEntry(models.Model):
+    """Рецепт в ленте подписок пользователя (см. recipes.timeline)."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        verbose_name='Рецепт'
+    )
+    pub_date = models.DateTimeField('Дата публикации')
+
+    class Meta:
+        verbose_name = 'Запись ленты подписок'
+        verbose_name_plural = 'Ленты подписок'
+        default_related_name = 'timeline_entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-recipe'],
+                name='timeline_user_pub_date_idx'
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class ShoppingCartTotalQuerySet(models.QuerySet):
+    """Поддержка итогов корзин в актуальном состоянии.
+
+    save() и delete() строк ShoppingCart и IngredientRecipe, удаление
+    рецептов и пользователей переносятся в итоги обработчиками сигналов
+    (recipes.signals), в том числе из админки. Код, который меняет эти
+    строки без сигналов (bulk_create, bulk_update, методы
+    RelationQuerySet), вызывает методы ниже сам. Расхождения исправляет команда
+    rebuild_cart_totals.
+    """
+
+    def change_amounts(self, user_ids, deltas):
+        """Прибавляет deltas {id продукта: количество} к корзинам user_ids."""
+        deltas = {
+            ingredient_id: delta
+            for ingredient_id, delta in deltas.items()
+            if delta
+        }
+        if not user_ids or not deltas:
+            return
+        with transaction.atomic():
+            totals = {
+                (total.user_id, total.ingredient_id): total
+                for total in self.select_for_update().filter(
+                    user_id__in=user_ids, ingredient_id__in=deltas
+                )
+            }
+            to_create, to_update, to_delete = [], [], []
+            for user_id in user_ids:
+                for ingredient_id, delta in deltas.items():
+                    total = totals.get((user_id, ingredient_id))
+                    if total is None:
+                        if delta > 0:
+                            to_create.append(self.model(
+                                user_id=user_id,
+                                ingredient_id=ingredient_id,
+                                amount=delta,
+                            ))
+                        continue
+                    total.amount += delta
+                    if total.amount > 0:
+                        to_update.append(total)
+                    else:
+                        to_delete.append(total.pk)
+            self.bulk_create(to_create)
+            self.bulk_update(to_update, ['amount'])
+            self.filter(pk__in=to_delete).delete()
+
+    def add_recipe(self, user_id, recipe_id, sign=1):
+        self.add_recipes(user_id, [recipe_id], sign)
+
+    def remove_recipe(self, user_id, recipe_id):
+        self.add_recipe(user_id, recipe_id, sign=-1)
+
+    def add_recipes(self, user_id, recipe_ids, sign=1):
+        """Переносит в корзину user_id продукты сразу нескольких рецептов."""
+        deltas = defaultdict(int)
+        for ingredient_id, amount in IngredientRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('ingredient_id', 'amount'):
+            deltas[ingredient_id] += sign * amount
+        self.change_amounts([user_id], deltas)
+
+    def remove_recipes(self, user_id, recipe_ids):
+        self.add_recipes(user_id, recipe_ids, sign=-1)
+
+    def change_recipe(self, recipe_id, old_amounts, new_amounts):
+        """Переносит в корзины изменение продуктов рецепта."""
+        self.change_amounts(
+            list(ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True)),
+            {
+                ingredient_id: (
+                    new_amounts.get(ingredient_id, 0)
+                    - old_amounts.get(ingredient_id, 0)
+                )
+                for ingredient_id in old_amounts.keys() | new_amounts.keys()
+            }
+        )
+
+    def delete_recipe(self, recipe_id):
+        """Убирает рецепт из итогов всех корзин перед его удалением."""
+        self.change_recipe(
+            recipe_id,
+            dict(IngredientRecipe.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('ingredient_id', 'amount')),
+            {},
+        )
+
+    def compute(self):
+        """Итоги корзин, посчитанные заново по ShoppingCart."""
+        return (
+            IngredientRecipe.objects
+            .filter(recipe__shopping_carts__isnull=False)
+            .values('recipe__shopping_carts__user', 'ingredient')
+            .annotate(total=models.Sum('amount'))
+            .order_by()
+        )
+
+    @transaction.atomic
+    def rebuild(self):
+        self.all().delete()
+        self.bulk_create(
+            (
+                self.model(
+                    user_id=row['recipe__shopping_carts__user'],
+                    ingredient_id=row['ingredient'],
+                    amount=row['total'],
+                )
+                for row in self.compute().iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class ShoppingCartTotal(models.Model):
+    """Суммарное количество продукта в корзине пользователя."""
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        verbose_name='Продукт',
+    )
+    amount = models.PositiveIntegerField('Количество')
+
+    objects = ShoppingCartTotalQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Итог корзины'
+        verbose_name_plural = 'Итоги корзин'
+        default_related_name = 'shopping_cart_totals'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_cart_total'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.ingredient}: {self.amount}'
+
+
+class ImageJob(models.Model):
+    """Задача на подготовку уменьшенных копий изображения."""
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (PROCESSING, 'Обрабатывается'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    model = models.CharField('Модель', max_length=64)
+    object_id = models.PositiveBigIntegerField('Идентификатор объекта')
+    field = models.CharField('Поле', max_length=64)
+    source = models.CharField('Исходный файл', max_length=255)
+    status = models.CharField(
+        'Статус', max_length=16, choices=STATUSES, default=PENDING
+    )
+    attempts = models.PositiveSmallIntegerField('Попыток', default=0)
+    error = models.TextField('Ошибка', blank=True)
+    created_at = models.DateTimeField('Создана', auto_now_add=True)
+    updated_at = models.DateTimeField('Изменена', auto_now=True)
+
+    class Meta:
+        verbose_name = 'Обработка изображения'
+        verbose_name_plural = 'Обработка изображений'
+        ordering = ('created_at',)
+        indexes = [
+            # Очередь: в индексе только ждущие задачи
+            models.Index(
+                fields=['created_at'],
+                condition=models.Q(status='pending'),
+                name='image_job_pending_idx',
+            ),
+        ]
+
+    def __str__(self):
+        return f'{self.model}#{self.object_id}.{self.field}: {self.status}'
+
+
+class DataVersion(models.Model):
+    """Номер версии набора данных (см. recipes.versions)."""
+
+    name = models.CharField('Набор данных', max_length=64, primary_key=True)
+    version = models.PositiveBigIntegerField('Версия', default=0)
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}: {self.version}'
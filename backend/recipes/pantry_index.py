@@ -0,0 +1,260 @@
+import re
+import time
+from array import array
+from bisect import bisect_left, insort
+from datetime import timedelta
+from itertools import groupby
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Count, Max
+
+from .models import IngredientRecipe, Recipe
+from .versions import RECIPES, get_version
+
+# Рецепты, сохранённые раньше последней синхронизации, но видимые только
+# после неё (долгая транзакция), перечитываются с таким запасом.
+SYNC_OVERLAP = timedelta(minutes=1)
+# При большем числе изменённых рецептов индекс строится заново.
+MAX_INCREMENTAL_UPDATE = 1000
+# Продукт хранится и битовой картой, если встречается в большей доле
+# рецептов: тогда карта не больше чем в 8 раз крупнее массива id.
+BITMAP_MIN_SHARE = 1 / 256
+NONZERO_BYTE = re.compile(rb'[^\x00]')
+
+
+def grow(sizes, recipe_id):
+    """Дотягивает массив размеров рецептов до индекса recipe_id."""
+    if recipe_id >= len(sizes):
+        missing = max(recipe_id + 1, 2 * len(sizes)) - len(sizes)
+        sizes.frombytes(bytes(sizes.itemsize * missing))
+
+
+def to_bitmap(recipe_ids):
+    """Множество id рецептов как целое число: бит r — рецепт r."""
+    if not recipe_ids:
+        return 0
+    bitmap = bytearray(max(recipe_ids) // 8 + 1)
+    for recipe_id in recipe_ids:
+        bitmap[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(bitmap, 'little')
+
+
+def from_bitmap(bitmap):
+    """id рецептов из битовой карты по возрастанию."""
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    recipe_ids = []
+    for match in NONZERO_BYTE.finditer(data):
+        byte, base = match.group()[0], match.start() * 8
+        recipe_ids.extend(base + bit for bit in range(8) if byte >> bit & 1)
+    return recipe_ids
+
+
+def add_to_planes(planes, bitmap):
+    """Прибавляет 1 к счётчикам рецептов из bitmap.
+
+    Счётчики хранятся по битам: planes[j] — j-е биты счётчиков всех
+    рецептов, так что сложение — несколько операций над целыми числами.
+    """
+    carry = bitmap
+    for j, plane in enumerate(planes):
+        if not carry:
+            return
+        planes[j], carry = plane ^ carry, plane & carry
+    if carry:
+        planes.append(carry)
+
+
+def subtract_planes(minuend, subtrahend):
+    difference = []
+    borrow = 0
+    for j in range(max(len(minuend), len(subtrahend))):
+        a = minuend[j] if j < len(minuend) else 0
+        b = subtrahend[j] if j < len(subtrahend) else 0
+        difference.append(a ^ b ^ borrow)
+        borrow = (~a & (b | borrow)) | (b & borrow)
+    return difference
+
+
+def planes_equal(planes, value, mask):
+    """Рецепты из mask, счётчик которых в planes равен value."""
+    if value >> len(planes):
+        return 0
+    for j, plane in enumerate(planes):
+        mask &= plane if value >> j & 1 else ~plane
+    return mask
+
+
+class PantryIndex:
+    """Обратный индекс «продукт → рецепты» для подбора рецептов
+    по имеющимся продуктам.
+
+    Для каждого продукта хранится отсортированный массив id рецептов,
+    для каждого рецепта — число его продуктов. Частые продукты (соль,
+    лук) дополнительно хранятся битовыми картами, а числа продуктов —
+    по битам (size_planes). Подбор складывает карты продуктов запроса
+    в побитовые счётчики и сравнивает их с размерами рецептов целиком,
+    не перебирая рецепты по одному и не обращаясь к БД.
+
+    Версия индекса — версия RECIPES (recipes.versions): её проверка —
+    один поиск по первичному ключу и делается не чаще раза в
+    PANTRY_INDEX_CHECK_INTERVAL секунд. Только когда версия изменилась,
+    считаются число рецептов и последнее updated_at. Изменённые рецепты
+    применяются к индексу точечно; удаление рецепта или много изменений
+    сразу ведут к полной перестройке. Первую сборку, долгую на большой
+    базе, делает wsgi.py при запуске процесса (PANTRY_INDEX_WARM_UP).
+    """
+
+    def __init__(self):
+        self.lock = Lock()
+        self.version = None
+        self.synced_at = None
+        self.checked_at = None
+        self.load(())
+
+    def load(self, rows):
+        """Строит индекс из пар (id продукта, id рецепта),
+        отсортированных по продукту и рецепту."""
+        postings = {}
+        sizes = array('H')
+        for ingredient_id, group in groupby(rows, key=lambda row: row[0]):
+            recipes = array('I', (recipe_id for _, recipe_id in group))
+            for recipe_id in recipes:
+                grow(sizes, recipe_id)
+                sizes[recipe_id] += 1
+            postings[ingredient_id] = recipes
+        dense = len(sizes) * BITMAP_MIN_SHARE
+        self.postings = postings
+        self.bitmaps = {
+            ingredient_id: to_bitmap(recipes)
+            for ingredient_id, recipes in postings.items()
+            if len(recipes) > dense
+        }
+        self.sizes = sizes
+        self.size_planes = [
+            to_bitmap([
+                recipe_id for recipe_id, size in enumerate(sizes)
+                if size >> j & 1
+            ])
+            for j in range(max(sizes, default=0).bit_length())
+        ]
+        self.recipe_count = sum(1 for size in sizes if size)
+
+    def build(self):
+        self.load(
+            IngredientRecipe.objects.order_by(
+                'ingredient_id', 'recipe_id'
+            ).values_list('ingredient_id', 'recipe_id').iterator()
+        )
+
+    def update_recipe(self, recipe_id, ingredient_ids):
+        """Заменяет продукты рецепта в индексе на ingredient_ids."""
+        bit = 1 << recipe_id
+        grow(self.sizes, recipe_id)
+        old_size = self.sizes[recipe_id]
+        if old_size:
+            for ingredient_id, recipes in self.postings.items():
+                i = bisect_left(recipes, recipe_id)
+                if i < len(recipes) and recipes[i] == recipe_id:
+                    del recipes[i]
+                    if ingredient_id in self.bitmaps:
+                        self.bitmaps[ingredient_id] &= ~bit
+            self.recipe_count -= 1
+        for ingredient_id in ingredient_ids:
+            insort(self.postings.setdefault(ingredient_id, array('I')),
+                   recipe_id)
+            if ingredient_id in self.bitmaps:
+                self.bitmaps[ingredient_id] |= bit
+        size = len(ingredient_ids)
+        self.sizes[recipe_id] = size
+        while size.bit_length() > len(self.size_planes):
+            self.size_planes.append(0)
+        for j in range(len(self.size_planes)):
+            if (old_size ^ size) >> j & 1:
+                self.size_planes[j] ^= bit
+        if ingredient_ids:
+            self.recipe_count += 1
+
+    def sync(self, since):
+        changed = list(
+            Recipe.objects.filter(updated_at__gte=since - SYNC_OVERLAP)
+            .values_list('id', flat=True)[:MAX_INCREMENTAL_UPDATE + 1]
+        )
+        if len(changed) > MAX_INCREMENTAL_UPDATE:
+            return False
+        ingredients = {recipe_id: [] for recipe_id in changed}
+        for recipe_id, ingredient_id in IngredientRecipe.objects.filter(
+            recipe_id__in=changed
+        ).values_list('recipe_id', 'ingredient_id'):
+            ingredients[recipe_id].append(ingredient_id)
+        for recipe_id, ingredient_ids in ingredients.items():
+            self.update_recipe(recipe_id, ingredient_ids)
+        return True
+
+    def refresh(self):
+        now = time.monotonic()
+        if (
+            self.checked_at is not None
+            and now - self.checked_at < settings.PANTRY_INDEX_CHECK_INTERVAL
+        ):
+            return
+        self.checked_at = now
+        version = get_version(RECIPES)
+        if version == self.version:
+            return
+        with self.lock:
+            if version == self.version:
+                return
+            stats = Recipe.objects.aggregate(
+                count=Count('id'), last=Max('updated_at')
+            )
+            count, last_modified = stats['count'], stats['last']
+            if not (
+                self.synced_at is not None
+                and count >= self.recipe_count
+                and self.sync(self.synced_at)
+                and count == self.recipe_count
+            ):
+                self.build()
+            self.version = version
+            self.synced_at = last_modified
+
+    def match(self, ingredient_ids, max_missing=0, limit=None):
+        """Рецепты, для которых не хватает не больше max_missing продуктов.
+
+        Возвращает кортежи (не хватает, есть в наличии, id рецепта):
+        сначала рецепты, которым хватает всего, затем с одним недостающим
+        продуктом и так далее; при равенстве — где больше продуктов
+        в наличии, затем более новые. Рецепты без единого продукта из
+        ingredient_ids не подходят.
+        """
+        self.refresh()
+        ingredient_ids = set(ingredient_ids)
+        with self.lock:
+            matched = []
+            candidates = 0
+            for ingredient_id in ingredient_ids:
+                bitmap = self.bitmaps.get(ingredient_id)
+                if bitmap is None:
+                    bitmap = to_bitmap(self.postings.get(ingredient_id, ()))
+                add_to_planes(matched, bitmap)
+                candidates |= bitmap
+            missing = subtract_planes(self.size_planes, matched)
+        found = []
+        for missing_count in range(max_missing + 1):
+            with_missing = planes_equal(missing, missing_count, candidates)
+            for matched_count in range(len(ingredient_ids), 0, -1):
+                if not with_missing:
+                    break
+                group = planes_equal(matched, matched_count, with_missing)
+                with_missing &= ~group
+                found.extend(
+                    (missing_count, matched_count, recipe_id)
+                    for recipe_id in reversed(from_bitmap(group))
+                )
+                if limit is not None and len(found) >= limit:
+                    return found[:limit]
+        return found
+
+
+pantry_index = PantryIndex()
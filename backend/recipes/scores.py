@@ -0,0 +1,129 @@
+"""Оценки рецептов для лент ?ordering=popular и ?ordering=trending.
+
+popular — сколько раз рецепт добавлен в избранное и в корзины (счётчики
+Recipe). trending — те же добавления за последние RECIPE_TRENDING_DAYS
+дней, каждое с весом, который вдвое падает за
+RECIPE_TRENDING_HALF_LIFE_HOURS часов.
+
+Затухание у всех рецептов одинаковое, поэтому trending хранится без него:
+как log2 суммы весов 2 ** ((created_at - TRENDING_EPOCH) / период
+полураспада). Порядок рецептов по нему тот же, что по затухающей сумме
+в любой момент, а значение меняется только вместе с добавлениями рецепта
+— новыми или выпавшими из окна.
+
+Лента читает готовые значения из RecipeScore по индексам; пересчёт
+выполняет update_recipe_scores. Он не агрегирует таблицы Favorite и
+ShoppingCart целиком и переписывает только изменившиеся оценки: иначе
+каждый пересчёт менял бы версию лент (get_scores_version) и сбрасывал
+их кэш.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone as dt_timezone
+from math import fsum, log2
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max, OuterRef, Subquery
+from django.utils import timezone
+
+from .models import Favorite, Recipe, RecipeScore, ShoppingCart
+
+TRENDING_WEIGHTS = (
+    (Favorite, 1.0),
+    (ShoppingCart, 1.0),
+)
+TRENDING_EPOCH = datetime(2020, 1, 1, tzinfo=dt_timezone.utc)
+BATCH_SIZE = 1000
+
+
+def create_missing_scores():
+    """Заводит оценки рецептам, созданным в обход сигнала."""
+    return len(RecipeScore.objects.bulk_create(
+        (
+            RecipeScore(recipe_id=recipe_id)
+            for recipe_id in Recipe.objects.filter(
+                score__isnull=True
+            ).values_list('id', flat=True).iterator()
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    ))
+
+
+def refresh_popular(now):
+    popular = Subquery(
+        Recipe.objects.filter(pk=OuterRef('recipe')).values(
+            total=F('favorites_count') + F('in_carts_count')
+        )
+    )
+    return RecipeScore.objects.exclude(popular=popular).update(
+        popular=popular, updated_at=now
+    )
+
+
+def log2_sum(exponents):
+    """log2 суммы 2 ** x без переполнения.
+
+    fsum не зависит от порядка слагаемых, поэтому оценка рецепта с теми же
+    добавлениями совпадает с сохранённой точно.
+    """
+    top = max(exponents)
+    return top + log2(fsum(2 ** (value - top) for value in exponents))
+
+
+def compute_trending(now):
+    """{id рецепта: trending} по добавлениям внутри окна."""
+    since = now - timedelta(days=settings.RECIPE_TRENDING_DAYS)
+    half_life = timedelta(hours=settings.RECIPE_TRENDING_HALF_LIFE_HOURS)
+    exponents = defaultdict(list)
+    for model, weight in TRENDING_WEIGHTS:
+        events = model.objects.filter(created_at__gte=since).values_list(
+            'recipe_id', 'created_at'
+        )
+        for recipe_id, created_at in events.iterator():
+            exponents[recipe_id].append(
+                log2(weight) + (created_at - TRENDING_EPOCH) / half_life
+            )
+    return {
+        recipe_id: log2_sum(values) for recipe_id, values in exponents.items()
+    }
+
+
+def refresh_trending(now):
+    scores = compute_trending(now)
+    with transaction.atomic():
+        current = dict(
+            RecipeScore.objects.filter(trending__gt=0).values_list(
+                'recipe_id', 'trending'
+            )
+        )
+        stale = current.keys() - scores.keys()
+        RecipeScore.objects.filter(recipe_id__in=stale).update(
+            trending=0, updated_at=now
+        )
+        changed = [
+            RecipeScore(recipe_id=recipe_id, trending=score, updated_at=now)
+            for recipe_id, score in scores.items()
+            if current.get(recipe_id) != score
+        ]
+        RecipeScore.objects.bulk_update(
+            changed, ['trending', 'updated_at'], batch_size=BATCH_SIZE
+        )
+    return len(stale) + len(changed)
+
+
+def refresh_scores(now=None):
+    """Пересчитывает оценки, возвращает число изменённых по видам."""
+    now = now or timezone.now()
+    return {
+        'created': create_missing_scores(),
+        'popular': refresh_popular(now),
+        'trending': refresh_trending(now),
+    }
+
+
+def get_scores_version():
+    """Момент последнего изменения оценок — часть версии ленты."""
+    return RecipeScore.objects.aggregate(
+        last_modified=Max('updated_at')
+    )['last_modified']
@@ -0,0 +1,144 @@
+"""Полнотекстовый поиск рецептов по названию, продуктам и описанию.
+
+На PostgreSQL поиск идёт по столбцу Recipe.search_vector (tsvector с
+весами A — название, B — продукты, C — описание) и GIN-индексу на нём,
+ранжирование — ts_rank. На SQLite тот же текст хранится в виртуальной
+таблице FTS5 recipes_recipe_fts (rowid = id рецепта), ранжирование —
+bm25 с теми же приоритетами полей; слова запроса ищутся как префиксы,
+морфологии и замены «ё» на «е», как у словаря russian, здесь нет. Обе
+структуры создаёт миграция 0010.
+
+Индекс обновляет update_search_index: его вызывают сохранение рецепта
+через API и админку, импорт и переименование продукта. Полностью
+пересобирает индекс команда rebuild_search_index.
+"""
+import re
+
+from django.contrib.postgres.search import (
+    SearchQuery,
+    SearchRank,
+    SearchVector,
+)
+from django.db import connection
+from django.db.models import F, FloatField, OuterRef, Subquery, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Coalesce
+
+from .models import IngredientRecipe, Recipe
+
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+# Веса столбцов name, ingredients, text для bm25
+FTS_WEIGHTS = '10.0, 4.0, 1.0'
+FTS_FILL = f'''
+    INSERT INTO {FTS_TABLE} (rowid, name, ingredients, text)
+    SELECT r.id, r.name, COALESCE((
+        SELECT group_concat(i.name, ' ')
+        FROM recipes_ingredientrecipe ri
+        JOIN recipes_ingredient i ON i.id = ri.ingredient_id
+        WHERE ri.recipe_id = r.id
+    ), ''), r.text
+    FROM recipes_recipe r
+'''
+
+
+def is_postgresql():
+    return connection.vendor == 'postgresql'
+
+
+def update_search_index(recipe_ids=None):
+    """Обновляет индекс для recipe_ids (None — для всех рецептов)."""
+    if recipe_ids is not None:
+        recipe_ids = list(recipe_ids)
+        if not recipe_ids:
+            return
+    if is_postgresql():
+        update_search_vectors(recipe_ids)
+    else:
+        update_fts_rows(recipe_ids)
+
+
+def update_search_vectors(recipe_ids):
+    # Агрегаты contrib.postgres требуют psycopg, поэтому импорт здесь.
+    from django.contrib.postgres.aggregates import StringAgg
+
+    ingredient_names = Subquery(
+        IngredientRecipe.objects.filter(recipe=OuterRef('pk'))
+        .order_by()
+        .values('recipe')
+        .annotate(names=StringAgg('ingredient__name', delimiter=' '))
+        .values('names')
+    )
+    recipes = Recipe.objects.all()
+    if recipe_ids is not None:
+        recipes = recipes.filter(pk__in=recipe_ids)
+    recipes.update(search_vector=(
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector(
+            Coalesce(ingredient_names, Value('')),
+            weight='B',
+            config=SEARCH_CONFIG,
+        )
+        + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+    ))
+
+
+def update_fts_rows(recipe_ids):
+    with connection.cursor() as cursor:
+        if recipe_ids is None:
+            cursor.execute(f'DELETE FROM {FTS_TABLE}')
+            cursor.execute(FTS_FILL)
+            return
+        placeholders = ', '.join(['%s'] * len(recipe_ids))
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN ({placeholders})',
+            recipe_ids,
+        )
+        cursor.execute(
+            f'{FTS_FILL} WHERE r.id IN ({placeholders})', recipe_ids
+        )
+
+
+def delete_from_search_index(recipe_id):
+    # Строка tsvector удаляется вместе с рецептом, FTS5 — отдельно.
+    if not is_postgresql():
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [recipe_id]
+            )
+
+
+def get_fts_query(text):
+    """Запрос FTS5 из слов text: каждое слово как префикс, в кавычках,
+    чтобы операторы FTS5 во вводе пользователя не разбирались."""
+    return ' '.join(f'"{word}"*' for word in re.findall(r'\w+', text))
+
+
+def search_recipes(recipes, text):
+    """Рецепты, подходящие под text, с релевантностью в аннотации
+    search_rank."""
+    if is_postgresql():
+        query = SearchQuery(
+            text, config=SEARCH_CONFIG, search_type='websearch'
+        )
+        return recipes.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query)
+        )
+
+    fts_query = get_fts_query(text)
+    if not fts_query:
+        # search_rank нужен и пустому результату: по нему сортирует список
+        return recipes.none().annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        )
+    # bm25 тем меньше, чем лучше совпадение
+    return recipes.filter(id__in=RawSQL(
+        f'SELECT rowid FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH %s',
+        (fts_query,),
+    )).annotate(search_rank=RawSQL(
+        f'SELECT -bm25({FTS_TABLE}, {FTS_WEIGHTS}) FROM {FTS_TABLE} '
+        f'WHERE {FTS_TABLE} MATCH %s '
+        f'AND {FTS_TABLE}.rowid = recipes_recipe.id',
+        (fts_query,),
+        output_field=FloatField(),
+    ))
@@ -0,0 +1,171 @@
+"""Короткие ссылки на рецепты.
+
+Код ссылки — id рецепта, перемешанный обратимой перестановкой (сеть
+Фейстеля с ключом SHORT_LINK_KEY) и записанный в base62: соседние
+рецепты получают непохожие коды, а по коду нельзя перебрать рецепты
+подряд. Первый символ кода — всегда буква, поэтому старые ссылки вида
+/s/<id>/ из одних цифр продолжают работать.
+
+Существование рецепта при переходе проверяется по ограниченному LRU-кэшу
+в памяти процесса (RecipeExistenceCache), записи в нём живут не дольше
+SHORT_LINK_CACHE_TIMEOUT секунд. Сохранение и удаление рецепта сразу
+убирают его из кэша своего процесса. Удаление ещё и увеличивает версию
+RECIPE_DELETIONS (recipes.versions): кэши остальных процессов сверяют её
+не чаще раза в SHORT_LINK_CHECK_INTERVAL секунд и, если она изменилась,
+очищаются — удалённый рецепт перестаёт открываться по ссылке почти сразу.
+"""
+import time
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Recipe
+from .versions import RECIPE_DELETIONS, bump_version, get_version
+
+DIGITS = '0123456789'
+LETTERS = 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ'
+ALPHABET = DIGITS + LETTERS
+# id перемешиваются в пределах 40 бит (до 10 ** 12 рецептов)
+HALF_BITS = 20
+HALF_MASK = (1 << HALF_BITS) - 1
+ROUNDS = 4
+
+
+def round_key(value, round_number):
+    digest = blake2b(
+        value.to_bytes(4, 'big'),
+        digest_size=4,
+        key=settings.SHORT_LINK_KEY.encode(),
+        salt=round_number.to_bytes(16, 'big'),
+    ).digest()
+    return int.from_bytes(digest, 'big') & HALF_MASK
+
+
+def permute(value, inverse=False):
+    """Обратимая перестановка 40-битных чисел."""
+    left, right = value >> HALF_BITS, value & HALF_MASK
+    rounds = range(ROUNDS)
+    if inverse:
+        left, right = right, left
+        rounds = reversed(rounds)
+    for round_number in rounds:
+        left, right = right, left ^ round_key(right, round_number)
+    if inverse:
+        left, right = right, left
+    return left << HALF_BITS | right
+
+
+def encode(recipe_id):
+    """Код короткой ссылки для recipe_id."""
+    if not 0 <= recipe_id < 1 << 2 * HALF_BITS:
+        raise ValueError(f'id {recipe_id} вне диапазона коротких ссылок')
+    value, first = divmod(permute(recipe_id), len(LETTERS))
+    code = LETTERS[first]
+    while value:
+        value, digit = divmod(value, len(ALPHABET))
+        code += ALPHABET[digit]
+    return code
+
+
+def decode(code):
+    """id рецепта по коду или None, если код неверный."""
+    if not code or code[0] not in LETTERS:
+        return None
+    value = 0
+    for char in reversed(code[1:]):
+        digit = ALPHABET.find(char)
+        if digit < 0:
+            return None
+        value = value * len(ALPHABET) + digit
+    value = value * len(LETTERS) + LETTERS.index(code[0])
+    if value >> 2 * HALF_BITS:
+        return None
+    recipe_id = permute(value, inverse=True)
+    # У каждого id ровно один код: «010» и «01» не должны совпасть.
+    return recipe_id if encode(recipe_id) == code else None
+
+
+def parse(code):
+    """id рецепта по коду или по старой ссылке из цифр."""
+    if code.isdigit() and code.isascii():
+        return int(code)
+    return decode(code)
+
+
+class RecipeExistenceCache:
+    """Ограниченный LRU-кэш «id рецепта → существует ли он»."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.entries = OrderedDict()
+        self.version = None
+        self.checked_at = None
+
+    def check_version(self, now):
+        """Очищает кэш, если после прошлой проверки удаляли рецепты."""
+        if (
+            self.checked_at is not None
+            and now - self.checked_at < settings.SHORT_LINK_CHECK_INTERVAL
+        ):
+            return
+        self.checked_at = now
+        version = get_version(RECIPE_DELETIONS)
+        with self.lock:
+            if version != self.version:
+                self.entries.clear()
+                self.version = version
+
+    def exists(self, recipe_id):
+        now = time.monotonic()
+        self.check_version(now)
+        with self.lock:
+            entry = self.entries.get(recipe_id)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(recipe_id)
+                return entry[0]
+        found = Recipe.objects.filter(pk=recipe_id).exists()
+        with self.lock:
+            self.entries[recipe_id] = (
+                found, now + settings.SHORT_LINK_CACHE_TIMEOUT
+            )
+            self.entries.move_to_end(recipe_id)
+            while len(self.entries) > settings.SHORT_LINK_CACHE_SIZE:
+                self.entries.popitem(last=False)
+        return found
+
+    def discard(self, recipe_id):
+        with self.lock:
+            self.entries.pop(recipe_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+            self.checked_at = None
+
+
+recipe_existence_cache = RecipeExistenceCache()
+
+
+def resolve(code):
+    """id существующего рецепта по коду ссылки или None."""
+    recipe_id = parse(code)
+    if recipe_id is None or not recipe_existence_cache.exists(recipe_id):
+        return None
+    return recipe_id
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def recipe_changed(instance, **kwargs):
+    # Новый рецепт мог быть закэширован как несуществующий.
+    recipe_existence_cache.discard(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(**kwargs):
+    bump_version(RECIPE_DELETIONS)
@@ -0,0 +1,277 @@
+from django.db.models import QuerySet
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import (
+    Favorite,
+    Ingredient,
+    IngredientRecipe,
+    Recipe,
+    RecipeScore,
+    ShoppingCart,
+    ShoppingCartTotal,
+    Subscription,
+    User,
+)
+from . import timeline
+from .search import delete_from_search_index, update_search_index
+from .versions import RECIPES, bump_version
+
+# Счётчики, которые меняет строка связи: (модель, внешний ключ, поле)
+RELATION_COUNTERS = {
+    Favorite: ((Recipe, 'recipe_id', Favorite.recipe_counter),),
+    ShoppingCart: ((Recipe, 'recipe_id', ShoppingCart.recipe_counter),),
+    Subscription: (
+        (User, 'author_id', 'subscribers_count'),
+        (User, 'subscriber_id', 'subscriptions_count'),
+    ),
+}
+
+
+@receiver(post_save, sender=User)
+def author_changed(instance, created, update_fields=None, **kwargs):
+    # Профиль автора входит в ответ рецепта, поэтому его изменение
+    # меняет и версию рецептов (Recipe.updated_at).
+    if created or update_fields == frozenset({'last_login'}):
+        return
+    if Recipe.objects.filter(author=instance).update(
+        updated_at=timezone.now()
+    ):
+        bump_version(RECIPES)
+
+
+@receiver(post_save, sender=Ingredient)
+@receiver(pre_delete, sender=Ingredient)
+def ingredient_changed(instance, **kwargs):
+    if Recipe.objects.filter(
+        recipe_ingredients__ingredient=instance
+    ).update(updated_at=timezone.now()):
+        bump_version(RECIPES)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(instance, created, **kwargs):
+    # Без строки оценок рецепт не попадёт в ленты по популярности
+    # до следующего запуска update_recipe_scores.
+    if created:
+        RecipeScore.objects.create(recipe=instance)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_renamed(instance, created, **kwargs):
+    if not created:
+        update_search_index(Recipe.objects.filter(
+            recipe_ingredients__ingredient=instance
+        ).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(**kwargs):
+    bump_version(RECIPES)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(instance, **kwargs):
+    delete_from_search_index(instance.id)
+    bump_version(RECIPES)
+
+
+def is_cascade(sender, origin):
+    """Строка удаляется каскадом вместе с рецептом, пользователем или
+    продуктом, а не сама по себе."""
+    if origin is None:
+        return False
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return not issubclass(model, sender)
+
+
+def is_deleted_with(origin, model, pk):
+    """Объект model с pk удаляется сам (origin), и его счётчики не нужны."""
+    return isinstance(origin, model) and origin.pk == pk
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_saving(instance, raw=False, update_fields=None, **kwargs):
+    # Автора можно сменить в админке: счётчик рецептов переходит к новому.
+    instance._previous_author_id = None
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and 'author' not in update_fields:
+        return
+    instance._previous_author_id = Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('author_id', flat=True).first()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_author_counted(instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_author_id', None)
+    if created:
+        User.change_counters(instance.author_id, recipes_count=1)
+    elif previous is not None and previous != instance.author_id:
+        User.change_counters(previous, recipes_count=-1)
+        User.change_counters(instance.author_id, recipes_count=1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_author_uncounted(instance, origin=None, **kwargs):
+    if not is_deleted_with(origin, User, instance.author_id):
+        User.change_counters(instance.author_id, recipes_count=-1)
+
+
+@receiver(pre_save, sender=IngredientRecipe)
+@receiver(pre_save, sender=Favorite)
+@receiver(pre_save, sender=ShoppingCart)
+@receiver(pre_save, sender=Subscription)
+def row_saving(sender, instance, raw=False, **kwargs):
+    # Прежняя строка нужна, чтобы перенести в итоги корзин разницу
+    # и сменить версию прежнему владельцу связи.
+    instance._previous = None
+    if not raw and instance.pk is not None:
+        instance._previous = sender._default_manager.filter(
+            pk=instance.pk
+        ).first()
+
+
+@receiver(post_save, sender=IngredientRecipe)
+def recipe_ingredient_saved(instance, raw=False, **kwargs):
+    if raw:
+        return
+    bump_version(RECIPES)
+    previous = getattr(instance, '_previous', None)
+    new_amounts = {instance.ingredient_id: instance.amount}
+    if previous is not None and previous.recipe_id == instance.recipe_id:
+        ShoppingCartTotal.objects.change_recipe(
+            instance.recipe_id,
+            {previous.ingredient_id: previous.amount},
+            new_amounts,
+        )
+        return
+    if previous is not None:
+        ShoppingCartTotal.objects.change_recipe(
+            previous.recipe_id, {previous.ingredient_id: previous.amount}, {}
+        )
+    ShoppingCartTotal.objects.change_recipe(
+        instance.recipe_id, {}, new_amounts
+    )
+
+
+@receiver(post_delete, sender=IngredientRecipe)
+def recipe_ingredient_deleted(sender, instance, origin=None, **kwargs):
+    # При удалении рецепта итоги уже поправил recipe_deleting.
+    if is_cascade(sender, origin):
+        return
+    bump_version(RECIPES)
+    ShoppingCartTotal.objects.change_recipe(
+        instance.recipe_id, {instance.ingredient_id: instance.amount}, {}
+    )
+
+
+@receiver(post_save, sender=ShoppingCart)
+def cart_item_saved(instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        if (previous.user_id, previous.recipe_id) == (
+            instance.user_id, instance.recipe_id
+        ):
+            return
+        ShoppingCartTotal.objects.remove_recipe(
+            previous.user_id, previous.recipe_id
+        )
+    ShoppingCartTotal.objects.add_recipe(instance.user_id, instance.recipe_id)
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def cart_item_deleted(sender, instance, origin=None, **kwargs):
+    # Итоги удаляемого пользователя удаляются каскадом, а удаляемого
+    # рецепта — уже поправлены recipe_deleting.
+    if is_cascade(sender, origin):
+        return
+    ShoppingCartTotal.objects.remove_recipe(
+        instance.user_id, instance.recipe_id
+    )
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(instance, **kwargs):
+    # Сигнал приходит и для рецептов, удаляемых каскадом вместе
+    # с автором; корзины и продукты рецепта в этот момент ещё на месте.
+    ShoppingCartTotal.objects.delete_recipe(instance.id)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def relation_changed(sender, instance, raw=False, **kwargs):
+    # API меняет версию сам, вместе со счётчиками; здесь — правки из
+    # админки и каскадные удаления. Лишнее увеличение версии безвредно.
+    if raw:
+        return
+    owner = 'subscriber_id' if sender is Subscription else 'user_id'
+    user_ids = {getattr(instance, owner)}
+    previous = getattr(instance, '_previous', None)
+    if previous is not None:
+        user_ids.add(getattr(previous, owner))
+    User.change_counters_in(user_ids, relations_version=1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscription)
+def relation_counted(sender, instance, created, raw=False, **kwargs):
+    # Строки, которые API пишет через RelationQuerySet, сигналов не
+    # отправляют: счётчики для них меняют представления. Здесь — save()
+    # из админки, shell и тестов.
+    if raw:
+        return
+    previous = getattr(instance, '_previous', None)
+    for model, attname, counter in RELATION_COUNTERS[sender]:
+        pk = getattr(instance, attname)
+        if created:
+            model.change_counters(pk, **{counter: 1})
+        elif previous is not None and getattr(previous, attname) != pk:
+            model.change_counters(getattr(previous, attname), **{counter: -1})
+            model.change_counters(pk, **{counter: 1})
+    if sender is not Subscription:
+        return
+    if previous is not None and (
+        previous.subscriber_id, previous.author_id
+    ) != (instance.subscriber_id, instance.author_id):
+        timeline.unfollow_many(previous.subscriber_id, [previous.author_id])
+        timeline.refill([previous.author_id])
+    if created or previous is not None:
+        timeline.follow(
+            instance.subscriber_id, User.objects.get(pk=instance.author_id)
+        )
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscription)
+def relation_uncounted(sender, instance, origin=None, **kwargs):
+    # В том числе каскадом вместе с пользователем: иначе у автора
+    # остаются подписчики, которых уже нет. Счётчики самого удаляемого
+    # объекта не трогаются.
+    for model, attname, counter in RELATION_COUNTERS[sender]:
+        pk = getattr(instance, attname)
+        if not is_deleted_with(origin, model, pk):
+            model.change_counters(pk, **{counter: -1})
+    if sender is not Subscription:
+        return
+    if not is_cascade(sender, origin):
+        timeline.unfollow_many(instance.subscriber_id, [instance.author_id])
+    if not is_deleted_with(origin, User, instance.author_id):
+        timeline.refill([instance.author_id])
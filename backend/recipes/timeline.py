@@ -0,0 +1,167 @@
+"""Лента подписок: рецепты авторов, на которых подписан пользователь.
+
+Рецепты обычных авторов раскладываются по лентам подписчиков при
+публикации (TimelineEntry), и лента читается по индексу
+(user, -pub_date, -recipe) без соединения с Subscription. У авторов,
+у которых подписчиков больше FEED_FANOUT_MAX_SUBSCRIBERS, рецепты не
+раскладываются: при чтении они добираются отдельным запросом по индексу
+(author, -pub_date, -id) и сливаются с записями ленты.
+
+Подписка добавляет в ленту последние FEED_BACKFILL_SIZE рецептов автора,
+отписка убирает его рецепты. Когда после отписки у автора остаётся ровно
+FEED_FANOUT_MAX_SUBSCRIBERS подписчиков, его рецепты перестают сливаться
+при чтении, поэтому последние FEED_BACKFILL_SIZE из них раскладываются по
+лентам всех подписчиков (refill). После изменения порога ленты пересобирает
+команда rebuild_timelines.
+"""
+from collections import defaultdict
+from itertools import islice
+
+from django.conf import settings
+from django.db.models import F, Q, Window
+from django.db.models.functions import RowNumber
+
+from .models import Recipe, Subscription, TimelineEntry, User
+
+BATCH_SIZE = 1000
+
+
+def is_fanned_out(author):
+    return author.subscribers_count <= settings.FEED_FANOUT_MAX_SUBSCRIBERS
+
+
+def fan_out(recipes):
+    """Раскладывает новые рецепты по лентам подписчиков их авторов."""
+    authors = User.objects.in_bulk({recipe.author_id for recipe in recipes})
+    fanned_out = defaultdict(list)
+    for recipe in recipes:
+        if is_fanned_out(authors[recipe.author_id]):
+            fanned_out[recipe.author_id].append(recipe)
+    if not fanned_out:
+        return
+    entries = (
+        TimelineEntry(
+            user_id=subscriber_id, recipe=recipe, pub_date=recipe.pub_date
+        )
+        for author_id, subscriber_id in Subscription.objects.filter(
+            author_id__in=fanned_out
+        ).values_list('author_id', 'subscriber_id').iterator()
+        for recipe in fanned_out[author_id]
+    )
+    while batch := list(islice(entries, BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def follow(user_id, author):
+    """Добавляет в ленту user_id последние рецепты author."""
+    follow_many(user_id, [author])
+
+
+def latest_recipes(author_ids):
+    """Последние FEED_BACKFILL_SIZE рецептов каждого из авторов."""
+    return Recipe.objects.filter(author_id__in=author_ids).annotate(
+        row_number=Window(
+            RowNumber(),
+            partition_by=F('author_id'),
+            order_by=(F('pub_date').desc(), F('id').desc()),
+        )
+    ).filter(row_number__lte=settings.FEED_BACKFILL_SIZE)
+
+
+def follow_many(user_id, authors):
+    """Добавляет в ленту user_id последние рецепты каждого из authors."""
+    author_ids = [author.pk for author in authors if is_fanned_out(author)]
+    if not author_ids:
+        return
+    TimelineEntry.objects.bulk_create(
+        (
+            TimelineEntry(user_id=user_id, recipe_id=recipe_id,
+                          pub_date=pub_date)
+            for recipe_id, pub_date in latest_recipes(author_ids).values_list(
+                'id', 'pub_date'
+            )
+        ),
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def refill(author_ids):
+    """Раскладывает рецепты авторов, опустившихся до порога, по лентам.
+
+    Вызывается после уменьшения subscribers_count в той же транзакции.
+    Счётчик меняется на единицу за раз, поэтому ровно порог видит только
+    та отписка, которая перевела автора через него. Рецепты, выложенные,
+    пока подписчиков было больше, в ленты не попадали и без этого
+    пропали бы из них, как только автор перестал сливаться при чтении.
+    """
+    author_ids = list(User.objects.filter(
+        pk__in=author_ids,
+        subscribers_count=settings.FEED_FANOUT_MAX_SUBSCRIBERS,
+    ).values_list('pk', flat=True))
+    if not author_ids:
+        return
+    recipes = defaultdict(list)
+    for author_id, recipe_id, pub_date in latest_recipes(
+        author_ids
+    ).values_list('author_id', 'id', 'pub_date'):
+        recipes[author_id].append((recipe_id, pub_date))
+    entries = (
+        TimelineEntry(user_id=subscriber_id, recipe_id=recipe_id,
+                      pub_date=pub_date)
+        for author_id, subscriber_id in Subscription.objects.filter(
+            author_id__in=author_ids
+        ).values_list('author_id', 'subscriber_id').iterator()
+        for recipe_id, pub_date in recipes[author_id]
+    )
+    while batch := list(islice(entries, BATCH_SIZE)):
+        TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def unfollow_many(user_id, author_ids):
+    TimelineEntry.objects.filter(
+        user_id=user_id, recipe__author_id__in=author_ids
+    ).delete()
+
+
+def before(position, date_field, id_field):
+    """Записи строго после position = (pub_date, id) в порядке ленты."""
+    if position is None:
+        return Q()
+    pub_date, pk = position
+    return Q(**{f'{date_field}__lt': pub_date}) | Q(
+        **{date_field: pub_date, f'{id_field}__lt': pk}
+    )
+
+
+def get_feed(user, limit, position=None):
+    """Страница ленты подписок user после position.
+
+    Возвращает id рецептов страницы и позицию её последней записи
+    (None, если дальше ничего нет).
+    """
+    items = list(
+        TimelineEntry.objects.filter(user=user)
+        .filter(before(position, 'pub_date', 'recipe_id'))
+        .order_by('-pub_date', '-recipe_id')
+        .values_list('pub_date', 'recipe_id')[:limit + 1]
+    )
+    # Авторы, чьи рецепты не раскладываются по лентам
+    merged_authors = list(User.objects.filter(
+        authors__subscriber=user,
+        subscribers_count__gt=settings.FEED_FANOUT_MAX_SUBSCRIBERS,
+    ).values_list('id', flat=True))
+    if merged_authors:
+        items = sorted(
+            set(items) | set(
+                Recipe.objects.filter(author_id__in=merged_authors)
+                .filter(before(position, 'pub_date', 'id'))
+                .order_by('-pub_date', '-id')
+                .values_list('pub_date', 'id')[:limit + 1]
+            ),
+            reverse=True,
+        )
+    if len(items) <= limit:
+        return [recipe_id for _, recipe_id in items], None
+    items = items[:limit]
+    return [recipe_id for _, recipe_id in items], items[-1]
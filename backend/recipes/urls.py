@@ -3,8 +3,10 @@ from django.urls import path
 from .views import recipe_short_link_redirect
 
 urlpatterns = [
+    # Обычно до маршрутизации не доходит: ссылки обслуживает
+    # ShortLinkMiddleware, маршрут нужен для reverse().
     path(
-        "s/<int:recipe_id>/",
+        "s/<str:code>/",
         recipe_short_link_redirect,
         name="recipe-short-link-redirect",
     ),
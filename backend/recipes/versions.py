@@ -0,0 +1,49 @@
+"""Версии наборов данных для ETag, ключей кэша и индексов в памяти.
+
+Версия — число в строке DataVersion, которое растёт после каждой
+транзакции, изменившей набор. Прочитать его — один поиск по первичному
+ключу, в отличие от COUNT и MAX по всей таблице.
+
+Версия RECIPES меняется при любом изменении, которое видно в ответах
+с рецептами: самих рецептов, их продуктов, авторов, изображений. Её
+увеличивают обработчики сигналов (recipes.signals) и код, который
+пишет в обход сигналов (update(), bulk_create). Версия INGREDIENTS —
+версия списка продуктов и индекса recipes.ingredient_index,
+RECIPE_DELETIONS меняется только при удалении рецептов (для кэша
+recipes.short_links).
+"""
+from functools import partial
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import DataVersion
+
+RECIPES = 'recipes'
+INGREDIENTS = 'ingredients'
+RECIPE_DELETIONS = 'recipe_deletions'
+
+
+def get_version(name):
+    return DataVersion.objects.filter(pk=name).values_list(
+        'version', flat=True
+    ).first() or 0
+
+
+def increment_version(name):
+    versions = DataVersion.objects.filter(pk=name)
+    if not versions.update(version=F('version') + 1):
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name)], ignore_conflicts=True
+        )
+        versions.update(version=F('version') + 1)
+
+
+def bump_version(name):
+    """Увеличивает версию после фиксации текущей транзакции.
+
+    Так новая версия не появляется раньше самих данных (иначе под ней
+    закэшировались бы старые), а строка версии не остаётся заблокированной
+    до конца транзакции и не выстраивает пишущие запросы в очередь.
+    """
+    transaction.on_commit(partial(increment_version, name))
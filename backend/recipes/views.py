@@ -1,10 +1,10 @@
-from django.shortcuts import redirect
-from rest_framework.exceptions import ValidationError
+from django.http import HttpResponseNotFound, HttpResponseRedirect
 
-from .models import Recipe
+from .short_links import resolve
 
 
-def recipe_short_link_redirect(request, recipe_id):
-    if not Recipe.objects.filter(id=recipe_id).exists():
-        raise ValidationError(f"Рецепт с id={recipe_id} не найден")
-    return redirect(f"/recipes/{recipe_id}/")
+def recipe_short_link_redirect(request, code):
+    recipe_id = resolve(code)
+    if recipe_id is None:
+        return HttpResponseNotFound(f"Рецепт по ссылке {code} не найден")
+    return HttpResponseRedirect(f"/recipes/{recipe_id}/")